@@ -0,0 +1,131 @@
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict
+
+
+class Rejected(Exception):
+    """The request was not admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Refills at `rate` tokens per second up to `burst`; each request spends its cost."""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Spend cost tokens and return 0, or return how long until cost tokens are available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost: float) -> None:
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class Ticket:
+    __slots__ = ('client', 'endpoint', 'cost', 'released')
+
+    def __init__(self, client: str, endpoint: str, cost: float):
+        self.client = client
+        self.endpoint = endpoint
+        self.cost = cost
+        self.released = False
+
+
+class AdmissionController:
+    """Decides up front whether an expensive request may run, instead of queueing it.
+
+    Two checks, both O(1) under one lock:
+    - a per-client token bucket (client_rate cost units per second, client_burst at most),
+      so one scripted client can't monopolise the server;
+    - a global in-flight budget: the summed cost of admitted requests that haven't
+      finished yet may not exceed inflight_budget.
+
+    Costs are weights per endpoint (a PDF stamp might cost 4, an ffmpeg merge 6).
+    A rejected request never waits, so the caller can answer 429 right away.
+    Limits are per process; with several workers the effective totals scale with them.
+    """
+
+    def __init__(self, inflight_budget: float = 16, client_rate: float = 1.0, client_burst: float = 20,
+                 busy_retry_after: float = 2.0, max_clients: int = 10000):
+        self.inflight_budget = inflight_budget
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.busy_retry_after = busy_retry_after
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self._inflight = 0.0
+        self._peak_inflight = 0.0
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {'admitted': 0, 'rate_limited': 0, 'overloaded': 0})
+
+    def admit(self, client: str, endpoint: str, cost: float) -> Ticket:
+        """Admit a request or raise Rejected. Call release() with the ticket when it finishes."""
+        # A single request can never cost more than the bucket or the budget can hold
+        cost = min(cost, self.client_burst, self.inflight_budget)
+        now = time.monotonic()
+        with self._lock:
+            counters = self._counters[endpoint]
+            bucket = self._bucket(client, now)
+            wait = bucket.take(cost, now)
+            if wait > 0:
+                counters['rate_limited'] += 1
+                raise Rejected('Too many requests from this client', wait)
+            if self._inflight + cost > self.inflight_budget:
+                # Don't charge the client for work the server refused
+                bucket.refund(cost)
+                counters['overloaded'] += 1
+                raise Rejected('Server is busy', self.busy_retry_after)
+            self._inflight += cost
+            self._peak_inflight = max(self._peak_inflight, self._inflight)
+            counters['admitted'] += 1
+        return Ticket(client, endpoint, cost)
+
+    def release(self, ticket: Ticket) -> None:
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._inflight = max(0.0, self._inflight - ticket.cost)
+
+    def _bucket(self, client: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst, now)
+            self._buckets[client] = bucket
+            # Forget the least recently seen clients; a returning one simply starts full
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'inflight': self._inflight,
+                'peakInflight': self._peak_inflight,
+                'inflightBudget': self.inflight_budget,
+                'clientRate': self.client_rate,
+                'clientBurst': self.client_burst,
+                'trackedClients': len(self._buckets),
+                'endpoints': {name: dict(counts) for name, counts in self._counters.items()},
+            }
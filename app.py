@@ -1,260 +1,368 @@
-from flask import Flask, render_template, request, jsonify, Response, send_from_directory
+from flask import Blueprint, Flask, current_app, request, jsonify, Response
 from flask_wtf.csrf import CSRFProtect
-import fitz
+import functools
 import os
 import tempfile
 import re
 import subprocess
-import html
 import uuid
 import time
 import threading
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 
-# ReportLab Imports
-from reportlab.platypus import BaseDocTemplate, Paragraph, Spacer, Frame, PageTemplate, Preformatted, Image
-from reportlab.platypus.tableofcontents import TableOfContents
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from docx import Document
-from docx.shared import Pt, Inches
-
-# Pygments, Matplotlib, yt-dlp, and Scraping libraries
-import matplotlib.pyplot as plt
-from youtube_downloader import YouTubeDownloader
-import requests
-import time
-try:
-    import yt_dlp
-except Exception:
-    yt_dlp = None
+from conversion_jobs import ConversionJobs
+from conversion_cache import ConversionCache
+from download_jobs import DownloadJobs
+from file_lifecycle import FileLifecycleManager
+from file_serving import FileServer, send_precompressed
+from media_store import MediaStore
+from state_backend import open_state_backend
+from progress_events import RECONNECT_MS, SSE_HEADERS, format_sse, sse_stream
+from doc_workers import DocumentTaskError, DocumentTaskTimeout, DocumentWorkerPool
+from admission import AdmissionController, Rejected
+from video_metadata import MetadataCache, media_url_key, video_cache_key
+from stream_merge import AUDIO_MIMETYPES, MergeBusy, StreamMerger, audio_container
+import document_ops
+import frontend_build
+import segmented_download
+import upstream
+
+# Heavy libraries (PyMuPDF, ReportLab, python-docx, matplotlib, yt-dlp, requests) are
+# imported inside the functions that use them, so a worker boots without paying for
+# features it has not served yet. benchmarks/import_time.py measures the difference.
+
+bp = Blueprint('luminar', __name__)
+csrf = CSRFProtect()
+
+# File lifecycle: idle files expire after CLEANUP_INTERVAL, and the least recently used
+# unpinned files are evicted early once the temp folder exceeds its byte quota.
+CLEANUP_INTERVAL = 180  # 3 minutes in seconds
 
-app = Flask(__name__)
-temp_dir = tempfile.mkdtemp()
-app.config['UPLOAD_FOLDER'] = temp_dir
-app.config['SECRET_KEY'] = 'luminar-secret-key-2025'
+class Services:
+    """The shared services of one app, built from its config by create_app().
 
-# File tracking for cleanup
-file_timestamps = {}  # filename -> last_access_time
-CLEANUP_INTERVAL = 180  # 3 minutes in seconds
+    Kept in app.extensions['luminar'] and looked up with services(), so each app (a
+    test's, say) has its own and building one never repoints another. Cheap: nothing
+    here starts a thread or loads a heavy library.
+    """
+
+    def __init__(self, app):
+        self.temp_dir = app.config['UPLOAD_FOLDER']
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+        # Job status, file access times and cache indexes live here so all workers agree on them.
+        # STATE_BACKEND=memory keeps them per-process (single worker only).
+        self.state_backend = open_state_backend(app.config['STATE_BACKEND'])
+        self.file_lifecycle = FileLifecycleManager(self.temp_dir, ttl=CLEANUP_INTERVAL,
+                                                   max_bytes=app.config['TEMP_DISK_QUOTA'],
+                                                   on_evict=lambda filename: self.conversion_jobs.forget(filename),
+                                                   backend=self.state_backend)
+
+        # Background conversion tracking: one shared future per notebook content hash, so polls,
+        # waiting routes and duplicate uploads all observe the same in-flight conversion.
+        self.conversion_jobs = ConversionJobs(max_workers=app.config['CONVERSION_WORKERS'], ttl=CLEANUP_INTERVAL,
+                                              backend=self.state_backend, claim_ttl=NBCONVERT_TIMEOUT + 60,
+                                              default_convert=bound_to_app(app, _convert_ipynb_to_pdf))
+
+        # Converted PDFs persist across restarts, keyed by notebook content and converter version
+        self.conversion_cache = ConversionCache(app.config['CONVERSION_CACHE_DIR'],
+                                                max_bytes=app.config['CONVERSION_CACHE_MAX_BYTES'],
+                                                backend=self.state_backend)
+
+        # PDF parsing, stamping, rasterizing and notes rendering run in worker processes,
+        # so a heavy document can't stall status polls and other requests on the GIL.
+        self.document_pool = DocumentWorkerPool(max_workers=app.config['DOC_WORKERS'],
+                                                timeout=app.config['DOC_TASK_TIMEOUT'],
+                                                memory_limit_mb=app.config['DOC_WORKER_MEMORY_MB'],
+                                                max_tasks_per_worker=app.config['DOC_WORKER_MAX_TASKS'])
+
+        # Expensive endpoints are admitted up front (per-client token bucket plus a global
+        # in-flight cost budget) and refused with 429 instead of queueing behind each other.
+        self.admission = AdmissionController(inflight_budget=app.config['ADMISSION_INFLIGHT_BUDGET'],
+                                             client_rate=app.config['ADMISSION_CLIENT_RATE'],
+                                             client_burst=app.config['ADMISSION_CLIENT_BURST'])
+
+        # Processed /video_download results, keyed by platform and video id. Entries expire
+        # before the signed media URLs inside them do.
+        self.video_metadata = MetadataCache(ttl=app.config['VIDEO_METADATA_TTL'], signed_urls=_media_format_urls)
+
+        # Video+audio merges are muxed by ffmpeg straight from the upstream streams to the
+        # client; at most FFMPEG_MAX_PROCESSES of them run at once per worker.
+        self.stream_merger = StreamMerger(max_processes=app.config['FFMPEG_MAX_PROCESSES'])
+
+        # /download_youtube downloads run in the background with byte progress, so a long
+        # download never holds a request thread.
+        self.download_jobs = DownloadJobs(max_workers=app.config['DOWNLOAD_WORKERS'], ttl=CLEANUP_INTERVAL,
+                                          backend=self.state_backend)
+
+        # One copy of each downloaded or merged video per format, shared by every request for
+        # it; the files live in temp_dir and age out through file_lifecycle like any other.
+        self.media_store = MediaStore(self.temp_dir, self.file_lifecycle, backend=self.state_backend)
+
+        # Temp files go out via sendfile, or are handed to nginx/Apache with FILE_OFFLOAD
+        self.file_server = FileServer(self.temp_dir, self.file_lifecycle, offload=app.config['FILE_OFFLOAD'],
+                                      offload_prefix=app.config['FILE_OFFLOAD_PREFIX'],
+                                      offload_hold=app.config['FILE_OFFLOAD_HOLD_SECONDS'])
+
+        self.cleanup_thread = None
+        self.cleanup_lock = threading.Lock()
+
+def services(app=None):
+    """The Services of app, by default the current one."""
+    return (app or current_app).extensions['luminar']
+
+def bound_to_app(app, fn):
+    """fn wrapped to run inside app's context, for job bodies that run on background threads."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return fn(*args, **kwargs)
+    return wrapper
 
 def track_file_access(filename):
-    """Track when a file was last accessed."""
-    if filename:
-        file_timestamps[filename] = time.time()
-
-def cleanup_aged_files():
-    """Remove files that haven't been accessed in CLEANUP_INTERVAL seconds."""
-    current_time = time.time()
-    files_to_remove = []
-    
-    for filename, last_access in list(file_timestamps.items()):
-        if current_time - last_access > CLEANUP_INTERVAL:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            try:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    print(f"\033[32m✓\033[0m Cleaned up aged file: {filename}")
-                files_to_remove.append(filename)
-            except Exception as e:
-                print(f"\033[33m⚠️\033[0m Could not remove aged file {filename}: {e}")
-    
-    for filename in files_to_remove:
-        del file_timestamps[filename]
+    """Track when a file was last accessed. Names outside the temp folder are ignored."""
+    svc = services()
+    if filename and svc.file_lifecycle.touch(filename):
+        # Keep the conversion job for this file alive as long as the file itself
+        svc.conversion_jobs.touch(filename)
+
+def send_tracked_file(directory, filename, **kwargs):
+    """Send a temp file with sendfile (or proxy offload), pinned until the transfer is handed off."""
+    return services().file_server.send(directory, filename, **kwargs)
 
 # Setup cleanup task
-def cleanup_task():
-    """Run cleanup periodically"""
+def cleanup_task(svc):
+    """Expire aged files as their deadlines come up (at least once a minute)"""
     while True:
-        cleanup_aged_files()
-        time.sleep(60)  # Check every minute
-
-cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
-cleanup_thread.start()
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-plt.switch_backend('agg')
-csrf = CSRFProtect(app)
-
-# --- UTILITY & CORE LOGIC FUNCTIONS ---
-dark_bg = colors.HexColor("#0A0A0A")
-white_text = colors.HexColor("#FFFFFF")
-green_accent = colors.HexColor("#00FF41")
-cyan_accent = colors.HexColor("#00D4FF")
+        svc.file_lifecycle.wait_for_next_expiry(max_wait=60)
+        svc.file_lifecycle.evict_expired()
+        svc.conversion_jobs.evict_expired()
+        svc.download_jobs.evict_expired()
 
-# File tracking for cleanup
-file_timestamps = {}  # filename -> last_access_time
-CLEANUP_INTERVAL = 180  # 3 minutes in seconds
+def start_background_tasks():
+    """Start the app's cleanup thread on its first request in each process.
 
-def track_file_access(filename):
-    """Track when a file was last accessed."""
-    if filename:
-        file_timestamps[filename] = time.time()
-
-def cleanup_aged_files():
-    """Remove files that haven't been accessed in CLEANUP_INTERVAL seconds."""
-    current_time = time.time()
-    files_to_remove = []
-    
-    for filename, last_access in list(file_timestamps.items()):
-        if current_time - last_access > CLEANUP_INTERVAL:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    Threads don't survive fork(), so starting it lazily gives every server
+    worker its own and keeps importing this module free of side effects.
+    """
+    svc = services()
+    if svc.cleanup_thread is not None and svc.cleanup_thread.is_alive():
+        return
+    with svc.cleanup_lock:
+        if svc.cleanup_thread is None or not svc.cleanup_thread.is_alive():
+            svc.cleanup_thread = threading.Thread(target=cleanup_task, args=(svc,), daemon=True)
+            svc.cleanup_thread.start()
+
+def admission_controlled(cost):
+    """Route decorator: run the view only if admission control accepts its cost.
+
+    cost is a number or a zero-argument callable evaluated per request. The
+    admitted cost stays in flight until the response has been fully sent.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            weight = cost() if callable(cost) else cost
+            # Released when the response closes, which may be after the app context is gone
+            admission = services().admission
             try:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    print(f"\033[32m✓\033[0m Cleaned up aged file: {filename}")
-                files_to_remove.append(filename)
-            except Exception as e:
-                print(f"\033[33m⚠️\033[0m Could not remove aged file {filename}: {e}")
-    
-    for filename in files_to_remove:
-        del file_timestamps[filename]
-
-def to_roman(n):
-    if not isinstance(n, int) or n <= 0: return str(n)
-    val = [1000, 900, 500, 400, 100, 90, 50, 40, 10, 9, 5, 4, 1]
-    syb = ["M", "CM", "D", "CD", "C", "XC", "L", "XL", "X", "IX", "V", "IV", "I"]
-    roman_num = ''
-    i = 0
-    while n > 0:
-        for _ in range(n // val[i]):
-            roman_num += syb[i]
-            n -= val[i]
-        i += 1
-    return roman_num
-
-def to_alpha(n, uppercase=True):
-    if not isinstance(n, int) or n <= 0: return str(n)
-    result = ""
-    start = 65 if uppercase else 97
-    while n > 0:
-        n, remainder = divmod(n - 1, 26)
-        result = chr(start + remainder) + result
-    return result
+                ticket = admission.admit(request.remote_addr or 'unknown', view.__name__, weight)
+            except Rejected as e:
+                response = jsonify({'error': f"{e.reason}. Please retry in {e.retry_after_header} seconds.",
+                                    'retryAfter': int(e.retry_after_header)})
+                response.status_code = 429
+                response.headers['Retry-After'] = e.retry_after_header
+                return response
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except Exception:
+                admission.release(ticket)
+                raise
+            response.call_on_close(lambda: admission.release(ticket))
+            return response
+        return wrapper
+    return decorator
+
+def _upload_cost():
+    # Notebooks start a conversion; other uploads are just written to disk
+    upload = request.files.get('file')
+    return 6 if upload and upload.filename.lower().endswith('.ipynb') else 1
+
+# --- UTILITY & CORE LOGIC FUNCTIONS ---
 
 def get_doc_stats(filepath):
     try:
-        doc = fitz.open(filepath)
-        page_count = len(doc)
-        text = "".join(page.get_text() for page in doc)
-        char_count = len(text)
-        word_count = len(text.split())
-        doc.close()
-        return {'pages': page_count, 'words': word_count, 'characters': char_count}
-    except Exception as e:
+        return services().document_pool.run(document_ops.get_doc_stats, filepath)
+    except DocumentTaskError as e:
         print(f"Could not get stats for {filepath}: {e}")
         return {'pages': 0, 'words': 0, 'characters': 0}
 
+NBCONVERT_TIMEOUT = 300
 
-# Background conversion tracking: map server_filename -> {'status': 'pending'|'done'|'failed', 'pdf_path': str}
-conversion_status = {}
-
-@app.route('/check_conversion_status/<filename>')
+@bp.route('/check_conversion_status/<filename>')
 def check_conversion_status(filename):
-    # Try direct lookup first (filename might be the original server-side name)
-    status = conversion_status.get(filename)
+    # filename may be the server-side upload name or the converted PDF basename
+    server_key, job = services().conversion_jobs.lookup(filename)
+    if job is None:
+        return jsonify({'status': 'unknown'})
+
+    status = job.snapshot()
+    if server_key != filename:
+        # expose the original server key too for convenience
+        status['serverFilename'] = server_key
+        # Track access to both original and converted files
+        track_file_access(server_key)
+        track_file_access(filename)
+    return jsonify(status)
 
-    # If not found, filename might be a pdf basename (e.g. converted file). Try reverse lookup.
-    if status is None and filename and filename.lower().endswith('.pdf'):
-        for k, v in conversion_status.items():
-            try:
-                if v and v.get('pdf_path') and os.path.basename(v.get('pdf_path')) == filename:
-                    status = dict(v)
-                    # expose the original server key too for convenience
-                    status['serverFilename'] = k
-                    # Track access to both original and converted files
-                    track_file_access(k)
-                    track_file_access(filename)
-                    break
-            except Exception:
-                continue
+@bp.route('/conversion_events/<filename>')
+def conversion_events(filename):
+    """Push conversion phase changes (queued, rendering, writing, done) over SSE.
 
-    # Fallback to unknown if still nothing
-    if status is None:
-        status = {'status': 'unknown'}
+    Each stream lasts at most STREAM_DURATION; the browser reconnects with Last-Event-ID.
+    """
+    job = services().conversion_jobs.get(filename)
+    if job is None:
+        return Response(format_sse({'status': 'unknown'}, retry=RECONNECT_MS), mimetype='text/event-stream',
+                        headers=SSE_HEADERS)
+    stream = sse_stream(job.snapshot, job.channel, lambda state: state.get('status') != 'pending',
+                        last_event_id=request.headers.get('Last-Event-ID'))
+    return Response(stream, mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@bp.route('/stats/admission')
+def admission_stats():
+    """Admission counters for monitoring: in-flight cost and admitted/rejected per endpoint."""
+    return jsonify(services().admission.stats())
+
+@bp.route('/stats/upstream')
+def upstream_stats():
+    """Per media host: circuit state, request and failure counts, error rate and latency."""
+    return jsonify(upstream.health.stats())
+
+def _render_notebook_native(src_path, pdf_output_path, progress=None):
+    """Fast path: render the notebook JSON straight to PDF. Returns True on success."""
+    try:
+        from notebook_renderer import render_notebook_to_pdf
+        services().document_pool.run(render_notebook_to_pdf, src_path, pdf_output_path, progress=progress)
+        return os.path.exists(pdf_output_path)
+    except Exception as e:
+        print(f"Native notebook render failed for {src_path}, falling back to nbconvert: {e}")
+        return False
+
+def _converter_version(engine):
+    """Version tag for cache keys, so upgrading a converter invalidates its cached PDFs."""
+    if engine == 'native':
+        from notebook_renderer import RENDERER_VERSION
+        return RENDERER_VERSION
+    try:
+        from importlib.metadata import version
+        return f"nbconvert-{version('nbconvert')}"
+    except Exception:
+        return 'nbconvert'
+
+def _cache_fetch(engine, src_path, pdf_output_path):
+    """Return (hit, cache_key) for this notebook's content under the given engine."""
+    try:
+        cache_key = services().conversion_cache.key_for(src_path, _converter_version(engine))
+        return services().conversion_cache.get(cache_key, pdf_output_path), cache_key
+    except Exception as e:
+        print(f"\033[33m⚠️\033[0m Conversion cache unavailable for {os.path.basename(src_path)}: {e}")
+        return False, None
 
-    # Ensure frontend-friendly fields
-    if isinstance(status, dict) and status.get('pdf_path'):
+def _cache_store(cache_keys, pdf_path):
+    for cache_key in cache_keys:
+        if not cache_key:
+            continue
         try:
-            status = dict(status)
-            status['pdf_basename'] = os.path.basename(status.get('pdf_path'))
-        except Exception:
-            pass
-    return jsonify(status)
+            services().conversion_cache.put(cache_key, pdf_path)
+        except Exception as e:
+            print(f"\033[33m⚠️\033[0m Could not cache converted PDF {os.path.basename(pdf_path)}: {e}")
 
-def _convert_ipynb_to_pdf_async(src_path, timeout=120):
-    """Run nbconvert to webpdf in a background thread and update conversion_status.
+def _convert_ipynb_to_pdf(job, renderer=None, timeout=NBCONVERT_TIMEOUT):
+    """Convert job.src_path to PDF on a conversion worker and return the PDF path.
 
-    This implementation uses Popen so we can provide a simple time-based progress
-    estimate while nbconvert runs. nbconvert does not expose a machine-readable
-    progress API here, so we keep a lightweight heuristic: while the process is
-    running we increment progress periodically and then set status to done on
-    success or failed on error.
+    The persistent conversion cache is checked first. Otherwise the native renderer is
+    tried and reports its own rendering/writing phases; nbconvert webpdf only exposes
+    start and exit, so it is reported as rendering until the process ends. Raises on
+    failure, which resolves the job's future as failed.
     """
-    server_key = os.path.basename(src_path)
+    src_path = job.src_path
     pdf_output_path = os.path.splitext(src_path)[0] + '.pdf'
-    try:
-        # Mark started
-        conversion_status[server_key] = {'status': 'pending', 'pdf_path': None, 'progress': 0}
-
-        # Start nbconvert as a subprocess and poll
-        proc = subprocess.Popen(['jupyter', 'nbconvert', '--to', 'webpdf', '--allow-chromium-download', src_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        # Simple progress estimator: ramp from 5 -> 85 while running
-        progress = 5
-        conversion_status[server_key]['progress'] = progress
-
-        # Poll process and update progress
-        while proc.poll() is None:
-            time.sleep(1)
-            # increase progress slowly but cap below 95
-            progress = min(85, progress + 5)
-            conversion_status[server_key]['progress'] = progress
-
-        # Process finished, check return code
-        rc = proc.returncode
-        if rc == 0 and os.path.exists(pdf_output_path):
-            conversion_status[server_key] = {'status': 'done', 'pdf_path': pdf_output_path, 'progress': 100}
-            try:
-                pdf_basename = os.path.basename(pdf_output_path)
-                conversion_status[server_key]['pdf_basename'] = pdf_basename
-                # Track both original and converted files
-                track_file_access(server_key)
-                track_file_access(pdf_basename)
-            except Exception:
-                pass
-            print(f"Background conversion completed: {pdf_output_path}")
-        else:
-            # grab stderr for diagnostics
-            try:
-                _, err = proc.communicate(timeout=1)
-                print(err.decode('utf-8', errors='ignore'))
-            except Exception:
-                pass
-            conversion_status[server_key] = {'status': 'failed', 'pdf_path': None, 'progress': 0}
-            print(f"Background conversion failed for {src_path} (rc={rc})")
-    except Exception as e:
-        conversion_status[server_key] = {'status': 'failed', 'pdf_path': None, 'progress': 0}
-        print(f"Background nbconvert failed for {src_path}: {e}")
+    engine = (renderer or current_app.config['NOTEBOOK_RENDERER']).lower()
+
+    hit, engine_key = _cache_fetch(engine, src_path, pdf_output_path)
+    if hit:
+        track_file_access(job.server_filename)
+        track_file_access(os.path.basename(pdf_output_path))
+        print(f"Conversion cache hit: {pdf_output_path}")
+        return pdf_output_path
+
+    if engine == 'native' and _render_notebook_native(src_path, pdf_output_path, job.set_phase):
+        _cache_store([engine_key], pdf_output_path)
+        track_file_access(job.server_filename)
+        track_file_access(os.path.basename(pdf_output_path))
+        print(f"Native notebook render completed: {pdf_output_path}")
+        return pdf_output_path
+
+    # Native rendering failed or is disabled: use the nbconvert result, cached or fresh.
+    # It is also stored under the native key so the failing native attempt isn't repeated.
+    nbconvert_key = engine_key
+    if engine != 'nbconvert':
+        hit, nbconvert_key = _cache_fetch('nbconvert', src_path, pdf_output_path)
+        if hit:
+            _cache_store([engine_key], pdf_output_path)
+            track_file_access(job.server_filename)
+            track_file_access(os.path.basename(pdf_output_path))
+            print(f"Conversion cache hit: {pdf_output_path}")
+            return pdf_output_path
 
+    # Start nbconvert as a subprocess
+    proc = subprocess.Popen(['jupyter', 'nbconvert', '--to', 'webpdf', '--allow-chromium-download', src_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-def get_pdf_for_serverfile(server_filename, input_filepath, wait_seconds=5, sync_timeout=60):
+    job.set_phase('rendering')
+    try:
+        _, err = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise RuntimeError(f"nbconvert timed out after {timeout}s")
+
+    job.set_phase('writing')
+    rc = proc.returncode
+    if rc == 0 and os.path.exists(pdf_output_path):
+        _cache_store({nbconvert_key, engine_key}, pdf_output_path)
+        # Track both original and converted files
+        track_file_access(job.server_filename)
+        track_file_access(os.path.basename(pdf_output_path))
+        print(f"Background conversion completed: {pdf_output_path}")
+        return pdf_output_path
+
+    # stderr for diagnostics
+    print(err.decode('utf-8', errors='ignore'))
+    print(f"Background conversion failed for {src_path} (rc={rc})")
+    raise RuntimeError(f"nbconvert failed (rc={rc})")
+
+def start_notebook_conversion(server_filename, src_path, renderer=None):
+    """Start (or join) the single conversion for this notebook's content."""
+    convert = bound_to_app(current_app._get_current_object(), lambda job: _convert_ipynb_to_pdf(job, renderer))
+    return services().conversion_jobs.submit(server_filename, src_path, convert)
+
+
+def get_pdf_for_serverfile(server_filename, input_filepath, timeout=60, renderer=None):
     """Return a PDF path for the given server_filename.
 
     Logic:
       - If the uploaded file is already a PDF, return it.
-      - If conversion_status shows a done PDF, return that path.
-      - If conversion_status shows pending, wait up to wait_seconds for it to finish.
-      - If still not available, try a synchronous nbconvert attempt (sync_timeout).
+      - If a conversion job for this file (or its PDF basename) is done, return its PDF.
+      - Otherwise join the in-flight conversion for this content, starting one if none
+        exists, and block on it for up to timeout seconds. A second conversion of the
+        same notebook is never started while one is running.
       - Return None if no PDF could be obtained.
     """
     # If caller already passed a PDF basename or filename, prefer that file if it exists
     if server_filename and server_filename.lower().endswith('.pdf'):
-        candidate = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(server_filename))
+        candidate = os.path.join(current_app.config['UPLOAD_FOLDER'], os.path.basename(server_filename))
         if os.path.exists(candidate):
             return candidate
 
@@ -262,384 +370,74 @@ def get_pdf_for_serverfile(server_filename, input_filepath, wait_seconds=5, sync
     if server_filename and os.path.exists(input_filepath) and server_filename.lower().endswith('.pdf'):
         return input_filepath
 
-    # Look up conversion status by the exact server_filename key
-    status = conversion_status.get(server_filename)
+    job = services().conversion_jobs.get(os.path.basename(server_filename))
+    if job is not None and job.status == 'done' and os.path.exists(job.pdf_path):
+        return job.pdf_path
 
-    # If not found, it's possible the caller passed the converted PDF basename. Try reverse lookup.
-    if status is None and server_filename and server_filename.lower().endswith('.pdf'):
-        for k, v in conversion_status.items():
-            try:
-                if v and v.get('pdf_path') and os.path.basename(v.get('pdf_path')) == os.path.basename(server_filename):
-                    status = v
-                    break
-            except Exception:
-                continue
-    if status and status.get('status') == 'done' and status.get('pdf_path') and os.path.exists(status.get('pdf_path')):
-        return status.get('pdf_path')
-
-    # If pending, wait briefly
-    if status and status.get('status') == 'pending':
-        waited = 0.0
-        while waited < wait_seconds:
-            time.sleep(0.5)
-            waited += 0.5
-            status = conversion_status.get(server_filename)
-            if status and status.get('status') == 'done' and status.get('pdf_path') and os.path.exists(status.get('pdf_path')):
-                return status.get('pdf_path')
-
-    # Try synchronous conversion as a fallback
-    pdf_output_path = os.path.splitext(input_filepath)[0] + '.pdf'
-    try:
-        # Mark pending so frontend knows conversion started
-        conversion_status[server_filename] = {'status': 'pending', 'pdf_path': None, 'progress': 0}
-        subprocess.run(['jupyter', 'nbconvert', '--to', 'webpdf', '--allow-chromium-download', input_filepath], check=True, timeout=sync_timeout)
-        if os.path.exists(pdf_output_path):
-            conversion_status[server_filename] = {'status': 'done', 'pdf_path': pdf_output_path, 'progress': 100}
-            return pdf_output_path
-    except Exception as e:
-        print(f"Synchronous nbconvert fallback failed for {input_filepath}: {e}")
-        conversion_status[server_filename] = {'status': 'failed', 'pdf_path': None, 'progress': 0}
+    if not input_filepath.lower().endswith('.ipynb') or not os.path.exists(input_filepath):
+        return None
 
+    # Join the shared job (submit returns the running one if there is one)
+    job = start_notebook_conversion(server_filename, input_filepath, renderer)
+    pdf_path = job.wait(timeout)
+    if pdf_path and os.path.exists(pdf_path):
+        return pdf_path
+    if job.status == 'pending':
+        print(f"Conversion of {server_filename} still running after {timeout}s")
     return None
 
-def extract_highlights(pdf_path):
-    from highlight_extractor import HighlightExtractor
-    doc = fitz.open(pdf_path)
-    extractor = HighlightExtractor(doc)
-    highlights = extractor.extract_highlights()
-
-    # Process pages in order and collect highlights with page context
-    for page_num, page in enumerate(doc):
-        page_highlights = []
-        for annot in page.annots():
-            if annot.type[1] == "Highlight":
-                rect = annot.rect
-                words = page.get_text("words", clip=rect)
-                if not words: continue
-
-                # Sort words by their position (left to right, top to bottom)
-                words_sorted = sorted(words, key=lambda w: (round(w[3], 1), w[0]))  # Sort by y_pos, then x_pos
-
-                # Group words into lines based on y-position
-                lines = {}
-                for word in words_sorted:
-                    y_pos = round(word[3], 1)
-                    if y_pos not in lines:
-                        lines[y_pos] = []
-                    lines[y_pos].append(word[4])
-
-                # Process lines in reading order (top to bottom)
-                for y_pos in sorted(lines.keys()):
-                    line_text = ' '.join(lines[y_pos]).strip()
-                    if not line_text: continue
-
-                    # Add page context to maintain document order
-                    highlight_data = {
-                        'text': line_text,
-                        'page': page_num + 1,
-                        'y_pos': y_pos
-                    }
-                    page_highlights.append(highlight_data)
-
-        # Sort page highlights by vertical position and add to main list
-        page_highlights.sort(key=lambda h: h['y_pos'])
-        for highlight in page_highlights:
-            line_text = highlight['text']
-
-            # Improved categorization logic
-            category = categorize_highlight(line_text)
-            highlights.append((category, line_text))
-
-    doc.close()
-    return highlights
-
-def categorize_highlight(text):
-    """Improved categorization logic for highlights"""
-    text = text.strip()
-
-    # Check for headings first (most specific)
-    if re.match(r'^(Chapter|Section|Topic|Lesson|Module|Unit|Part)\s+\d+', text, re.IGNORECASE):
-        return 'heading'
-    if re.match(r'^(AIM:|Objective:|Goal:|Learning Objective:|Key Concept:)', text, re.IGNORECASE):
-        return 'heading'
-    if len(text) < 80 and text.istitle() and not any(char in text for char in '.,!?;:'):
-        return 'heading'
-
-    # Check for code (programming languages)
-    code_keywords = [
-        # Python
-        r'\b(def|class|import|from|if|elif|else|for|while|try|except|with|as|lambda|return|yield)\b',
-        # Java/JavaScript
-        r'\b(public|private|protected|static|void|int|String|function|var|let|const|class|interface)\b',
-        # C/C++/C#
-        r'\b(int|char|float|double|void|struct|class|public|private|protected|static)\b',
-        # SQL
-        r'\b(SELECT|INSERT|UPDATE|DELETE|CREATE|DROP|ALTER|FROM|WHERE|JOIN|GROUP BY|ORDER BY)\b',
-        # General programming
-        r'\b(print|console\.log|System\.out\.println)\b'
-    ]
-
-    code_indicators = [
-        r'[{}();=<>]',  # Common programming symbols
-        r'\[.*\]',      # Array/list access
-        r'\(.*\)\s*{',  # Function definitions
-        r'import\s+.*', # Import statements
-        r'#include',    # C/C++ includes
-    ]
-
-    for keyword in code_keywords:
-        if re.search(keyword, text, re.IGNORECASE):
-            return 'code'
-
-    for indicator in code_indicators:
-        if re.search(indicator, text):
-            return 'code'
-
-    # Check for mathematical expressions
-    math_patterns = [
-        r'[+\-×÷=≠≈≤≥∞∑∫√∛∜∂∇∆∅∈∉⊂⊃∪∩∧∨¬⇒⇔∀∃∄]',  # Mathematical symbols
-        r'\b(sin|cos|tan|log|ln|exp|sqrt|pi|e|alpha|beta|gamma|delta)\b',  # Math functions/constants
-        r'\d+\s*[+\-×÷=]\s*\d+',  # Simple arithmetic
-        r'\b\d+\^\d+\b',  # Exponents
-        r'\b\d+/\d+\b',   # Fractions
-        r'\(\d+\)',       # Parenthesized numbers
-    ]
-
-    for pattern in math_patterns:
-        if re.search(pattern, text):
-            return 'math'
-
-    # Check for lists and bullet points
-    if re.match(r'^[-•*]\s', text):
-        return 'list_item'
-
-    # Check for numbered lists
-    if re.match(r'^\d+[\.)]\s', text):
-        return 'list_item'
-
-    # Check for questions
-    if text.endswith('?') or text.startswith(('What', 'How', 'Why', 'When', 'Where', 'Who')):
-        return 'question'
-
-    # Check for important terms or definitions
-    if ':' in text and len(text.split(':')[0].strip()) < 30:
-        return 'definition'
-
-    # Default to regular text
-    return 'point'
-
-def create_modern_pdf(highlights, output_path):
-    left_margin, right_margin, top_margin, bottom_margin = (0.75*inch,) * 4
-
-    class ModernDocTemplate(BaseDocTemplate):
-        def __init__(self, filename, **kw):
-            super().__init__(filename, **kw)
-            frame = Frame(left_margin, bottom_margin, self.width, self.height, id='content_frame')
-            template = PageTemplate(id='main', frames=[frame], onPage=self.page_template)
-            self.addPageTemplates([template])
-
-        def page_template(self, canvas, doc):
-            canvas.saveState()
-            # Clean white background
-            canvas.setFillColor(colors.white)
-            canvas.rect(0, 0, self.pagesize[0], self.pagesize[1], fill=1)
-
-            # Modern header with Hephaestus branding
-            canvas.setFillColor(colors.HexColor("#4a90e2"))  # Professional blue
-            canvas.setFont('Helvetica-Bold', 12)
-            canvas.drawCentredString(self.pagesize[0]/2, self.pagesize[1] - 0.5*inch, "Hephaestus")
-
-            # Clean page number
-            canvas.setFillColor(colors.gray)
-            canvas.setFont('Helvetica', 9)
-            canvas.drawCentredString(self.pagesize[0]/2, 0.5*inch, f"Page {doc.page}")
-            canvas.restoreState()
-
-    doc = ModernDocTemplate(output_path, pagesize=letter)
-    styles = getSampleStyleSheet()
-
-    # Modern, clean styles
-    styles.add(ParagraphStyle(
-        name='ModernHeading',
-        fontName='Helvetica-Bold',
-        fontSize=16,
-        textColor=colors.HexColor("#2c3e50"),  # Dark blue-gray
-        alignment=TA_CENTER,
-        spaceAfter=15,
-        leading=20
-    ))
-
-    styles.add(ParagraphStyle(
-        name='ModernBody',
-        fontName='Helvetica',
-        fontSize=12,
-        textColor=colors.black,
-        spaceAfter=10,
-        leading=16,
-        firstLineIndent=0
-    ))
-
-    styles.add(ParagraphStyle(
-        name='ModernCode',
-        fontName='Courier',
-        fontSize=11,
-        textColor=colors.HexColor("#2c3e50"),
-        backColor=colors.HexColor("#f8f9fa"),  # Light gray background
-        borderColor=colors.HexColor("#dee2e6"),
-        borderWidth=1,
-        borderPadding=8,
-        leading=14,
-        spaceAfter=12
-    ))
-
-    story = []
-
-    # Add title
-    title = Paragraph("Study Notes", styles['ModernHeading'])
-    story.append(title)
-    story.append(Spacer(1, 20))
-
-    # Process highlights without table of contents
-    for item_type, text in highlights:
-        if item_type == 'heading':
-            p = Paragraph(text, styles['ModernHeading'])
-            story.append(p)
-        elif item_type == 'code':
-            p = Preformatted(text, styles['ModernCode'])
-            story.append(p)
-        elif item_type == 'math':
-            try:
-                fig = plt.figure(figsize=(6, 1), facecolor='white')
-                fig.text(0.5, 0.5, f'${text}$', ha='center', va='center', fontsize=20, color='black')
-                img_path = os.path.join(temp_dir, f'math_{hash(text)}.png')
-                plt.savefig(img_path, transparent=True, bbox_inches='tight', pad_inches=0.1)
-                plt.close(fig)
-                story.append(Image(img_path, width=4*inch, height=0.5*inch))
-            except Exception:
-                story.append(Paragraph(text, styles['ModernBody']))
-        else:
-            # Clean bullet points
-            p_text = f'<bullet color="#4a90e2">•</bullet> {html.escape(text)}'
-            story.append(Paragraph(p_text, styles['ModernBody']))
-
-        story.append(Spacer(1, 8))
-
-    doc.build(story)
-
-def create_docx_from_highlights(highlights, output_path):
-    doc = Document()
-    styles = doc.styles
-    if 'Normal' in styles:
-        styles['Normal'].font.name = 'Calibri'
-        styles['Normal'].font.size = Pt(11)
-
-    # Title
-    title = doc.add_paragraph()
-    run = title.add_run('Study Notes')
-    run.bold = True
-    run.font.size = Pt(18)
-
-    for item_type, text in highlights:
-        if item_type == 'heading':
-            p = doc.add_paragraph()
-            r = p.add_run(text)
-            r.bold = True
-            r.font.size = Pt(14)
-        elif item_type == 'code':
-            p = doc.add_paragraph()
-            r = p.add_run(text)
-            r.font.name = 'Courier New'
-            r.font.size = Pt(10)
-        else:
-            p = doc.add_paragraph('• ' + text)
-            p_format = p.paragraph_format
-            p_format.space_after = Pt(6)
-    doc.save(output_path)
-
-def create_docx_from_pdf(pdf_path: str, docx_output_path: str) -> None:
-    try:
-        pdf = fitz.open(pdf_path)
-        doc = Document()
-        for page in pdf:
-            pix = page.get_pixmap(dpi=144)
-            img_path = os.path.join(temp_dir, f"page_{uuid.uuid4()}.png")
-            pix.save(img_path)
-            doc.add_picture(img_path, width=Inches(6.5))
-        doc.save(docx_output_path)
-    except Exception as e:
-        print(f"Failed to create DOCX from PDF: {e}")
-
-def add_header_footer_to_pdf(input_pdf_path, output_filepath, headers, footers, start_page_num, page_num_placement, page_num_format, overlap_resolution, margin_size, chapter_num, page_num_enabled, hf_enabled):
-    input_doc = fitz.open(input_pdf_path)
-    output_doc = fitz.open()
-    header_y_pos = letter[1] - 0.5*inch
-    footer_y_pos = 0.5*inch
-    hf_x_margin = 0.5*inch
-    # Default to narrow margins (0.1 inch) without user selection
-    content_margin = 0.1*inch
-    total_pages = len(input_doc)
-    last_page_num = start_page_num + total_pages - 1
-    page_num_area, page_num_pos = page_num_placement.split('-')
-    for i, page in enumerate(input_doc):
-        temp_headers = headers.copy()
-        temp_footers = footers.copy()
-        new_page = output_doc.new_page(width=page.rect.width, height=page.rect.height)
-        packet = BytesIO()
-        can = canvas.Canvas(packet, pagesize=(page.rect.width, page.rect.height))
-        can.setFont('Helvetica', 9)
-        current_page_num = start_page_num + i
-        page_num_str = ""
-        if page_num_enabled:
-            format_map = { 'roman_lower': to_roman(current_page_num).lower(), 'roman_upper': to_roman(current_page_num), 'alpha_lower': to_alpha(current_page_num, False), 'alpha_upper': to_alpha(current_page_num), 'dash_x_dash': f"- {current_page_num} -", 'page_x': f"Page {current_page_num}", 'page_x_of_n': f"Page {current_page_num} of {last_page_num}", 'book_style': f"{chapter_num}-{current_page_num}", }
-            page_num_str = format_map.get(page_num_format, str(current_page_num))
-            target_dict = temp_headers if page_num_area == 'header' else temp_footers
-            pos_key = page_num_pos
-            if target_dict.get(pos_key):
-                if overlap_resolution == 'before': target_dict[pos_key] = f"{page_num_str} {target_dict[pos_key]}"
-                else: target_dict[pos_key] = f"{target_dict[pos_key]} {page_num_str}"
-                page_num_str = ""
-        if hf_enabled:
-            can.drawString(hf_x_margin, header_y_pos, temp_headers.get('left', ''))
-            can.drawCentredString(page.rect.width / 2, header_y_pos, temp_headers.get('center', ''))
-            can.drawRightString(page.rect.width - hf_x_margin, header_y_pos, temp_headers.get('right', ''))
-            can.drawString(hf_x_margin, footer_y_pos, temp_footers.get('left', ''))
-            can.drawCentredString(page.rect.width / 2, footer_y_pos, temp_footers.get('center', ''))
-            can.drawRightString(page.rect.width - hf_x_margin, footer_y_pos, temp_footers.get('right', ''))
-        if page_num_str:
-            y_pos = header_y_pos if page_num_area == 'header' else footer_y_pos
-            if page_num_pos == 'left': can.drawString(hf_x_margin, y_pos, page_num_str)
-            elif page_num_pos == 'right': can.drawRightString(page.rect.width - hf_x_margin, y_pos, page_num_str)
-            else: can.drawCentredString(page.rect.width / 2, y_pos, page_num_str)
-        can.save()
-        packet.seek(0)
-        overlay_doc = fitz.open("pdf", packet.read())
-        new_page.show_pdf_page(new_page.rect, overlay_doc, 0)
-        content_rect = fitz.Rect(content_margin, content_margin, page.rect.width - content_margin, page.rect.height - content_margin)
-        new_page.show_pdf_page(content_rect, input_doc, i)
-    output_doc.save(output_filepath)
-    output_doc.close()
-    input_doc.close()
-
 # --- FLASK ROUTES ---
-@app.route('/')
+@bp.route('/')
 def home():
-    return send_from_directory('templates', 'index.html')
-
-@app.route('/temp/<path:filename>')
+    # The prebuilt page (python frontend_build.py) loads one precompiled bundle; without it
+    # the source page compiles its JSX in the browser
+    dist = os.path.join(current_app.static_folder, 'dist')
+    if os.path.exists(os.path.join(dist, 'index.html')):
+        return send_precompressed(dist, 'index.html')
+    return Response(frontend_build.dev_page(), mimetype='text/html')
+
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+    """Content-hashed bundles from the frontend build."""
+    if filename in ('index.html', 'manifest.json'):
+        return "Not found", 404
+    return send_precompressed(os.path.join(current_app.static_folder, 'dist'), filename, immutable=True)
+
+@bp.route('/temp/<path:filename>')
 def serve_temp_file(filename):
     force_download = request.args.get('download') is not None or request.args.get('filename') is not None
     download_name = request.args.get('filename')
+    # ?v=<version> (see temp_url) names the content, so it can be cached for good
+    immutable = bool(request.args.get('v')) and request.args.get('v') == services().file_server.version(filename)
     
     # Track file access
     track_file_access(filename)
     
     try:
-        return send_from_directory(temp_dir, filename, as_attachment=force_download, download_name=download_name)
+        return send_tracked_file(services().temp_dir, filename, as_attachment=force_download, download_name=download_name,
+                                 immutable=immutable)
     except TypeError:
-        return send_from_directory(temp_dir, filename, as_attachment=force_download)
+        return send_tracked_file(services().temp_dir, filename, as_attachment=force_download, immutable=immutable)
+
+def optimize_output_pdf(path):
+    """Compact (and, if enabled, linearize) a generated PDF. Returns the size report, or None if it failed."""
+    try:
+        report = services().document_pool.run(document_ops.optimize_pdf, path, current_app.config['PDF_LINEARIZE'])
+    except DocumentTaskError as e:
+        # The unoptimized file is still complete and valid
+        print(f"\033[33m⚠️\033[0m Could not optimize {os.path.basename(path)}: {e}")
+        return None
+    print(f"\033[32m✓\033[0m Optimized {os.path.basename(path)}: {report['before'] / 1024:.0f} KB -> "
+          f"{report['after'] / 1024:.0f} KB{' (linearized)' if report['linearized'] else ''}")
+    return report
+
+def temp_url(filename):
+    """Versioned /temp URL for an output file: repeat views revalidate or hit the browser cache."""
+    version = services().file_server.version(filename)
+    return f'/temp/{filename}?v={version}' if version else f'/temp/{filename}'
 
 @csrf.exempt
-@app.route('/download_youtube', methods=['POST', 'GET'])
+@bp.route('/download_youtube', methods=['POST', 'GET'])
 def download_youtube():
     try:
         if request.method == 'POST':
@@ -657,24 +455,151 @@ def download_youtube():
             download_id = request.args.get('download_id')
             if not url or not download_id:
                 return jsonify({'error': 'Missing parameters'}), 400
-            # Download logic
-            from smart_youtube_downloader import SmartYouTubeDownloader
-            api_key = os.getenv('YOUTUBE_API_KEY')
-            downloader = SmartYouTubeDownloader(api_key=api_key)
-            output_dir = app.config['UPLOAD_FOLDER']
-            try:
-                info = downloader.download_video(url, output_path=output_dir)
-                file_path = info.get('file_path')
-                if not file_path or not os.path.exists(file_path):
-                    return jsonify({'missingOutput': True, 'error': 'Output file missing. Please re-upload and try again.'}), 404
-                track_file_access(os.path.basename(file_path))
-                return send_from_directory(output_dir, os.path.basename(file_path), as_attachment=True)
-            except Exception as e:
-                return jsonify({'error': str(e)}), 500
+            # Start (or join) a background download and answer right away; the client
+            # follows it on the events/status endpoints and then fetches the file.
+            job = services().download_jobs.start(download_id, video_cache_key(url), url,
+                                                 bound_to_app(current_app._get_current_object(), _download_youtube_media))
+            return jsonify(download_status_payload(download_id, job.snapshot())), 202
     except Exception as e:
         return jsonify({'error': f'Failed to process download request: {str(e)}'}), 500
+
+def _download_youtube_media(job):
+    """Download job body: the media store copy of the video, downloaded only if no request got it yet."""
+    from smart_youtube_downloader import SmartYouTubeDownloader
+    downloader = SmartYouTubeDownloader(api_key=os.getenv('YOUTUBE_API_KEY'))
+    try:
+        # Used as the download name; the preview just looked it up, so this is a cache hit
+        job.set_title(downloader.get_preview_info(job.url).get('title'))
+    except Exception as e:
+        print(f"\033[33m⚠️\033[0m Could not look up the title of {job.url}: {e}")
+    filename = services().media_store.fetch(video_cache_key(job.url), 'best',
+                                            lambda part_stem: _download_youtube_to(downloader, job, part_stem))
+    return os.path.join(services().temp_dir, filename)
+
+def _download_youtube_to(downloader, job, part_stem):
+    """Download job.url to part_stem + extension: pytube first, yt-dlp if pytube can't fetch it."""
+    try:
+        info = downloader.download_video(job.url, output_path=services().temp_dir, progress=job.report,
+                                         filename_stem=os.path.basename(part_stem))
+        if info.get('file_path') and os.path.exists(info['file_path']):
+            return info['file_path']
+    except Exception as e:
+        print(f"\033[33m⚠️\033[0m pytube download failed for {job.url}, trying yt-dlp: {e}")
+
+    import yt_dlp
+    def hook(d):
+        if d.get('status') == 'downloading':
+            job.report(d.get('downloaded_bytes') or 0, d.get('total_bytes') or d.get('total_bytes_estimate'))
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        # A single progressive file, so no ffmpeg merge is needed
+        'format': 'best[ext=mp4][acodec!=none][vcodec!=none]/best',
+        'outtmpl': part_stem + '.%(ext)s',
+        'progress_hooks': [hook],
+        'concurrent_fragment_downloads': segmented_download.CONNECTIONS,
+        'socket_timeout': upstream.EXTRACTOR_TIMEOUT,
+        'retries': upstream.RETRIES,
+        'fragment_retries': upstream.RETRIES,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(job.url, download=True)
+        return ydl.prepare_filename(info)
+
+def download_status_payload(download_id, status):
+    """Job status plus the URLs the client uses to follow and collect it."""
+    payload = dict(status, downloadId=download_id,
+                   statusUrl=f'/download_youtube/status/{download_id}',
+                   eventsUrl=f'/download_youtube/events/{download_id}')
+    if status.get('status') == 'done':
+        payload['fileUrl'] = f'/download_youtube/file/{download_id}'
+    return payload
+
+@bp.route('/download_youtube/status/<download_id>')
+def download_youtube_status(download_id):
+    status = services().download_jobs.status(download_id)
+    if status is None:
+        return jsonify({'status': 'unknown', 'downloadId': download_id}), 404
+    return jsonify(download_status_payload(download_id, status))
+
+@bp.route('/download_youtube/events/<download_id>')
+def download_youtube_events(download_id):
+    """Push byte progress (queued, downloading, done/failed) over SSE.
+
+    Streams are short (see conversion_events); the browser reconnects with Last-Event-ID.
+    """
+    job = services().download_jobs.get(download_id)
+    if job is None:
+        # Unknown here, or running in another worker: send one snapshot; the reconnect polls
+        status = services().download_jobs.status(download_id) or {'status': 'unknown'}
+        return Response(format_sse(download_status_payload(download_id, status), retry=RECONNECT_MS),
+                        mimetype='text/event-stream', headers=SSE_HEADERS)
+    stream = sse_stream(lambda: download_status_payload(download_id, job.snapshot()), job.channel,
+                        lambda state: state.get('status') in ('done', 'failed'),
+                        last_event_id=request.headers.get('Last-Event-ID'))
+    return Response(stream, mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@bp.route('/download_youtube/file/<download_id>')
+def download_youtube_file(download_id):
+    status = services().download_jobs.status(download_id)
+    if status is None:
+        return jsonify({'missingOutput': True, 'error': 'Download not found. Please start it again.'}), 404
+    if status.get('status') != 'done':
+        return jsonify(dict(download_status_payload(download_id, status), error='Download is not finished yet')), 409
+    filename = status['filename']
+    if not os.path.exists(os.path.join(services().temp_dir, filename)):
+        return jsonify({'missingOutput': True, 'error': 'Output file missing. Please re-upload and try again.'}), 404
+    services().download_jobs.touch(download_id)
+    track_file_access(filename)
+    download_name = filename
+    if status.get('title'):
+        # Stored files are named by video id; give the user the title back
+        download_name = re.sub(r'[\\/:*?"<>|\x00-\x1f]+', '_', status['title']).strip()[:150] + os.path.splitext(filename)[1]
+    return send_tracked_file(services().temp_dir, filename, as_attachment=True, download_name=download_name)
+
+# Upper bound on URLs per batch preview request. Without an API key every URL is a
+# pytube/yt-dlp lookup on the small fallback pool, so far fewer fit in one request.
+MAX_BATCH_PREVIEW_URLS = 50
+MAX_BATCH_PREVIEW_URLS_WITHOUT_API_KEY = 12
+
+def _batch_preview_urls():
+    """URLs from a JSON body ({"urls": [...]}) or a newline-separated 'urls' form field."""
+    payload = request.get_json(silent=True) or {}
+    urls = payload.get('urls') if isinstance(payload, dict) else None
+    if urls is None:
+        urls = request.form.get('urls', '').splitlines()
+    return [u.strip() for u in urls if isinstance(u, str) and u.strip()]
+
 @csrf.exempt
-@app.route('/download_twitter', methods=['POST', 'GET'])
+@bp.route('/download_youtube/batch', methods=['POST'])
+@admission_controlled(lambda: 1 + len(_batch_preview_urls()) / 25)
+def download_youtube_batch():
+    """Preview many YouTube URLs at once (playlists, course pages).
+
+    Returns {'results': [...]} in input order; each entry has 'url' plus either the
+    same preview fields as POST /download_youtube (with a download_id) or an 'error'.
+    """
+    urls = _batch_preview_urls()
+    if not urls:
+        return jsonify({'error': 'No URLs provided'}), 400
+    api_key = os.getenv('YOUTUBE_API_KEY')
+    limit = MAX_BATCH_PREVIEW_URLS if api_key else MAX_BATCH_PREVIEW_URLS_WITHOUT_API_KEY
+    if len(urls) > limit:
+        return jsonify({'error': f'Too many URLs: at most {limit} per request'}), 400
+    try:
+        from smart_youtube_downloader import SmartYouTubeDownloader
+        downloader = SmartYouTubeDownloader(api_key=api_key)
+        results = downloader.get_preview_infos(urls)
+        for result in results:
+            if 'error' not in result:
+                result['download_id'] = str(uuid.uuid4())
+        return jsonify({'results': results})
+    except Exception as e:
+        return jsonify({'error': f'Failed to process batch preview: {str(e)}'}), 500
+
+@csrf.exempt
+@bp.route('/download_twitter', methods=['POST', 'GET'])
 def download_twitter():
     try:
         if request.method == 'POST':
@@ -691,19 +616,20 @@ def download_twitter():
                 return jsonify({'error': 'Missing parameters'}), 400
             # Download logic for X/Twitter (dummy implementation, replace with real logic)
             # Simulate output file
-            output_dir = app.config['UPLOAD_FOLDER']
+            output_dir = current_app.config['UPLOAD_FOLDER']
             dummy_file = os.path.join(output_dir, f"{download_id}_twitter.mp4")
             if not os.path.exists(dummy_file):
                 # Simulate missing output
                 return jsonify({'missingOutput': True, 'error': 'Output file missing. Please re-upload and try again.'}), 404
             track_file_access(os.path.basename(dummy_file))
-            return send_from_directory(output_dir, os.path.basename(dummy_file), as_attachment=True)
+            return send_tracked_file(output_dir, os.path.basename(dummy_file), as_attachment=True)
     except Exception as e:
         return jsonify({'error': f'Failed to process download request: {str(e)}'}), 500
 
 
 @csrf.exempt
-@app.route('/upload_and_analyze', methods=['POST'])
+@bp.route('/upload_and_analyze', methods=['POST'])
+@admission_controlled(_upload_cost)
 def upload_and_analyze():
     """Accept a file upload. If it's a PDF return immediate stats. If it's an
     IPYNB, save file, mark conversion pending and start background conversion.
@@ -722,10 +648,12 @@ def upload_and_analyze():
     import hashlib
     content_hash = hashlib.sha1(file_bytes).hexdigest()[:12]
     filename = f"{content_hash}_{original_filename}"
-    server_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    server_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
 
     # If file already exists with same content-hash, reuse it; otherwise write it
     if not os.path.exists(server_path):
+        if not services().file_lifecycle.make_room(len(file_bytes)):
+            return jsonify({'error': 'The server is out of temporary storage right now. Please try again in a few minutes.'}), 507
         with open(server_path, 'wb') as outf:
             outf.write(file_bytes)
             
@@ -740,31 +668,27 @@ def upload_and_analyze():
         stats = get_doc_stats(server_path)
         return jsonify({'serverFilename': filename, 'initialStats': stats, 'pageCount': stats.get('pages', 1)})
 
-    # If ipynb, mark pending and spawn background conversion
+    # If ipynb, spawn background conversion
     if filename.lower().endswith('.ipynb'):
-        # mark pending
-        conversion_status[filename] = {'status': 'pending', 'pdf_path': None, 'progress': 0}
-        # start thread
-        t = threading.Thread(target=_convert_ipynb_to_pdf_async, args=(server_path, 300), daemon=True)
-        t.start()
-        # frontend will poll check_conversion_status
+        # start (or join) the shared conversion; frontend will poll check_conversion_status
+        start_notebook_conversion(filename, server_path)
         return jsonify({'serverFilename': filename, 'initialStats': {'pages': 0}, 'pageCount': 0})
 
     # Unknown types: accept but return generic response
     return jsonify({'serverFilename': filename, 'initialStats': {}, 'pageCount': 0})
 
 
-@app.route('/get_page_count')
+@bp.route('/get_page_count')
 def get_page_count():
     filename = request.args.get('filename')
     if not filename:
         return jsonify({'pageCount': 0}), 400
     try:
         # Try absolute path first
-        path = filename if os.path.isabs(filename) else os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        path = filename if os.path.isabs(filename) else os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(path):
             # Try basename in temp dir
-            path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(filename))
+            path = os.path.join(current_app.config['UPLOAD_FOLDER'], os.path.basename(filename))
         if not os.path.exists(path):
               return jsonify({'pageCount': 0, 'error': 'File not found. It may have been cleaned up due to inactivity. Please re-upload your file.'}), 404
             
@@ -776,12 +700,14 @@ def get_page_count():
     except Exception as e:
         return jsonify({'pageCount': 0, 'error': str(e)}), 500
 
-@csrf.exempt
-@app.route('/video_download', methods=['POST'])
-def video_download():
-    url = request.json.get('url')
-    if not url: return jsonify({'error': 'URL is required'}), 400
+def _media_format_urls(payload):
+    media = list(payload.get('media') or [])
+    if payload.get('bestAudio'):
+        media.append(payload['bestAudio'])
+    return [entry.get('url') for entry in media]
 
+def _extract_video_metadata(yt_dlp, url):
+    """Run yt-dlp on url and build the /video_download payload; None if there is no downloadable video."""
     # Enhanced yt-dlp options for better compatibility
     ydl_opts = {
         'quiet': True,
@@ -798,76 +724,98 @@ def video_download():
         'nocheckcertificate': True,
         'ignoreerrors': True,
         'skip_unavailable_fragments': True,
+        'socket_timeout': upstream.EXTRACTOR_TIMEOUT,
+        'extractor_retries': 2,
     })
 
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        if not info:
+            # ignoreerrors makes yt-dlp return None instead of raising for some failures
+            return None
+        media_formats = []
+        best_audio = None
+
+        if 'formats' in info:
+            for f in info.get('formats', []):
+                vcodec = f.get('vcodec')
+                acodec = f.get('acodec')
+                height = f.get('height', 0) or 0
+                ext = f.get('ext', 'mp4')
+                format_note = f.get('format_note', '')
+                quality = format_note if format_note else (f"{height}p" if height else ext.upper())
+                filesize = f.get('filesize_approx') or f.get('filesize') or 0
+                size_mb = round(filesize / (1024 * 1024), 1) if filesize else None
+
+                is_video_only = (vcodec and vcodec != 'none') and (not acodec or acodec == 'none')
+                is_audio_only = (acodec and acodec != 'none') and (not vcodec or vcodec == 'none')
+                is_progressive = (vcodec and vcodec != 'none') and (acodec and acodec != 'none')
+
+                entry = {
+                    'quality': quality,
+                    'url': f.get('url'),
+                    'size': size_mb,
+                    'format': ext,
+                    'height': height,
+                    'video_only': is_video_only,
+                    'audio_only': is_audio_only,
+                    'progressive': is_progressive,
+                    'abr': f.get('abr'),
+                    'vcodec': vcodec,
+                    'acodec': acodec
+                }
+
+                if is_audio_only and (best_audio is None or (f.get('abr') or 0) > (best_audio.get('abr') or 0)):
+                    best_audio = entry
+
+                if is_progressive or is_video_only:
+                    media_formats.append(entry)
+
+        if not media_formats:
+            return None
+
+        # Sort by quality (highest first), progressive first for same height
+        sorted_media = sorted(media_formats, key=lambda x: (x.get('height', 0), 1 if x.get('video_only') else 2), reverse=True)
+
+        # Generate filename based on platform
+        uploader = info.get('uploader', info.get('uploader_id', 'unknown'))
+        title = info.get('title', 'video')
+        video_id = info.get('id', '')
+
+        # Clean filename
+        safe_title = re.sub(r'[^\w\-_\. ]', '_', title)[:50]
+        safe_uploader = re.sub(r'[^\w\-_\. ]', '_', uploader)[:30]
+
+        suggested_filename = f"{safe_uploader}_{safe_title}_{video_id}.mp4"
+
+        return {
+            'media': sorted_media,
+            'bestAudio': best_audio,
+            'suggestedFilename': suggested_filename,
+            'title': title,
+            'uploader': uploader,
+            'duration': info.get('duration', 0)
+        }
+
+@csrf.exempt
+@bp.route('/video_download', methods=['POST'])
+def video_download():
+    url = request.json.get('url')
+    if not url: return jsonify({'error': 'URL is required'}), 400
+
     try:
-        if yt_dlp is None:
-            return jsonify({'error': 'yt_dlp module not installed on server'}), 501
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            media_formats = []
-            best_audio = None
-
-            if 'formats' in info:
-                for f in info.get('formats', []):
-                    vcodec = f.get('vcodec')
-                    acodec = f.get('acodec')
-                    height = f.get('height', 0) or 0
-                    ext = f.get('ext', 'mp4')
-                    format_note = f.get('format_note', '')
-                    quality = format_note if format_note else (f"{height}p" if height else ext.upper())
-                    filesize = f.get('filesize_approx') or f.get('filesize') or 0
-                    size_mb = round(filesize / (1024 * 1024), 1) if filesize else None
-
-                    is_video_only = (vcodec and vcodec != 'none') and (not acodec or acodec == 'none')
-                    is_audio_only = (acodec and acodec != 'none') and (not vcodec or vcodec == 'none')
-                    is_progressive = (vcodec and vcodec != 'none') and (acodec and acodec != 'none')
-
-                    entry = {
-                        'quality': quality,
-                        'url': f.get('url'),
-                        'size': size_mb,
-                        'format': ext,
-                        'height': height,
-                        'video_only': is_video_only,
-                        'audio_only': is_audio_only,
-                        'progressive': is_progressive,
-                        'abr': f.get('abr'),
-                        'vcodec': vcodec,
-                        'acodec': acodec
-                    }
-
-                    if is_audio_only and (best_audio is None or (f.get('abr') or 0) > (best_audio.get('abr') or 0)):
-                        best_audio = entry
-
-                    if is_progressive or is_video_only:
-                        media_formats.append(entry)
-
-            if not media_formats:
-                return jsonify({'error': 'No downloadable video found. Please check the URL and try again.'}), 404
-
-            # Sort by quality (highest first), progressive first for same height
-            sorted_media = sorted(media_formats, key=lambda x: (x.get('height', 0), 1 if x.get('video_only') else 2), reverse=True)
-
-            # Generate filename based on platform
-            uploader = info.get('uploader', info.get('uploader_id', 'unknown'))
-            title = info.get('title', 'video')
-            video_id = info.get('id', '')
-
-            # Clean filename
-            safe_title = re.sub(r'[^\w\-_\. ]', '_', title)[:50]
-            safe_uploader = re.sub(r'[^\w\-_\. ]', '_', uploader)[:30]
-
-            suggested_filename = f"{safe_uploader}_{safe_title}_{video_id}.mp4"
-
-            return jsonify({
-                'media': sorted_media,
-                'bestAudio': best_audio,
-                'suggestedFilename': suggested_filename,
-                'title': title,
-                'uploader': uploader,
-                'duration': info.get('duration', 0)
-            })
+        import yt_dlp
+    except Exception:
+        return jsonify({'error': 'yt_dlp module not installed on server'}), 501
+
+    try:
+        # Repeat lookups are served from the cache; concurrent ones share one extraction
+        payload, cached = services().video_metadata.get_or_load(video_cache_key(url), lambda: _extract_video_metadata(yt_dlp, url))
+        if payload is None:
+            return jsonify({'error': 'No downloadable video found. Please check the URL and try again.'}), 404
+        response = jsonify(payload)
+        response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+        return response
 
     except yt_dlp.utils.DownloadError as e:
         error_msg = str(e)
@@ -880,62 +828,129 @@ def video_download():
     except Exception as e:
         return jsonify({'error': f'Failed to process URL: {str(e)}'}), 500
 
-@csrf.exempt
-@app.route('/proxy_merge_download')
-def proxy_merge_download():
-    video_url = request.args.get('video')
-    audio_url = request.args.get('audio')
-    filename = request.args.get('filename', f"merged_{int(time.time())}.mp4")
+def merge_target(args):
+    """(video_url, audio_url, store_key, filename) for a merge query; ValueError if incomplete."""
+    video_url = args.get('video')
+    audio_url = args.get('audio')
     if not video_url or not audio_url:
-        return "Missing video or audio URL", 400
+        raise ValueError("Missing video or audio URL")
+    filename = secure_filename(args.get('filename', f"merged_{int(time.time())}.mp4")) or 'merged.mp4'
+    # The same pair of googlevideo streams (across re-signed URLs) is merged once, then served
+    # from the store; streams from any other host are merged per request and never stored
+    video_key, audio_key = media_url_key(video_url), media_url_key(audio_url)
+    store_key = f"merge:{video_key}+{audio_key}" if video_key and audio_key else None
+    return video_url, audio_url, store_key, filename
+
+def audio_target(args):
+    """(audio_url, container, store_key, filename) for an audio-only query; ValueError if incomplete."""
+    audio_url = args.get('audio')
+    if not audio_url:
+        raise ValueError("Missing audio URL")
+    container = audio_container(args.get('acodec'))
+    stem = os.path.splitext(secure_filename(args.get('filename', '')))[0] or f"audio_{int(time.time())}"
+    audio_key = media_url_key(audio_url)
+    return audio_url, container, f"audio:{audio_key}" if audio_key else None, f"{stem}.{container}"
+
+def stored_or_streamed(store, store_key, fmt, start):
+    """The file in media store `store` for (store_key, fmt) as (filename, None), or (None, body)
+    for a live ffmpeg stream from start() that is teed into the store. A store_key of None (an
+    untrusted source) bypasses the store. Raises what start() raises."""
+    stored = store.lookup(store_key, fmt) if store_key else None
+    if stored:
+        return stored, None
+    output = start()
+    writer = store.begin(store_key, fmt, f".{fmt}") if store_key else None
+    return None, (writer.tee(output, succeeded=lambda: output.succeeded) if writer is not None else output)
+
+def _stream_response(body, mimetype, filename):
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment;filename=\"{filename}\"",
+                             "X-Accel-Buffering": "no"})
 
-    # Download streams to temp files
+@csrf.exempt
+@bp.route('/proxy_merge_download')
+@admission_controlled(6)
+def proxy_merge_download():
     try:
-        v_path = os.path.join(temp_dir, f"v_{uuid.uuid4()}.mp4")
-        a_path = os.path.join(temp_dir, f"a_{uuid.uuid4()}.m4a")
-        out_path = os.path.join(temp_dir, filename)
-
-        vr = requests.get(video_url, stream=True)
-        vr.raise_for_status()
-        with open(v_path, 'wb') as vf:
-            for chunk in vr.iter_content(chunk_size=8192):
-                if chunk:
-                    vf.write(chunk)
-
-        ar = requests.get(audio_url, stream=True)
-        ar.raise_for_status()
-        with open(a_path, 'wb') as af:
-            for chunk in ar.iter_content(chunk_size=8192):
-                if chunk:
-                    af.write(chunk)
-
-        # Merge using ffmpeg
-        subprocess.run(['ffmpeg', '-y', '-i', v_path, '-i', a_path, '-c', 'copy', out_path], check=True)
-        return send_from_directory(temp_dir, os.path.basename(out_path), as_attachment=True)
+        video_url, audio_url, store_key, filename = merge_target(request.args)
+    except ValueError as e:
+        return str(e), 400
+    # Both streams are fetched concurrently and muxed on the fly; the fragmented MP4
+    # goes to the client as ffmpeg writes it, and is kept in the store if it completes.
+    svc = services()
+    try:
+        stored, body = stored_or_streamed(svc.media_store, store_key, 'mp4',
+                                          lambda: svc.stream_merger.merge(video_url, audio_url))
+    except MergeBusy:
+        return "Too many merges in progress. Please try again shortly.", 503, {'Retry-After': '5'}
+    except FileNotFoundError:
+        return "Failed to merge: ffmpeg is not installed on the server", 500
     except Exception as e:
         return f"Failed to merge: {e}", 500
+    if stored:
+        return send_tracked_file(svc.temp_dir, stored, as_attachment=True, download_name=filename)
+    return _stream_response(body, 'video/mp4', filename)
+
+@csrf.exempt
+@bp.route('/proxy_audio_download')
+@admission_controlled(2)
+def proxy_audio_download():
+    """Audio only: remux the bestAudio stream (no video, no re-encode) and stream it."""
+    try:
+        audio_url, container, store_key, filename = audio_target(request.args)
+    except ValueError as e:
+        return str(e), 400
+    svc = services()
+    try:
+        stored, body = stored_or_streamed(svc.media_store, store_key, container,
+                                          lambda: svc.stream_merger.extract_audio(audio_url, container))
+    except MergeBusy:
+        return "Too many merges in progress. Please try again shortly.", 503, {'Retry-After': '5'}
+    except FileNotFoundError:
+        return "Failed to extract audio: ffmpeg is not installed on the server", 500
+    except Exception as e:
+        return f"Failed to extract audio: {e}", 500
+    if stored:
+        return send_tracked_file(svc.temp_dir, stored, as_attachment=True, download_name=filename,
+                                 mimetype=AUDIO_MIMETYPES[container])
+    return _stream_response(body, AUDIO_MIMETYPES[container], filename)
+
+# Conditional and range headers the browser sends that the upstream should see
+PROXY_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+# Upstream headers that describe the relayed bytes and let the browser seek and resume
+PROXY_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges',
+                           'ETag', 'Last-Modified')
 
 @csrf.exempt
-@app.route('/proxy_download')
+@bp.route('/proxy_download')
 def proxy_download():
     url = request.args.get('url')
     filename = request.args.get('filename', 'download.mp4')
     if not url: return "Missing URL", 400
+    forwarded = {name: request.headers[name] for name in PROXY_REQUEST_HEADERS if name in request.headers}
     try:
-        r = requests.get(url, stream=True)
-        r.raise_for_status()
-        return Response(r.iter_content(chunk_size=8192),
-                        mimetype=r.headers.get('Content-Type'),
-                        headers={"Content-Disposition": f"attachment;filename=\"{filename}\""})
+        r = upstream.open_stream(url, headers=forwarded)
+    except upstream.CircuitOpen as e:
+        return f"Failed to fetch media: {e}", 503, {'Retry-After': str(max(1, int(e.retry_after)))}
     except Exception as e:
-        return f"Failed to fetch media: {e}", 500
+        return f"Failed to fetch media: {e}", 502
+    if r.status_code not in (200, 206, 304, 416):
+        r.close()
+        return f"Failed to fetch media: upstream returned {r.status_code}", 502
+    headers = {name: r.headers[name] for name in PROXY_RESPONSE_HEADERS if name in r.headers}
+    headers["Content-Disposition"] = f"attachment;filename=\"{filename}\""
+    body = upstream.iter_adaptive(r) if r.status_code in (200, 206) else []
+    response = Response(body, status=r.status_code, headers=headers)
+    response.call_on_close(r.close)
+    return response
 
 @csrf.exempt
-@app.route('/extract_highlights', methods=['POST'])
+@bp.route('/extract_highlights', methods=['POST'])
+@admission_controlled(4)
 def extract_highlights_route():
     server_filename = request.form.get('serverFilename')
     if not server_filename: return jsonify({'error': 'No server file reference provided'}), 400
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], server_filename)
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], server_filename)
     if not os.path.exists(filepath):
         return jsonify({'error': 'File not found. It may have been cleaned up due to inactivity. Please re-upload your file.'}), 404
     # Track access to source file
@@ -949,14 +964,16 @@ def extract_highlights_route():
     if os.path.basename(pdf_path) != server_filename:
         track_file_access(os.path.basename(pdf_path))
     try:
-        highlights = extract_highlights(pdf_path)
+        with services().file_lifecycle.pinned(os.path.basename(pdf_path)):
+            highlights = services().document_pool.run(document_ops.extract_highlights, pdf_path)
         if not highlights:
             return jsonify({'error': 'No highlights were found in the PDF.'}), 400
 
         # Write notes PDF into temp upload folder
         pdf_filename = os.path.basename(pdf_path).replace('.pdf', '_notes.pdf')
-        pdf_path_out = os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
-        create_modern_pdf(highlights, pdf_path_out)
+        pdf_path_out = os.path.join(current_app.config['UPLOAD_FOLDER'], pdf_filename)
+        services().document_pool.run(document_ops.create_modern_pdf, highlights, pdf_path_out)
+        pdf_size = optimize_output_pdf(pdf_path_out)
         
         # Track the newly created notes PDF
         track_file_access(pdf_filename)
@@ -965,26 +982,30 @@ def extract_highlights_route():
 
         # Create docx notes next to pdf
         docx_filename = os.path.basename(pdf_path).replace('.pdf', '_notes.docx')
-        docx_path = os.path.join(app.config['UPLOAD_FOLDER'], docx_filename)
-        create_docx_from_highlights(highlights, docx_path)
-
-        return jsonify({'previewUrl': f'/temp/{pdf_filename}', 'docxUrl': f'/temp/{docx_filename}', 'finalStats': final_stats})
+        docx_path = os.path.join(current_app.config['UPLOAD_FOLDER'], docx_filename)
+        services().document_pool.run(document_ops.create_docx_from_highlights, highlights, docx_path)
+        track_file_access(docx_filename)
+
+        return jsonify({'previewUrl': temp_url(pdf_filename), 'docxUrl': temp_url(docx_filename), 'finalStats': final_stats,
+                        'pdfSize': pdf_size})
+    except DocumentTaskTimeout:
+        return jsonify({'error': 'Processing this PDF took too long. Please try a smaller file.'}), 504
     except Exception as e: return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
 @csrf.exempt
-@app.route('/add_header_footer', methods=['POST'])
+@bp.route('/add_header_footer', methods=['POST'])
+@admission_controlled(4)
 def add_header_footer_route():
     form_data = request.form
     server_filename = form_data.get('serverFilename')
     if not server_filename: return jsonify({'error': 'No server file reference provided'}), 400
-    input_filepath = os.path.join(app.config['UPLOAD_FOLDER'], server_filename)
+    input_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], server_filename)
     intermediate_pdf_path = get_pdf_for_serverfile(server_filename, input_filepath)
     if not intermediate_pdf_path or not os.path.exists(intermediate_pdf_path):
         return jsonify({'error': 'The file you uploaded was cleaned up due to inactivity. Please re-upload your file and try again.'}), 400
-    
-    # Check if this is a converted IPYNB file
-    is_converted_ipynb = server_filename.lower().endswith('.ipynb')
-    
+    # Keep the converted PDF around for further operations; it ages out with the other temp files
+    track_file_access(os.path.basename(intermediate_pdf_path))
+
     headers = {'left': form_data.get('headerLeft', ''), 'center': form_data.get('headerCenter', ''), 'right': form_data.get('headerRight', '')}
     footers = {'left': form_data.get('footerLeft', ''), 'center': form_data.get('footerCenter', ''), 'right': form_data.get('footerRight', '')}
     page_num_placement = form_data.get('pageNumPlacement', 'footer-center')
@@ -1005,29 +1026,83 @@ def add_header_footer_route():
         start_page_num = 1
     
     output_filename = f"{uuid.uuid4()}_final.pdf"
-    output_filepath = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+    output_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], output_filename)
     
     try:
-        add_header_footer_to_pdf(intermediate_pdf_path, output_filepath, headers, footers, start_page_num, page_num_placement, page_num_format, overlap_resolution, margin_size, chapter_num, page_num_enabled, hf_enabled)
+        with services().file_lifecycle.pinned(os.path.basename(intermediate_pdf_path)):
+            services().document_pool.run(document_ops.add_header_footer_to_pdf, intermediate_pdf_path, output_filepath, headers, footers, start_page_num, page_num_placement, page_num_format, overlap_resolution, margin_size, chapter_num, page_num_enabled, hf_enabled)
+        pdf_size = optimize_output_pdf(output_filepath)
+        track_file_access(output_filename)
         final_stats = get_doc_stats(output_filepath)
 
-        # Clean up converted IPYNB PDF after successful output generation
-        if is_converted_ipynb and intermediate_pdf_path != output_filepath:
-            try:
-                os.remove(intermediate_pdf_path)
-                print(f"\033[32m✓\033[0m Cleaned up intermediate PDF: {os.path.basename(intermediate_pdf_path)}")
-            except Exception as e:
-                print(f"\033[33m⚠️\033[0m Could not remove intermediate PDF {os.path.basename(intermediate_pdf_path)}: {e}")
-        
         # Also provide DOCX version
         docx_name = output_filename.replace('.pdf', '.docx')
-        docx_path = os.path.join(app.config['UPLOAD_FOLDER'], docx_name)
-        create_docx_from_pdf(output_filepath, docx_path)
-        return jsonify({'previewUrl': f'/temp/{output_filename}', 'docxUrl': f'/temp/{docx_name}', 'finalStats': final_stats})
+        docx_path = os.path.join(current_app.config['UPLOAD_FOLDER'], docx_name)
+        services().document_pool.run(document_ops.create_docx_from_pdf, output_filepath, docx_path)
+        track_file_access(docx_name)
+        return jsonify({'previewUrl': temp_url(output_filename), 'docxUrl': temp_url(docx_name), 'finalStats': final_stats,
+                        'pdfSize': pdf_size})
+    except DocumentTaskTimeout:
+        return jsonify({'error': 'Processing this PDF took too long. Please try a smaller file.'}), 504
     except Exception as e:
         return jsonify({'error': f'Failed to process PDF: {str(e)}'}), 500
 
-port = int(os.environ.get("PORT", 5001))
-app.run(host="0.0.0.0", port=port)
+def create_app(config=None):
+    """Application factory. Defaults come from the environment; config overrides them.
 
-application = app
+    Each app gets its own Services (see services()). Servers and the gateway use
+    `application` below, so a process normally builds one.
+    """
+    app = Flask(__name__)
+    # Working directory shared by every worker process: uploads/outputs plus the state database.
+    # Set LUMINAR_WORK_DIR to a volume all workers (or hosts) can see.
+    work_dir = os.environ.get('LUMINAR_WORK_DIR') or os.path.join(tempfile.gettempdir(), 'luminar')
+    app.config.update(
+        SECRET_KEY='luminar-secret-key-2025',
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,
+        UPLOAD_FOLDER=os.path.join(work_dir, 'uploads'),
+        STATE_BACKEND=os.environ.get('STATE_BACKEND', f"sqlite:///{os.path.join(work_dir, 'state.db')}"),
+        TEMP_DISK_QUOTA=int(os.environ.get('TEMP_DISK_QUOTA_MB', 2048)) * 1024 * 1024,
+        CONVERSION_WORKERS=int(os.environ.get('CONVERSION_WORKERS', 2)),
+        CONVERSION_CACHE_DIR=os.environ.get('CONVERSION_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'luminar', 'conversions')),
+        CONVERSION_CACHE_MAX_BYTES=int(os.environ.get('CONVERSION_CACHE_MAX_MB', 512)) * 1024 * 1024,
+        DOC_WORKERS=int(os.environ.get('DOC_WORKERS', 2)),
+        DOC_TASK_TIMEOUT=float(os.environ.get('DOC_TASK_TIMEOUT', 120)),
+        DOC_WORKER_MEMORY_MB=int(os.environ.get('DOC_WORKER_MEMORY_MB', 2048)),
+        DOC_WORKER_MAX_TASKS=int(os.environ.get('DOC_WORKER_MAX_TASKS', 50)),
+        ADMISSION_INFLIGHT_BUDGET=float(os.environ.get('ADMISSION_INFLIGHT_BUDGET', 24)),
+        ADMISSION_CLIENT_RATE=float(os.environ.get('ADMISSION_CLIENT_RATE', 0.5)),
+        ADMISSION_CLIENT_BURST=float(os.environ.get('ADMISSION_CLIENT_BURST', 24)),
+        VIDEO_METADATA_TTL=float(os.environ.get('VIDEO_METADATA_TTL', 900)),
+        FFMPEG_MAX_PROCESSES=int(os.environ.get('FFMPEG_MAX_PROCESSES', 2)),
+        DOWNLOAD_WORKERS=int(os.environ.get('DOWNLOAD_WORKERS', 2)),
+        FILE_OFFLOAD=os.environ.get('FILE_OFFLOAD', '').lower(),
+        PDF_LINEARIZE=os.environ.get('PDF_LINEARIZE', '1') not in ('0', 'false', 'no'),
+        FILE_OFFLOAD_PREFIX=os.environ.get('FILE_OFFLOAD_PREFIX', '/_files/'),
+        FILE_OFFLOAD_HOLD_SECONDS=float(os.environ.get('FILE_OFFLOAD_HOLD_SECONDS', 60)),
+        PROXY_HOPS=int(os.environ.get('PROXY_HOPS', 0)),
+        # Notebook engine: 'native' lays the notebook out with ReportLab (fast, no browser) and
+        # falls back to nbconvert webpdf on failure; 'nbconvert' always uses the high-fidelity path.
+        NOTEBOOK_RENDERER=os.environ.get('NOTEBOOK_RENDERER', 'native').lower(),
+    )
+    if config:
+        app.config.update(config)
+    if app.config['PROXY_HOPS']:
+        # Trust that many X-Forwarded-* entries, so remote_addr (which admission control
+        # keys on) is the client, not the proxy
+        hops = app.config['PROXY_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops, x_port=hops, x_prefix=hops)
+
+    app.extensions['luminar'] = Services(app)
+    csrf.init_app(app)
+    app.register_blueprint(bp)
+    app.before_request(start_background_tasks)
+    return app
+
+# The process's single app and WSGI entry point, e.g. `gunicorn app:application` (see gunicorn.conf.py)
+application = create_app()
+app = application
+
+if __name__ == '__main__':
+    port = int(os.environ.get("PORT", 5001))
+    app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,70 @@
+"""Measure how long a fresh worker takes to import the app and serve its first request.
+
+Each sample runs in a new interpreter, the way a server worker (re)spawns:
+
+    python benchmarks/import_time.py            # 10 runs, median and worst
+    python benchmarks/import_time.py --top 15   # plus the slowest modules (-X importtime)
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE = r"""
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.application.test_client().get('/check_conversion_status/none')
+served = time.perf_counter()
+print(imported - start, served - start)
+"""
+
+
+def run_sample(env):
+    out = subprocess.run([sys.executable, '-c', SAMPLE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    imported, served = out.split()[-2:]
+    return float(imported), float(served)
+
+
+def slowest_modules(env, top):
+    """Parse `python -X importtime` output into (cumulative_us, module) pairs."""
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=0, help='also list the N slowest imports')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='luminar-bench-')
+    env = dict(os.environ, LUMINAR_WORK_DIR=work_dir, CONVERSION_CACHE_DIR=os.path.join(work_dir, 'cache'))
+
+    samples = [run_sample(env) for _ in range(args.runs)]
+    imports = [s[0] * 1000 for s in samples]
+    firsts = [s[1] * 1000 for s in samples]
+    print(f"import app:          median {statistics.median(imports):7.1f} ms   max {max(imports):7.1f} ms")
+    print(f"first request ready: median {statistics.median(firsts):7.1f} ms   max {max(firsts):7.1f} ms")
+
+    if args.top:
+        print("\nSlowest imports (cumulative):")
+        for cumulative, name in slowest_modules(env, args.top):
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
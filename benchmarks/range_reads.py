@@ -0,0 +1,80 @@
+"""Check that FileServer answers a Range request by seeking, not by reading up to it.
+
+Serves a sparse file through FileServer under a gunicorn-style wsgi.file_wrapper
+(which has no seekable()), requests a small range deep into it and counts the bytes
+read from disk:
+
+    python benchmarks/range_reads.py                       # 64 MB file, range at 52 MB
+    python benchmarks/range_reads.py --size-mb 512 --offset-mb 500
+
+Exits non-zero if more than a few blocks were read.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+
+import file_serving  # noqa: E402
+from file_lifecycle import FileLifecycleManager  # noqa: E402
+from file_serving import FileServer  # noqa: E402
+
+RANGE_LENGTH = 100
+# FileWrapper reads in 8 KB blocks; allow a couple of them
+MAX_READ_BYTES = 64 * 1024
+
+
+class ServerFileWrapper:
+    """Like gunicorn's wsgi.file_wrapper: iterates the file, can't seek."""
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return iter(lambda: self.filelike.read(self.blksize), b'')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--offset-mb', type=int, default=52)
+    args = parser.parse_args()
+
+    read_bytes = [0]
+    original_read = file_serving.PinnedFile.read
+
+    def counting_read(self, size=-1):
+        data = original_read(self, size)
+        read_bytes[0] += len(data)
+        return data
+    file_serving.PinnedFile.read = counting_read
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'big.bin'), 'wb') as f:
+            f.truncate(args.size_mb * 1024 * 1024)
+        server = FileServer(directory, FileLifecycleManager(directory, ttl=3600))
+        app = Flask(__name__)
+        app.add_url_rule('/f/<name>', 'f', lambda name: server.send(directory, name))
+
+        start = args.offset_mb * 1024 * 1024
+        response = app.test_client().get('/f/big.bin', headers={'Range': f'bytes={start}-{start + RANGE_LENGTH - 1}'},
+                                         environ_base={'wsgi.file_wrapper': ServerFileWrapper})
+        body = response.get_data()
+        response.close()
+
+    print(f"HTTP {response.status_code}, {len(body)} bytes sent, {read_bytes[0]} bytes read from disk")
+    if response.status_code != 206 or len(body) != RANGE_LENGTH or read_bytes[0] > MAX_READ_BYTES:
+        print(f"\033[33m⚠️\033[0m Range request did not seek (read {read_bytes[0]} bytes to send {len(body)})")
+        sys.exit(1)
+    print("\033[32m✓\033[0m Range request seeked to its start")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from state_backend import StateBackend
+
+# Notebook fields that never change the rendered PDF
+_VOLATILE_CELL_KEYS = ('id', 'metadata')
+_KEPT_NOTEBOOK_METADATA = ('language_info', 'kernelspec')
+# StateBackend namespace for the shared index; expires_at stores the last-use time
+_NS = 'conversion_cache'
+
+
+def normalized_notebook_hash(path: str) -> str:
+    """Hash a notebook's renderable content, ignoring cell ids and editor metadata.
+
+    Files that are not valid notebook JSON are hashed byte for byte.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    try:
+        notebook = json.loads(raw)
+        cells = [{k: v for k, v in cell.items() if k not in _VOLATILE_CELL_KEYS}
+                 for cell in notebook.get('cells', [])]
+        metadata = {k: v for k, v in notebook.get('metadata', {}).items() if k in _KEPT_NOTEBOOK_METADATA}
+        raw = json.dumps({'cells': cells, 'metadata': metadata}, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    except (ValueError, AttributeError):
+        pass
+    return hashlib.sha256(raw).hexdigest()
+
+
+class ConversionCache:
+    """Converted PDFs on disk, keyed by notebook content hash and converter version.
+
+    The cache directory survives restarts. Entries are evicted least-recently-used
+    first once the total size exceeds max_bytes; recency is kept in file mtimes so
+    it is rebuilt from the directory on startup. With a shared StateBackend the
+    index (sizes and last use) lives there instead, so every worker sees the same
+    entries and the same budget.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, backend: Optional[StateBackend] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()  # key -> size, oldest first
+        self._total = 0
+        self._loaded = False
+
+    @staticmethod
+    def key_for(notebook_path: str, converter_version: str) -> str:
+        return f"{normalized_notebook_hash(notebook_path)}-{converter_version}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def _ensure_loaded(self) -> None:
+        # Scanning the cache directory is deferred to first use so constructing the
+        # cache (at app start-up) does no I/O.
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._load()
+                self._loaded = True
+
+    def _load(self) -> None:
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pdf'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime, name[:-4], st.st_size))
+        for mtime, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+            if self._backend is not None and self._backend.get(_NS, key) is None:
+                self._backend.put(_NS, key, weight=size, expires_at=mtime)
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        self._ensure_loaded()
+        if self._backend is not None:
+            return self._backend.total_weight(_NS)
+        return self._total
+
+    def get(self, key: str, dest_path: str) -> bool:
+        """Materialize a cached PDF at dest_path. Returns False on a miss."""
+        self._ensure_loaded()
+        if self._backend is not None:
+            return self._get_shared(key, dest_path)
+        with self._lock:
+            if key not in self._entries:
+                return False
+            path = self._path(key)
+            try:
+                os.utime(path, (time.time(), time.time()))
+            except OSError:
+                self._total -= self._entries.pop(key)
+                return False
+            self._entries.move_to_end(key)
+        _link_or_copy(path, dest_path)
+        return True
+
+    def _get_shared(self, key: str, dest_path: str) -> bool:
+        if self._backend.get(_NS, key) is None:
+            return False
+        try:
+            _link_or_copy(self._path(key), dest_path)
+        except OSError:
+            self._backend.delete(_NS, key)
+            return False
+        # expires_at holds the last-use time for this namespace
+        self._backend.touch(_NS, key, time.time())
+        return True
+
+    def put(self, key: str, src_path: str) -> None:
+        """Store src_path under key and evict LRU entries beyond the size budget."""
+        self._ensure_loaded()
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self._backend is not None:
+            self._backend.put(_NS, key, weight=size, expires_at=time.time())
+            self._evict_shared(keep=key)
+            return
+        with self._lock:
+            self._total += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def _evict_shared(self, keep: str) -> None:
+        total = self._backend.total_weight(_NS)
+        if total <= self.max_bytes:
+            return
+        for record in self._backend.oldest(_NS, limit=1000):
+            if total <= self.max_bytes:
+                break
+            if record.key == keep:
+                continue
+            self._backend.delete(_NS, record.key)
+            total -= record.weight
+            try:
+                os.remove(self._path(record.key))
+            except OSError:
+                pass
+
+
+def _link_or_copy(src: str, dest: str) -> None:
+    """Hardlink when possible so hits cost no I/O; fall back to a copy across devices."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
@@ -0,0 +1,280 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Optional, Tuple
+
+from job_store import JobStatusStore
+from progress_events import ProgressChannel
+from state_backend import StateBackend
+
+# Conversion phases in order, with the progress percentage reported for each.
+PHASE_PROGRESS = {'queued': 0, 'rendering': 40, 'writing': 80, 'done': 100, 'failed': 0}
+
+# StateBackend namespaces: per-filename status rows, and per-content-hash ownership claims
+_STATUS_NS = 'conversions'
+_CLAIM_NS = 'conversion_claims'
+_FOLLOW_INTERVAL = 0.5
+
+
+def content_key(path: str) -> str:
+    """Hash a file's bytes so identical uploads share one conversion."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionJob:
+    """One in-flight or finished conversion. The future resolves to the output PDF path."""
+
+    def __init__(self, key: str, server_filename: str, src_path: str):
+        self.key = key
+        self.server_filename = server_filename
+        self.src_path = src_path
+        self.future: Future = Future()
+        self.created = time.time()
+        self.names = {server_filename}
+        self.owner = False  # True when this process holds the cross-worker claim
+        self.channel = ProgressChannel(phase='queued')
+        self.future.add_done_callback(lambda _: self.channel.publish(phase=self.status))
+
+    @property
+    def phase(self) -> str:
+        return self.channel.state['phase']
+
+    @property
+    def progress(self) -> int:
+        return PHASE_PROGRESS.get(self.phase, 0)
+
+    def set_phase(self, phase: str) -> None:
+        """Report a real conversion phase; pushed to any SSE subscribers."""
+        if not self.future.done():
+            self.channel.publish(phase=phase)
+
+    @property
+    def pdf_path(self) -> Optional[str]:
+        if self.future.done() and not self.future.cancelled() and self.future.exception() is None:
+            return self.future.result()
+        return None
+
+    @property
+    def status(self) -> str:
+        if not self.future.done():
+            return 'pending'
+        return 'done' if self.pdf_path else 'failed'
+
+    def is_reusable(self) -> bool:
+        """A job can be shared while it is running or if its PDF is still on disk."""
+        if not self.future.done():
+            return True
+        path = self.pdf_path
+        return bool(path and os.path.exists(path))
+
+    def snapshot(self) -> Dict:
+        """Status dict in the shape the frontend polls for."""
+        status = self.status
+        pdf_path = self.pdf_path
+        phase = status if status != 'pending' else self.phase
+        snapshot = {'status': status, 'phase': phase, 'pdf_path': pdf_path, 'progress': PHASE_PROGRESS.get(phase, 0)}
+        if pdf_path:
+            snapshot['pdf_basename'] = os.path.basename(pdf_path)
+        return snapshot
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Block until the conversion finishes or the deadline passes. Returns the PDF path or None."""
+        try:
+            return self.future.result(timeout=timeout)
+        except FutureTimeout:
+            return None
+        except Exception:
+            return None
+
+
+def _no_converter(job: ConversionJob) -> str:
+    raise RuntimeError('No converter available to take over this job')
+
+
+class ConversionJobs:
+    """Single-flight registry: at most one conversion per content hash runs at a time.
+
+    Jobs are reachable by server filename and by converted PDF basename through a
+    JobStatusStore; finished jobs expire ttl seconds after their files were last used.
+
+    With a shared StateBackend the single-flight guarantee spans worker processes: the
+    worker that claims a content hash converts it and mirrors its status; any other
+    worker follows that claim with a local job whose future resolves when it finishes.
+    """
+
+    def __init__(self, max_workers: int = 2, ttl: float = 600, backend: Optional[StateBackend] = None,
+                 default_convert: Optional[Callable[[ConversionJob], str]] = None, claim_ttl: float = 600):
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self._backend = backend
+        self._default_convert = default_convert
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, ConversionJob] = {}
+        self._store = JobStatusStore(ttl, is_evictable=lambda job: job.future.done())
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='convert')
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def lookup(self, name: str) -> Tuple[Optional[str], Optional[ConversionJob]]:
+        """Resolve a server filename or converted PDF basename to (server filename, job)."""
+        server_key, job = self._store.lookup(name)
+        if job is None and self._backend is not None:
+            return self._adopt(name)
+        return server_key, job
+
+    def get(self, name: str) -> Optional[ConversionJob]:
+        return self.lookup(name)[1]
+
+    def touch(self, name: str) -> None:
+        self._store.touch(name)
+        if self._backend is not None:
+            self._backend.touch(_STATUS_NS, name, time.time() + self.ttl)
+
+    def forget(self, name: str) -> None:
+        """Drop the job owning name, e.g. because its source or PDF was cleaned up."""
+        job = self._store.discard(name)
+        if self._backend is not None:
+            record = self._backend.get(_STATUS_NS, name) or self._backend.get_by_alias(_STATUS_NS, name)
+            if record is not None:
+                self._backend.delete(_STATUS_NS, record.key)
+        self._release(job)
+
+    def evict_expired(self) -> int:
+        evicted = self._store.evict_expired()
+        for job in evicted:
+            self._release(job)
+        if self._backend is not None:
+            self._backend.purge_expired(_STATUS_NS, time.time())
+            self._backend.purge_expired(_CLAIM_NS, time.time())
+        return len(evicted)
+
+    def submit(self, server_filename: str, src_path: str, convert: Callable[[ConversionJob], str]) -> ConversionJob:
+        """Return the job for src_path's content, starting `convert(job)` only if none is usable."""
+        key = content_key(src_path)
+        with self._lock:
+            job = self._by_key.get(key)
+            if job is not None and job.is_reusable():
+                job.names.add(server_filename)
+                self._store.put(server_filename, job)
+                if job.pdf_path:
+                    self._store.add_output(server_filename, os.path.basename(job.pdf_path))
+                self._mirror(job)
+                return job
+            job = ConversionJob(key, server_filename, src_path)
+            self._by_key[key] = job
+            self._store.put(server_filename, job)
+        self._start(job, convert)
+        return job
+
+    def _start(self, job: ConversionJob, convert: Callable[[ConversionJob], str]) -> None:
+        if self._backend is None:
+            self._executor.submit(self._run, job, convert)
+            return
+        job.channel.subscribe(lambda state: self._mirror(job))
+        if self._claim(job):
+            self._executor.submit(self._run, job, convert)
+        else:
+            # Another worker owns this content; follow it without taking a conversion slot
+            threading.Thread(target=self._run, args=(job, lambda j: self._follow(j, convert)), daemon=True).start()
+
+    def _run(self, job: ConversionJob, convert: Callable[[ConversionJob], str]) -> None:
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            pdf_path = convert(job)
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        with self._lock:
+            for name in job.names:
+                self._store.add_output(name, os.path.basename(pdf_path))
+        job.future.set_result(pdf_path)
+
+    def _release(self, job: Optional[ConversionJob]) -> None:
+        """Forget a job's content hash once no server filename refers to it any more."""
+        if job is None:
+            return
+        with self._lock:
+            if any(self._store.get(name) is job for name in job.names):
+                return
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+
+    # --- cross-process coordination (only used with a StateBackend) ---
+
+    def _claim(self, job: ConversionJob) -> bool:
+        claimed = self._backend.claim(_CLAIM_NS, job.key, {'owner': os.getpid(), 'status': 'pending', 'phase': 'queued'},
+                                      expires_at=time.time() + self.claim_ttl)
+        job.owner = claimed
+        return claimed
+
+    def _follow(self, job: ConversionJob, convert: Callable[[ConversionJob], str]) -> str:
+        """Wait for the worker that owns job.key; take over if it disappears or its PDF is gone."""
+        while True:
+            record = self._backend.get(_CLAIM_NS, job.key)
+            state = record.value if record is not None and record.expires_at > time.time() else None
+            if state is None or (state.get('status') == 'done' and not os.path.exists(state.get('pdf_path') or '')):
+                if record is not None:
+                    self._backend.delete(_CLAIM_NS, job.key)
+                if self._claim(job):
+                    return convert(job)
+            elif state.get('status') == 'done':
+                return state['pdf_path']
+            elif state.get('status') == 'failed':
+                raise RuntimeError('Conversion failed in another worker')
+            else:
+                job.set_phase(state.get('phase', 'queued'))
+            time.sleep(_FOLLOW_INTERVAL)
+
+    def _mirror(self, job: ConversionJob) -> None:
+        """Publish a job's status so other workers can answer polls about it."""
+        if self._backend is None:
+            return
+        snapshot = job.snapshot()
+        now = time.time()
+        if job.owner:
+            if snapshot['status'] == 'failed':
+                self._backend.delete(_CLAIM_NS, job.key)
+            else:
+                self._backend.put(_CLAIM_NS, job.key, dict(snapshot, owner=os.getpid()),
+                                  expires_at=now + (self.ttl if snapshot['status'] == 'done' else self.claim_ttl))
+        alias = snapshot.get('pdf_basename')
+        for name in list(job.names):
+            self._backend.put(_STATUS_NS, name, dict(snapshot, key=job.key, src_path=job.src_path),
+                              alias=alias, expires_at=now + self.ttl)
+
+    def _adopt(self, name: str) -> Tuple[Optional[str], Optional[ConversionJob]]:
+        """Build a local job for a conversion another worker started or finished."""
+        record = self._backend.get(_STATUS_NS, name) or self._backend.get_by_alias(_STATUS_NS, name)
+        if record is None or not record.value or record.value.get('status') == 'failed':
+            return None, None
+        state = record.value
+        with self._lock:
+            existing = self._store.get(record.key)
+            if existing is not None:
+                return record.key, existing
+            job = self._by_key.get(state['key'])
+            if job is not None:
+                job.names.add(record.key)
+                self._store.put(record.key, job)
+                return record.key, job
+            job = ConversionJob(state['key'], record.key, state['src_path'])
+            self._by_key[job.key] = job
+            self._store.put(record.key, job)
+        if state.get('status') == 'done' and state.get('pdf_path') and os.path.exists(state['pdf_path']):
+            job.future.set_running_or_notify_cancel()
+            with self._lock:
+                self._store.add_output(record.key, os.path.basename(state['pdf_path']))
+            job.future.set_result(state['pdf_path'])
+            return record.key, job
+        convert = self._default_convert or _no_converter
+        job.channel.subscribe(lambda _state: self._mirror(job))
+        threading.Thread(target=self._run, args=(job, lambda j: self._follow(j, convert)), daemon=True).start()
+        return record.key, job
@@ -0,0 +1,195 @@
+import multiprocessing
+import os
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows; memory limits are skipped there
+    resource = None
+
+# Imported once in the fork server so recycled workers start without re-importing them
+_PRELOAD = ['document_ops', 'notebook_renderer', 'fitz', 'docx', 'reportlab.platypus']
+
+
+class DocumentTaskError(RuntimeError):
+    """A document task raised, or its worker process died while running it."""
+
+
+class DocumentTaskTimeout(DocumentTaskError):
+    """A document task ran past its timeout (its worker was killed) or never got a worker."""
+
+
+def _peak_rss_bytes() -> int:
+    if resource is None:
+        return 0
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_main(conn, memory_limit: Optional[int]) -> None:
+    """Worker loop: run (func, args, kwargs) messages until told to stop."""
+    if memory_limit and resource is not None:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ValueError, OSError) as e:
+            print(f"\033[33m⚠️\033[0m Could not set document worker memory limit: {e}")
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message is None:
+            return
+        func, args, kwargs, wants_progress = message
+        if wants_progress:
+            kwargs['progress'] = lambda phase: conn.send(('progress', phase))
+        try:
+            reply = ('ok', func(*args, **kwargs))
+        except MemoryError:
+            reply = ('error', 'the document needs more memory than a worker is allowed')
+        except Exception as e:
+            reply = ('error', str(e) or type(e).__name__)
+        conn.send(reply + (_peak_rss_bytes(),))
+
+
+class _Worker:
+    def __init__(self, ctx, memory_limit: Optional[int]):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+            self.process.join(timeout=1)
+        except (OSError, ValueError):
+            pass
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=1)
+        self.conn.close()
+
+
+class DocumentWorkerPool:
+    """Runs CPU-bound document work in separate processes so request threads don't hold the GIL.
+
+    - At most max_workers tasks run at once; callers beyond that wait for a free worker.
+    - run() blocks the calling thread for up to timeout seconds. A task that overruns
+      has its worker killed, so a pathological PDF can't pin a CPU forever.
+    - Each worker's address space is capped at memory_limit_mb (MemoryError inside the
+      task), and workers are replaced after max_tasks_per_worker tasks or once their
+      peak RSS passes recycle_rss_mb, which bounds fragmentation and leaks in C libraries.
+    - Workers are started on first use and forked from a fork server that has already
+      imported PyMuPDF, ReportLab and python-docx.
+
+    Tasks must be picklable module-level functions (see document_ops).
+    """
+
+    def __init__(self, max_workers: int = 2, timeout: float = 120, memory_limit_mb: Optional[int] = 2048,
+                 max_tasks_per_worker: int = 50, recycle_rss_mb: Optional[int] = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self.max_tasks_per_worker = max_tasks_per_worker
+        if recycle_rss_mb is None and memory_limit_mb:
+            recycle_rss_mb = memory_limit_mb * 3 // 4
+        self.recycle_rss = recycle_rss_mb * 1024 * 1024 if recycle_rss_mb else None
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._idle: List[_Worker] = []
+        self._pid = os.getpid()
+        self._ctx = None
+
+    def _context(self):
+        if self._ctx is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                self._ctx = multiprocessing.get_context('forkserver')
+                self._ctx.set_forkserver_preload(_PRELOAD)
+            else:
+                self._ctx = multiprocessing.get_context('spawn')
+        return self._ctx
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked (e.g. by the WSGI server): the parent's workers aren't ours to use
+                self._idle = []
+                self._pid = os.getpid()
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.is_alive():
+                    return worker
+                worker.kill()
+        return _Worker(self._context(), self.memory_limit)
+
+    def _checkin(self, worker: _Worker) -> None:
+        recycle = worker.tasks >= self.max_tasks_per_worker
+        with self._lock:
+            if not recycle and self._pid == os.getpid():
+                self._idle.append(worker)
+                return
+        worker.stop()
+
+    def run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None,
+            progress: Optional[Callable[[str], None]] = None, **kwargs) -> Any:
+        """Run func(*args, **kwargs) in a worker process and return its result.
+
+        If progress is given, func receives a `progress` callable whose calls are
+        relayed to it on this thread. Raises DocumentTaskTimeout or DocumentTaskError.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        name = getattr(func, '__name__', 'task')
+        if not self._slots.acquire(timeout=timeout):
+            raise DocumentTaskTimeout(f"No document worker became free within {timeout}s")
+        worker = None
+        try:
+            worker = self._checkout()
+            worker.conn.send((func, args, kwargs, progress is not None))
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.conn.poll(remaining):
+                    worker.kill()
+                    worker = None
+                    raise DocumentTaskTimeout(f"{name} did not finish within {timeout}s")
+                try:
+                    message = worker.conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(timeout=1)
+                    exitcode = worker.process.exitcode
+                    worker.kill()
+                    worker = None
+                    raise DocumentTaskError(f"{name} crashed its worker process (exit code {exitcode})")
+                if message[0] == 'progress':
+                    try:
+                        progress(message[1])
+                    except Exception as e:
+                        print(f"Progress callback failed: {e}")
+                    continue
+                status, value, peak_rss = message
+                worker.tasks += 1
+                if self.recycle_rss and peak_rss > self.recycle_rss:
+                    worker.tasks = self.max_tasks_per_worker
+                if status == 'error':
+                    raise DocumentTaskError(value)
+                return value
+        finally:
+            if worker is not None:
+                self._checkin(worker)
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
@@ -0,0 +1,454 @@
+"""CPU-bound document operations (PyMuPDF, ReportLab, python-docx, matplotlib).
+
+These run inside DocumentWorkerPool processes, so everything here must be a
+picklable module-level function that takes and returns plain data. Heavy
+libraries are imported lazily so the web process can import this module cheaply.
+"""
+import html
+import os
+import re
+import shutil
+import subprocess
+import uuid
+from io import BytesIO
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def to_roman(n):
+    if not isinstance(n, int) or n <= 0: return str(n)
+    val = [1000, 900, 500, 400, 100, 90, 50, 40, 10, 9, 5, 4, 1]
+    syb = ["M", "CM", "D", "CD", "C", "XC", "L", "XL", "X", "IX", "V", "IV", "I"]
+    roman_num = ''
+    i = 0
+    while n > 0:
+        for _ in range(n // val[i]):
+            roman_num += syb[i]
+            n -= val[i]
+        i += 1
+    return roman_num
+
+def to_alpha(n, uppercase=True):
+    if not isinstance(n, int) or n <= 0: return str(n)
+    result = ""
+    start = 65 if uppercase else 97
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        result = chr(start + remainder) + result
+    return result
+
+def get_doc_stats(filepath):
+    import fitz
+    try:
+        doc = fitz.open(filepath)
+        page_count = len(doc)
+        text = "".join(page.get_text() for page in doc)
+        char_count = len(text)
+        word_count = len(text.split())
+        doc.close()
+        return {'pages': page_count, 'words': word_count, 'characters': char_count}
+    except Exception as e:
+        print(f"Could not get stats for {filepath}: {e}")
+        return {'pages': 0, 'words': 0, 'characters': 0}
+
+def extract_highlights(pdf_path):
+    import fitz
+    from highlight_extractor import HighlightExtractor
+    doc = fitz.open(pdf_path)
+    extractor = HighlightExtractor(doc)
+    highlights = extractor.extract_highlights()
+
+    # Process pages in order and collect highlights with page context
+    for page_num, page in enumerate(doc):
+        page_highlights = []
+        for annot in page.annots():
+            if annot.type[1] == "Highlight":
+                rect = annot.rect
+                words = page.get_text("words", clip=rect)
+                if not words: continue
+
+                # Sort words by their position (left to right, top to bottom)
+                words_sorted = sorted(words, key=lambda w: (round(w[3], 1), w[0]))  # Sort by y_pos, then x_pos
+
+                # Group words into lines based on y-position
+                lines = {}
+                for word in words_sorted:
+                    y_pos = round(word[3], 1)
+                    if y_pos not in lines:
+                        lines[y_pos] = []
+                    lines[y_pos].append(word[4])
+
+                # Process lines in reading order (top to bottom)
+                for y_pos in sorted(lines.keys()):
+                    line_text = ' '.join(lines[y_pos]).strip()
+                    if not line_text: continue
+
+                    # Add page context to maintain document order
+                    highlight_data = {
+                        'text': line_text,
+                        'page': page_num + 1,
+                        'y_pos': y_pos
+                    }
+                    page_highlights.append(highlight_data)
+
+        # Sort page highlights by vertical position and add to main list
+        page_highlights.sort(key=lambda h: h['y_pos'])
+        for highlight in page_highlights:
+            line_text = highlight['text']
+
+            # Improved categorization logic
+            category = categorize_highlight(line_text)
+            highlights.append((category, line_text))
+
+    doc.close()
+    return highlights
+
+def categorize_highlight(text):
+    """Improved categorization logic for highlights"""
+    text = text.strip()
+
+    # Check for headings first (most specific)
+    if re.match(r'^(Chapter|Section|Topic|Lesson|Module|Unit|Part)\s+\d+', text, re.IGNORECASE):
+        return 'heading'
+    if re.match(r'^(AIM:|Objective:|Goal:|Learning Objective:|Key Concept:)', text, re.IGNORECASE):
+        return 'heading'
+    if len(text) < 80 and text.istitle() and not any(char in text for char in '.,!?;:'):
+        return 'heading'
+
+    # Check for code (programming languages)
+    code_keywords = [
+        # Python
+        r'\b(def|class|import|from|if|elif|else|for|while|try|except|with|as|lambda|return|yield)\b',
+        # Java/JavaScript
+        r'\b(public|private|protected|static|void|int|String|function|var|let|const|class|interface)\b',
+        # C/C++/C#
+        r'\b(int|char|float|double|void|struct|class|public|private|protected|static)\b',
+        # SQL
+        r'\b(SELECT|INSERT|UPDATE|DELETE|CREATE|DROP|ALTER|FROM|WHERE|JOIN|GROUP BY|ORDER BY)\b',
+        # General programming
+        r'\b(print|console\.log|System\.out\.println)\b'
+    ]
+
+    code_indicators = [
+        r'[{}();=<>]',  # Common programming symbols
+        r'\[.*\]',      # Array/list access
+        r'\(.*\)\s*{',  # Function definitions
+        r'import\s+.*', # Import statements
+        r'#include',    # C/C++ includes
+    ]
+
+    for keyword in code_keywords:
+        if re.search(keyword, text, re.IGNORECASE):
+            return 'code'
+
+    for indicator in code_indicators:
+        if re.search(indicator, text):
+            return 'code'
+
+    # Check for mathematical expressions
+    math_patterns = [
+        r'[+\-×÷=≠≈≤≥∞∑∫√∛∜∂∇∆∅∈∉⊂⊃∪∩∧∨¬⇒⇔∀∃∄]',  # Mathematical symbols
+        r'\b(sin|cos|tan|log|ln|exp|sqrt|pi|e|alpha|beta|gamma|delta)\b',  # Math functions/constants
+        r'\d+\s*[+\-×÷=]\s*\d+',  # Simple arithmetic
+        r'\b\d+\^\d+\b',  # Exponents
+        r'\b\d+/\d+\b',   # Fractions
+        r'\(\d+\)',       # Parenthesized numbers
+    ]
+
+    for pattern in math_patterns:
+        if re.search(pattern, text):
+            return 'math'
+
+    # Check for lists and bullet points
+    if re.match(r'^[-•*]\s', text):
+        return 'list_item'
+
+    # Check for numbered lists
+    if re.match(r'^\d+[\.)]\s', text):
+        return 'list_item'
+
+    # Check for questions
+    if text.endswith('?') or text.startswith(('What', 'How', 'Why', 'When', 'Where', 'Who')):
+        return 'question'
+
+    # Check for important terms or definitions
+    if ':' in text and len(text.split(':')[0].strip()) < 30:
+        return 'definition'
+
+    # Default to regular text
+    return 'point'
+
+def create_modern_pdf(highlights, output_path):
+    from reportlab.platypus import BaseDocTemplate, Paragraph, Spacer, Frame, PageTemplate, Preformatted, Image
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+
+    left_margin, right_margin, top_margin, bottom_margin = (0.75*inch,) * 4
+
+    class ModernDocTemplate(BaseDocTemplate):
+        def __init__(self, filename, **kw):
+            super().__init__(filename, **kw)
+            frame = Frame(left_margin, bottom_margin, self.width, self.height, id='content_frame')
+            template = PageTemplate(id='main', frames=[frame], onPage=self.page_template)
+            self.addPageTemplates([template])
+
+        def page_template(self, canvas, doc):
+            canvas.saveState()
+            # Clean white background
+            canvas.setFillColor(colors.white)
+            canvas.rect(0, 0, self.pagesize[0], self.pagesize[1], fill=1)
+
+            # Modern header with Hephaestus branding
+            canvas.setFillColor(colors.HexColor("#4a90e2"))  # Professional blue
+            canvas.setFont('Helvetica-Bold', 12)
+            canvas.drawCentredString(self.pagesize[0]/2, self.pagesize[1] - 0.5*inch, "Hephaestus")
+
+            # Clean page number
+            canvas.setFillColor(colors.gray)
+            canvas.setFont('Helvetica', 9)
+            canvas.drawCentredString(self.pagesize[0]/2, 0.5*inch, f"Page {doc.page}")
+            canvas.restoreState()
+
+    doc = ModernDocTemplate(output_path, pagesize=letter)
+    styles = getSampleStyleSheet()
+
+    # Modern, clean styles
+    styles.add(ParagraphStyle(
+        name='ModernHeading',
+        fontName='Helvetica-Bold',
+        fontSize=16,
+        textColor=colors.HexColor("#2c3e50"),  # Dark blue-gray
+        alignment=TA_CENTER,
+        spaceAfter=15,
+        leading=20
+    ))
+
+    styles.add(ParagraphStyle(
+        name='ModernBody',
+        fontName='Helvetica',
+        fontSize=12,
+        textColor=colors.black,
+        spaceAfter=10,
+        leading=16,
+        firstLineIndent=0
+    ))
+
+    styles.add(ParagraphStyle(
+        name='ModernCode',
+        fontName='Courier',
+        fontSize=11,
+        textColor=colors.HexColor("#2c3e50"),
+        backColor=colors.HexColor("#f8f9fa"),  # Light gray background
+        borderColor=colors.HexColor("#dee2e6"),
+        borderWidth=1,
+        borderPadding=8,
+        leading=14,
+        spaceAfter=12
+    ))
+
+    story = []
+
+    # Add title
+    title = Paragraph("Study Notes", styles['ModernHeading'])
+    story.append(title)
+    story.append(Spacer(1, 20))
+
+    # Process highlights without table of contents
+    for item_type, text in highlights:
+        if item_type == 'heading':
+            p = Paragraph(text, styles['ModernHeading'])
+            story.append(p)
+        elif item_type == 'code':
+            p = Preformatted(text, styles['ModernCode'])
+            story.append(p)
+        elif item_type == 'math':
+            try:
+                plt = _pyplot()
+                fig = plt.figure(figsize=(6, 1), facecolor='white')
+                fig.text(0.5, 0.5, f'${text}$', ha='center', va='center', fontsize=20, color='black')
+                img_buf = BytesIO()
+                plt.savefig(img_buf, format='png', transparent=True, bbox_inches='tight', pad_inches=0.1)
+                plt.close(fig)
+                img_buf.seek(0)
+                story.append(Image(img_buf, width=4*inch, height=0.5*inch))
+            except Exception:
+                story.append(Paragraph(text, styles['ModernBody']))
+        else:
+            # Clean bullet points
+            p_text = f'<bullet color="#4a90e2">•</bullet> {html.escape(text)}'
+            story.append(Paragraph(p_text, styles['ModernBody']))
+
+        story.append(Spacer(1, 8))
+
+    doc.build(story)
+
+def create_docx_from_highlights(highlights, output_path):
+    from docx import Document
+    from docx.shared import Pt
+
+    doc = Document()
+    styles = doc.styles
+    if 'Normal' in styles:
+        styles['Normal'].font.name = 'Calibri'
+        styles['Normal'].font.size = Pt(11)
+
+    # Title
+    title = doc.add_paragraph()
+    run = title.add_run('Study Notes')
+    run.bold = True
+    run.font.size = Pt(18)
+
+    for item_type, text in highlights:
+        if item_type == 'heading':
+            p = doc.add_paragraph()
+            r = p.add_run(text)
+            r.bold = True
+            r.font.size = Pt(14)
+        elif item_type == 'code':
+            p = doc.add_paragraph()
+            r = p.add_run(text)
+            r.font.name = 'Courier New'
+            r.font.size = Pt(10)
+        else:
+            p = doc.add_paragraph('• ' + text)
+            p_format = p.paragraph_format
+            p_format.space_after = Pt(6)
+    doc.save(output_path)
+
+def create_docx_from_pdf(pdf_path: str, docx_output_path: str) -> None:
+    import fitz
+    from docx import Document
+    from docx.shared import Inches
+
+    try:
+        pdf = fitz.open(pdf_path)
+        doc = Document()
+        for page in pdf:
+            pix = page.get_pixmap(dpi=144)
+            doc.add_picture(BytesIO(pix.tobytes("png")), width=Inches(6.5))
+        doc.save(docx_output_path)
+    except Exception as e:
+        print(f"Failed to create DOCX from PDF: {e}")
+
+def add_header_footer_to_pdf(input_pdf_path, output_filepath, headers, footers, start_page_num, page_num_placement, page_num_format, overlap_resolution, margin_size, chapter_num, page_num_enabled, hf_enabled):
+    import fitz
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.pdfgen import canvas
+
+    input_doc = fitz.open(input_pdf_path)
+    output_doc = fitz.open()
+    header_y_pos = letter[1] - 0.5*inch
+    footer_y_pos = 0.5*inch
+    hf_x_margin = 0.5*inch
+    # Default to narrow margins (0.1 inch) without user selection
+    content_margin = 0.1*inch
+    total_pages = len(input_doc)
+    last_page_num = start_page_num + total_pages - 1
+    page_num_area, page_num_pos = page_num_placement.split('-')
+    for i, page in enumerate(input_doc):
+        temp_headers = headers.copy()
+        temp_footers = footers.copy()
+        new_page = output_doc.new_page(width=page.rect.width, height=page.rect.height)
+        packet = BytesIO()
+        can = canvas.Canvas(packet, pagesize=(page.rect.width, page.rect.height))
+        can.setFont('Helvetica', 9)
+        current_page_num = start_page_num + i
+        page_num_str = ""
+        if page_num_enabled:
+            format_map = { 'roman_lower': to_roman(current_page_num).lower(), 'roman_upper': to_roman(current_page_num), 'alpha_lower': to_alpha(current_page_num, False), 'alpha_upper': to_alpha(current_page_num), 'dash_x_dash': f"- {current_page_num} -", 'page_x': f"Page {current_page_num}", 'page_x_of_n': f"Page {current_page_num} of {last_page_num}", 'book_style': f"{chapter_num}-{current_page_num}", }
+            page_num_str = format_map.get(page_num_format, str(current_page_num))
+            target_dict = temp_headers if page_num_area == 'header' else temp_footers
+            pos_key = page_num_pos
+            if target_dict.get(pos_key):
+                if overlap_resolution == 'before': target_dict[pos_key] = f"{page_num_str} {target_dict[pos_key]}"
+                else: target_dict[pos_key] = f"{target_dict[pos_key]} {page_num_str}"
+                page_num_str = ""
+        if hf_enabled:
+            can.drawString(hf_x_margin, header_y_pos, temp_headers.get('left', ''))
+            can.drawCentredString(page.rect.width / 2, header_y_pos, temp_headers.get('center', ''))
+            can.drawRightString(page.rect.width - hf_x_margin, header_y_pos, temp_headers.get('right', ''))
+            can.drawString(hf_x_margin, footer_y_pos, temp_footers.get('left', ''))
+            can.drawCentredString(page.rect.width / 2, footer_y_pos, temp_footers.get('center', ''))
+            can.drawRightString(page.rect.width - hf_x_margin, footer_y_pos, temp_footers.get('right', ''))
+        if page_num_str:
+            y_pos = header_y_pos if page_num_area == 'header' else footer_y_pos
+            if page_num_pos == 'left': can.drawString(hf_x_margin, y_pos, page_num_str)
+            elif page_num_pos == 'right': can.drawRightString(page.rect.width - hf_x_margin, y_pos, page_num_str)
+            else: can.drawCentredString(page.rect.width / 2, y_pos, page_num_str)
+        can.save()
+        packet.seek(0)
+        overlay_doc = fitz.open("pdf", packet.read())
+        new_page.show_pdf_page(new_page.rect, overlay_doc, 0)
+        content_rect = fitz.Rect(content_margin, content_margin, page.rect.width - content_margin, page.rect.height - content_margin)
+        new_page.show_pdf_page(content_rect, input_doc, i)
+    output_doc.save(output_filepath)
+    output_doc.close()
+    input_doc.close()
+
+
+def _linearize(src, dst):
+    """Write src to dst linearized ("fast web view"). False if no linearizer is installed.
+
+    MuPDF dropped linearization, so this uses pikepdf or the qpdf command when available.
+    """
+    try:
+        import pikepdf
+    except ImportError:
+        qpdf = shutil.which('qpdf')
+        if qpdf is None:
+            return False
+        # Exit status 3 means success with warnings
+        result = subprocess.run([qpdf, '--linearize', src, dst], capture_output=True, text=True)
+        if result.returncode not in (0, 3):
+            raise RuntimeError(f"qpdf failed: {result.stderr.strip()}")
+        return True
+    with pikepdf.open(src) as pdf:
+        pdf.save(dst, linearize=True)
+    return True
+
+
+def optimize_pdf(path, linearize=True):
+    """Compact a finished PDF in place for fast preview and return the size change.
+
+    Identical objects are merged, unused ones dropped, streams and fonts deflated,
+    objects packed into object streams and embedded fonts subset to the glyphs used.
+    With linearize (and a linearizer available), page one and its resources come first,
+    so a viewer can render it before the rest of the file has arrived. The original is
+    kept if the result is not smaller and isn't linearized.
+    Returns {'before': bytes, 'after': bytes, 'linearized': bool}.
+    """
+    import fitz
+    before = os.path.getsize(path)
+    directory, name = os.path.split(path)
+    compact = os.path.join(directory, f".{name}.{uuid.uuid4().hex}")
+    linear = compact + '.linear'
+    try:
+        doc = fitz.open(path)
+        try:
+            try:
+                doc.subset_fonts()
+            except Exception:
+                # Subsetting is an optimization; fonts it can't handle stay as they are
+                pass
+            doc.save(compact, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, use_objstms=1)
+        finally:
+            doc.close()
+        linearized = bool(linearize) and _linearize(compact, linear)
+        result = linear if linearized else compact
+        if linearized or os.path.getsize(result) < before:
+            os.replace(result, path)
+        else:
+            linearized = False
+    finally:
+        for leftover in (compact, linear):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return {'before': before, 'after': os.path.getsize(path), 'linearized': linearized}
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from job_store import JobStatusStore
+from progress_events import ProgressChannel
+from state_backend import StateBackend
+
+# StateBackend namespace for per-download_id status rows
+_STATUS_NS = 'downloads'
+# Downloaders report every few KB; publish (and mirror) at most this often per job
+_PUBLISH_INTERVAL = 0.25
+
+
+class DownloadJob:
+    """One background download. The future resolves to the path of the finished file."""
+
+    def __init__(self, key: str, url: str):
+        self.key = key
+        self.url = url
+        self.future: Future = Future()
+        self.created = time.time()
+        self.ids = set()
+        self.channel = ProgressChannel(status='queued', downloadedBytes=0, totalBytes=None)
+        self._last_report = 0.0
+        self.future.add_done_callback(self._finished)
+
+    def report(self, downloaded: int, total: Optional[int] = None) -> None:
+        """Progress hook target: bytes written so far and the expected size, if known."""
+        if self.future.done():
+            return
+        now = time.monotonic()
+        if now - self._last_report < _PUBLISH_INTERVAL and not (total and downloaded >= total):
+            return
+        self._last_report = now
+        self.channel.publish(status='downloading', downloadedBytes=downloaded, totalBytes=total)
+
+    def set_title(self, title: Optional[str]) -> None:
+        if title:
+            self.channel.publish(title=title)
+
+    def _finished(self, future: Future) -> None:
+        if future.cancelled():
+            self.channel.publish(status='failed', error='Download cancelled')
+        elif future.exception() is not None:
+            self.channel.publish(status='failed', error=str(future.exception()))
+        else:
+            path = future.result()
+            size = os.path.getsize(path) if os.path.exists(path) else self.channel.state['downloadedBytes']
+            self.channel.publish(status='done', filename=os.path.basename(path), downloadedBytes=size, totalBytes=size)
+
+    @property
+    def path(self) -> Optional[str]:
+        if self.future.done() and not self.future.cancelled() and self.future.exception() is None:
+            return self.future.result()
+        return None
+
+    def is_reusable(self) -> bool:
+        """A job can be shared while it is running or if its file is still on disk."""
+        if not self.future.done():
+            return True
+        path = self.path
+        return bool(path and os.path.exists(path))
+
+    def snapshot(self) -> Dict:
+        """Status dict for the status and SSE endpoints."""
+        state = self.channel.state
+        total = state.get('totalBytes')
+        if state['status'] == 'done':
+            state['progress'] = 100
+        else:
+            state['progress'] = min(99, int(state['downloadedBytes'] * 100 / total)) if total else None
+        return state
+
+
+class DownloadJobs:
+    """Runs downloads on a small thread pool so request threads return immediately.
+
+    Jobs are addressed by the client's download_id. Requests for the same media key
+    share one job while it runs or while its file is still on disk, so two tabs asking
+    for one video download it once. With a StateBackend, snapshots are mirrored so any
+    worker can answer status polls; finished jobs expire ttl seconds after last use.
+    """
+
+    def __init__(self, max_workers: int = 2, ttl: float = 600, backend: Optional[StateBackend] = None):
+        self.ttl = ttl
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, DownloadJob] = {}
+        self._store = JobStatusStore(ttl, is_evictable=lambda job: job.future.done())
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download')
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def start(self, download_id: str, key: str, url: str, download: Callable[[DownloadJob], str]) -> DownloadJob:
+        """Return the job for download_id, starting `download(job)` only if no job for key is usable."""
+        with self._lock:
+            job = self._store.get(download_id)
+            if job is not None:
+                return job
+            job = self._by_key.get(key)
+            new = job is None or not job.is_reusable()
+            if new:
+                job = DownloadJob(key, url)
+                self._by_key[key] = job
+            job.ids.add(download_id)
+            self._store.put(download_id, job)
+        if new:
+            if self._backend is not None:
+                job.channel.subscribe(lambda state: self._mirror(job))
+            self._executor.submit(self._run, job, download)
+        self._mirror(job)
+        return job
+
+    def get(self, download_id: str) -> Optional[DownloadJob]:
+        return self._store.get(download_id)
+
+    def status(self, download_id: str) -> Optional[Dict]:
+        """Snapshot of download_id's job, from this process or (if another worker runs it) the backend."""
+        job = self.get(download_id)
+        if job is not None:
+            return job.snapshot()
+        if self._backend is not None:
+            record = self._backend.get(_STATUS_NS, download_id)
+            if record is not None and record.expires_at > time.time():
+                return record.value
+        return None
+
+    def touch(self, download_id: str) -> None:
+        self._store.touch(download_id)
+        if self._backend is not None:
+            self._backend.touch(_STATUS_NS, download_id, time.time() + self.ttl)
+
+    def evict_expired(self) -> int:
+        evicted = self._store.evict_expired()
+        with self._lock:
+            for job in evicted:
+                if self._by_key.get(job.key) is job and not any(self._store.get(i) is job for i in job.ids):
+                    del self._by_key[job.key]
+        if self._backend is not None:
+            self._backend.purge_expired(_STATUS_NS, time.time())
+        return len(evicted)
+
+    def _run(self, job: DownloadJob, download: Callable[[DownloadJob], str]) -> None:
+        if not job.future.set_running_or_notify_cancel():
+            return
+        job.channel.publish(status='downloading')
+        try:
+            path = download(job)
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        job.future.set_result(path)
+
+    def _mirror(self, job: DownloadJob) -> None:
+        if self._backend is None:
+            return
+        snapshot = job.snapshot()
+        expires_at = time.time() + self.ttl
+        for download_id in list(job.ids):
+            self._backend.put(_STATUS_NS, download_id, snapshot, expires_at=expires_at)
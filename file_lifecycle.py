@@ -0,0 +1,311 @@
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from state_backend import StateBackend
+
+# How long a pin held by a worker is honoured if that worker dies without releasing it
+PIN_LEASE = 3600
+# Quota inputs that cost a directory scan (in-progress bytes) or a namespace-wide SUM
+# (the shared total) are reused for this long, so a touch stays O(log n)
+QUOTA_CACHE_SECONDS = 1.0
+
+
+class FileLifecycleManager:
+    """Tracks temp files by last access and deletes them when they age out or space runs short.
+
+    - Expiry uses a min-heap of (expires_at, filename); touching a file pushes a new
+      entry and stale ones are skipped when popped, so each expiry costs O(log n).
+    - Recency is an OrderedDict, so picking the least-recently-used file is O(1).
+    - Pinned files (e.g. being streamed to a client) are never deleted; an expired
+      pinned file is re-checked one ttl later. hold() pins a file for a fixed time
+      instead, for handoffs with no end to hook (a proxy opening it later).
+    - With a shared StateBackend, access times, sizes and pins are mirrored there so
+      workers sharing the directory agree on what is idle, pinned and over quota.
+    - Only existing files inside directory are tracked or deleted. Hidden files are
+      writes in progress (download parts, PDF rewrites): they are never tracked, but
+      their bytes count against the quota. Those bytes and the shared total are
+      re-read at most every QUOTA_CACHE_SECONDS; eviction itself always re-reads.
+    """
+
+    def __init__(self, directory: str, ttl: float, max_bytes: Optional[int] = None,
+                 on_evict: Optional[Callable[[str], None]] = None, backend: Optional[StateBackend] = None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._on_evict = on_evict
+        self._backend = backend
+        self._cond = threading.Condition(threading.RLock())
+        self._lru: 'OrderedDict[str, int]' = OrderedDict()  # filename -> size, least recent first
+        self._expires: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._pins: Dict[str, int] = {}
+        self._quota_cache: Dict[str, Tuple[float, int]] = {}  # name -> (read at, bytes)
+        self._room_failed_at = float('-inf')
+        self._holds: Dict[str, float] = {}  # filename -> held until
+        self._total = 0
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._lru)
+
+    @property
+    def total_bytes(self) -> int:
+        if self._backend is not None:
+            return self._cached('shared_total', lambda: self._backend.total_weight('files'))
+        return self._total
+
+    def _cached(self, name: str, read: Callable[[], int]) -> int:
+        """read(), reusing the last result for QUOTA_CACHE_SECONDS."""
+        now = time.monotonic()
+        with self._cond:
+            cached = self._quota_cache.get(name)
+        if cached is not None and now - cached[0] < QUOTA_CACHE_SECONDS:
+            return cached[1]
+        value = read()
+        with self._cond:
+            self._quota_cache[name] = (now, value)
+        return value
+
+    def _over_quota(self) -> bool:
+        return self.total_bytes + self._cached('in_progress', self._in_progress_bytes) > self.max_bytes
+
+    def _make_room_after_touch(self, filename: str) -> None:
+        # While pinned files keep the directory over quota, don't retry on every access
+        now = time.monotonic()
+        with self._cond:
+            if now - self._room_failed_at < QUOTA_CACHE_SECONDS:
+                return
+        if not self.make_room(0, keep=filename):
+            with self._cond:
+                self._room_failed_at = now
+
+    def _path(self, filename: str) -> Optional[str]:
+        """Absolute path of filename, or None if it would resolve outside directory."""
+        if not filename:
+            return None
+        root = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(root, filename))
+        if path == root or os.path.commonpath([root, path]) != root:
+            return None
+        return path
+
+    def touch(self, filename: str) -> bool:
+        """Record an access (and the current size) of filename, then enforce the quota.
+
+        Returns False, tracking nothing, unless filename is an existing, visible file
+        inside directory (request paths end up here, so '../state.db' must not).
+        """
+        path = self._path(filename)
+        if path is None or os.path.basename(filename).startswith('.'):
+            return False
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        expires_at = time.time() + self.ttl
+        with self._cond:
+            self._total += size - self._lru.pop(filename, 0)
+            self._lru[filename] = size
+            # Only wake the cleanup thread if this is now the first thing due
+            if self._schedule(filename, expires_at):
+                self._cond.notify_all()
+        if self._backend is not None:
+            self._backend.put('files', filename, weight=size, expires_at=expires_at)
+        if self.max_bytes is not None and self._over_quota():
+            self._make_room_after_touch(filename)
+        return True
+
+    def _in_progress_bytes(self) -> int:
+        """Bytes in hidden (still being written) files; preallocated files count in full."""
+        total = 0
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') and entry.is_file(follow_symlinks=False):
+                        try:
+                            total += entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+        return total
+
+    def pin(self, filename: str) -> None:
+        with self._cond:
+            count = self._pins.get(filename, 0) + 1
+            self._pins[filename] = count
+        if count == 1 and self._backend is not None:
+            self._backend.put('pins', self._pin_key(filename), alias=filename, expires_at=time.time() + PIN_LEASE)
+
+    def unpin(self, filename: str) -> None:
+        with self._cond:
+            count = self._pins.get(filename, 0) - 1
+            if count > 0:
+                self._pins[filename] = count
+            else:
+                self._pins.pop(filename, None)
+        if count <= 0 and self._backend is not None:
+            self._backend.delete('pins', self._pin_key(filename))
+        # Restart the idle clock from the end of the transfer
+        self.touch(filename)
+
+    def hold(self, filename: str, seconds: float) -> None:
+        """Keep filename from being deleted for the next `seconds`, without a matching unpin."""
+        until = time.time() + seconds
+        with self._cond:
+            self._holds[filename] = max(until, self._holds.get(filename, 0))
+        if self._backend is not None:
+            self._backend.put('pins', self._pin_key(filename) + ':hold', alias=filename, expires_at=until)
+
+    @staticmethod
+    def _pin_key(filename: str) -> str:
+        return f"{os.getpid()}:{filename}"
+
+    def _pinned_locked(self, filename: str, now: float) -> bool:
+        if filename in self._pins:
+            return True
+        until = self._holds.get(filename)
+        if until is not None and until <= now:
+            del self._holds[filename]
+            return False
+        return until is not None
+
+    def is_pinned(self, filename: str) -> bool:
+        now = time.time()
+        with self._cond:
+            if self._pinned_locked(filename, now):
+                return True
+        return self._backend is not None and self._backend.has_live_alias('pins', filename, now)
+
+    @contextmanager
+    def pinned(self, *filenames: str):
+        """Keep filenames from being deleted for the duration of the block."""
+        for filename in filenames:
+            self.pin(filename)
+        try:
+            yield
+        finally:
+            for filename in filenames:
+                self.unpin(filename)
+
+    def make_room(self, needed_bytes: int, keep: Optional[str] = None) -> bool:
+        """Evict least-recently-used unpinned files until needed_bytes fit in the quota."""
+        if self.max_bytes is None:
+            return True
+        in_progress = self._in_progress_bytes()
+        with self._cond:
+            self._quota_cache['in_progress'] = (time.monotonic(), in_progress)
+        needed_bytes += in_progress
+        if self._backend is not None:
+            return self._make_room_shared(needed_bytes, keep)
+        victims = []
+        now = time.time()
+        with self._cond:
+            for filename in list(self._lru):
+                if self._total + needed_bytes <= self.max_bytes:
+                    break
+                if filename == keep or self._pinned_locked(filename, now):
+                    continue
+                victims.append(filename)
+                self._forget_locked(filename)
+            fits = self._total + needed_bytes <= self.max_bytes
+        for filename in victims:
+            self._delete(filename, 'over disk quota')
+        return fits
+
+    def _make_room_shared(self, needed_bytes: int, keep: Optional[str]) -> bool:
+        # The backend orders records by expiry, i.e. by last access across all workers
+        total = self._backend.total_weight('files')
+        for record in self._backend.oldest('files', limit=1000):
+            if total + needed_bytes <= self.max_bytes:
+                break
+            if record.key == keep or self.is_pinned(record.key):
+                continue
+            total -= record.weight
+            with self._cond:
+                self._forget_locked(record.key)
+            self._delete(record.key, 'over disk quota')
+        with self._cond:
+            self._quota_cache['shared_total'] = (time.monotonic(), total)
+        return total + needed_bytes <= self.max_bytes
+
+    def evict_expired(self, now: Optional[float] = None) -> List[str]:
+        """Delete every file whose idle time has passed ttl. Returns the deleted names."""
+        now = time.time() if now is None else now
+        candidates = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, filename = heapq.heappop(self._heap)
+                if self._expires.get(filename) != expires_at:
+                    continue  # touched again since, or already evicted
+                candidates.append(filename)
+        if self._backend is not None:
+            candidates.extend(record.key for record in self._backend.expired('files', now, limit=500))
+
+        victims = []
+        for filename in dict.fromkeys(candidates):
+            if self._backend is not None:
+                record = self._backend.get('files', filename)
+                if record is not None and record.expires_at and record.expires_at > now:
+                    # Another worker used it more recently
+                    with self._cond:
+                        self._schedule(filename, record.expires_at)
+                    continue
+            if self.is_pinned(filename):
+                with self._cond:
+                    self._schedule(filename, now + self.ttl)
+                if self._backend is not None:
+                    self._backend.touch('files', filename, now + self.ttl)
+                continue
+            with self._cond:
+                self._forget_locked(filename)
+            victims.append(filename)
+            self._delete(filename, 'aged')
+        return victims
+
+    def wait_for_next_expiry(self, max_wait: float) -> None:
+        """Sleep until the earliest scheduled expiry (or max_wait, or a new touch)."""
+        with self._cond:
+            delay = max_wait
+            if self._heap:
+                delay = min(max_wait, max(0.0, self._heap[0][0] - time.time()))
+            if delay > 0:
+                self._cond.wait(timeout=delay)
+
+    def _schedule(self, filename: str, expires_at: float) -> bool:
+        """Set filename's expiry. True if it is now the earliest deadline."""
+        earliest = not self._heap or expires_at < self._heap[0][0]
+        self._expires[filename] = expires_at
+        heapq.heappush(self._heap, (expires_at, filename))
+        # Rebuild once stale entries from repeated touches dominate the heap
+        if len(self._heap) > 4 * len(self._expires) + 64:
+            self._heap = [(exp, name) for name, exp in self._expires.items()]
+            heapq.heapify(self._heap)
+        return earliest
+
+    def _forget_locked(self, filename: str) -> None:
+        self._total -= self._lru.pop(filename, 0)
+        self._expires.pop(filename, None)
+
+    def _delete(self, filename: str, reason: str) -> None:
+        filepath = self._path(filename)
+        try:
+            if filepath is None:
+                print(f"\033[33m⚠️\033[0m Refusing to remove {filename}: outside {self.directory}")
+            elif os.path.exists(filepath):
+                os.remove(filepath)
+                print(f"\033[32m✓\033[0m Cleaned up {reason} file: {filename}")
+        except Exception as e:
+            print(f"\033[33m⚠️\033[0m Could not remove {reason} file {filename}: {e}")
+        if self._backend is not None:
+            self._backend.delete('files', filename)
+        if self._on_evict:
+            try:
+                self._on_evict(filename)
+            except Exception as e:
+                print(f"\033[33m⚠️\033[0m Eviction hook failed for {filename}: {e}")
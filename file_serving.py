@@ -0,0 +1,212 @@
+"""Serving lifecycle-managed files without copying them through Python.
+
+By default a full-body response hands the WSGI server a real file object, so
+gunicorn (and most servers) transfer it with the kernel's sendfile() instead of
+read/write loops in a worker thread. Range requests bypass the server's
+wsgi.file_wrapper, which can't seek, and use werkzeug's FileWrapper, which seeks
+to the range start. Servers without a file_wrapper (the ASGI gateway's WSGI bridge)
+stream every response through FileWrapper. Behind nginx or
+Apache, FILE_OFFLOAD makes the response an empty X-Accel-Redirect / X-Sendfile
+reply and the proxy does the transfer itself. The file stays pinned in the
+FileLifecycleManager until the server closes it. An offloaded file is opened by
+the proxy only after the reply has left the app, so it stays held for
+offload_hold seconds after that.
+
+ETags are strong and derived from the file's bytes (cached per inode, mtime and
+size), so a regenerated but identical output still revalidates with a 304. A URL
+carrying the current version (see version()) names content that can't change and
+is sent with an immutable Cache-Control.
+"""
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+from file_lifecycle import FileLifecycleManager
+
+OFFLOAD_MODES = ('', 'x-sendfile', 'x-accel')
+# Files up to this size get an ETag hashed from their bytes. Larger ones (videos, which
+# are written once) hash their inode, mtime and size instead of being read in full.
+CONTENT_ETAG_LIMIT = 64 * 1024 * 1024
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+# Precompressed siblings (see frontend_build), in order of preference
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+_DIGEST_CACHE_SIZE = 2048
+
+
+class PinnedFile(io.FileIO):
+    """A file opened for reading that calls on_close once, when the server closes it.
+
+    It is a plain FileIO, so servers that use sendfile() still see a real fileno().
+    """
+
+    def __init__(self, path: str, on_close: Callable[[], None]):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class FileServer:
+    """Sends files from a lifecycle-managed directory (see module docstring).
+
+    offload is '' (serve locally), 'x-sendfile' (Apache mod_xsendfile, lighttpd) or
+    'x-accel' (nginx: offload_prefix is an `internal` location aliasing directory).
+    """
+
+    def __init__(self, directory: str, lifecycle: FileLifecycleManager, offload: str = '',
+                 offload_prefix: str = '/_files/', offload_hold: float = 60.0):
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"FILE_OFFLOAD must be one of {', '.join(repr(m) for m in OFFLOAD_MODES)}")
+        self.directory = os.path.abspath(directory)
+        self.offload = offload
+        self.offload_prefix = '/' + offload_prefix.strip('/') + '/'
+        self.offload_hold = offload_hold
+        self._lifecycle = lifecycle
+        self._lock = threading.Lock()
+        self._digests: 'OrderedDict[Tuple, str]' = OrderedDict()
+
+    def etag(self, path: str) -> str:
+        """Strong validator for path: a digest of its content (see CONTENT_ETAG_LIMIT)."""
+        stat = os.stat(path)
+        key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        hasher = hashlib.blake2b(digest_size=16)
+        if stat.st_size <= CONTENT_ETAG_LIMIT:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(block)
+        else:
+            hasher.update(repr(key).encode())
+        digest = hasher.hexdigest()
+        with self._lock:
+            self._digests[key] = digest
+            while len(self._digests) > _DIGEST_CACHE_SIZE:
+                self._digests.popitem(last=False)
+        return digest
+
+    def version(self, filename: str) -> Optional[str]:
+        """Short content version of filename in directory, for cache-busting URLs; None if missing."""
+        path = safe_join(self.directory, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        try:
+            return self.etag(path)[:16]
+        except OSError:
+            return None
+
+    def send(self, directory: str, filename: str, as_attachment: bool = False,
+             download_name: Optional[str] = None, mimetype: Optional[str] = None, immutable: bool = False):
+        """Response for directory/filename (404 if missing), pinning filename for the transfer.
+
+        immutable marks the response as cacheable forever; pass it only for URLs that
+        name the content (e.g. carry its version).
+        """
+        path = safe_join(os.path.abspath(directory), filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        kwargs = dict(as_attachment=as_attachment, download_name=download_name or os.path.basename(path),
+                      mimetype=mimetype)
+        relative = os.path.relpath(path, self.directory)
+        self._lifecycle.pin(filename)
+        try:
+            if self.offload and not relative.startswith(os.pardir):
+                response = self._offloaded(path, relative, filename, kwargs)
+            else:
+                response = self._local(path, filename, kwargs)
+        except BaseException:
+            self._lifecycle.unpin(filename)
+            raise
+        if immutable:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            response.headers.pop('Expires', None)
+        return response
+
+    def _local(self, path: str, filename: str, kwargs):
+        stat = os.stat(path)
+        file = PinnedFile(path, lambda: self._lifecycle.unpin(filename))
+        environ = request.environ
+        if 'HTTP_RANGE' in environ:
+            # The server's file_wrapper (gunicorn's) has no seekable(), so werkzeug would read
+            # and discard everything before the range; its own FileWrapper seeks instead
+            environ = {key: value for key, value in environ.items() if key != 'wsgi.file_wrapper'}
+        try:
+            # Conditional handling is done below: werkzeug only supports ranges for paths,
+            # and a path would be opened as a buffered file we can't hook close() on
+            response = send_file(file, environ, conditional=False, last_modified=stat.st_mtime,
+                                 etag=self.etag(path), max_age=current_app.get_send_file_max_age(path), **kwargs)
+            response.content_length = stat.st_size
+            response = response.make_conditional(request.environ, accept_ranges=True, complete_length=stat.st_size)
+            # Advertised on full responses too: PDF viewers only switch to range loading if they see it
+            response.accept_ranges = 'bytes'
+            return response
+        except BaseException:
+            # send() unpins on failure, so close without the callback
+            file._on_close = None
+            file.close()
+            raise
+
+    def _offloaded(self, path: str, relative: str, filename: str, kwargs):
+        # The proxy handles ranges and conditional requests itself
+        response = send_file(path, request.environ, use_x_sendfile=True, conditional=False, etag=False,
+                             max_age=current_app.get_send_file_max_age(path), **kwargs)
+        if self.offload == 'x-accel':
+            del response.headers['X-Sendfile']
+            response.headers['X-Accel-Redirect'] = self.offload_prefix + quote(relative.replace(os.sep, '/'))
+        response.headers.pop('Content-Length', None)
+        # Nothing to stream, so let close() run the callbacks. That happens before the
+        # proxy opens the file, so keep it for offload_hold more seconds; once opened,
+        # eviction can unlink it without cutting the transfer short.
+        response.direct_passthrough = False
+        response.call_on_close(lambda: self._release_offloaded(filename))
+        return response
+
+    def _release_offloaded(self, filename: str) -> None:
+        self._lifecycle.hold(filename, self.offload_hold)
+        self._lifecycle.unpin(filename)
+
+
+def send_precompressed(directory: str, filename: str, immutable: bool = False):
+    """Send directory/filename, or its .br/.gz sibling when the client accepts that encoding.
+
+    immutable is for content-hashed names: cacheable by anyone, forever.
+    """
+    path = safe_join(os.path.abspath(directory), filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    chosen, encoding = path, None
+    for name, suffix in PRECOMPRESSED:
+        if request.accept_encodings[name] and os.path.isfile(path + suffix):
+            chosen, encoding = path + suffix, name
+            break
+    # Each variant has its own ETag (werkzeug's is derived from the path), so caches keep them apart
+    response = send_file(chosen, request.environ, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                         download_name=filename, conditional=True, etag=True, max_age=None)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if immutable:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response.headers.pop('Expires', None)
+    return response
@@ -0,0 +1,120 @@
+"""Build the production frontend: JSX compiled ahead of time, minified, content-hashed
+and precompressed.
+
+    python frontend_build.py
+
+templates/index.html stays the source, and works unbuilt: its text/babel scripts are
+compiled in the browser by @babel/standalone. The build compiles those scripts (the
+inline app and the files it references) into one minified bundle with esbuild, names
+it by content hash and writes static/dist/index.html with the Babel loader replaced
+by that bundle. Every output gets .gz and, if the brotli package is installed, .br
+siblings, so the server never compresses on the fly.
+
+esbuild runs as `npx --yes esbuild@<ESBUILD_VERSION>` unless ESBUILD names a binary.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import shlex
+import subprocess
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(ROOT, 'templates', 'index.html')
+STATIC_DIR = os.path.join(ROOT, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+# URL prefix the app serves DIST_DIR under (see the /assets route)
+ASSET_URL = '/assets/'
+ESBUILD_VERSION = '0.21.5'
+
+_URL_FOR = re.compile(r"\{\{\s*url_for\('static',\s*filename='([^']+)'\)\s*\}\}")
+_BABEL_SCRIPT = re.compile(r'<script type="text/babel"(?:\s+src="([^"]*)")?\s*>(.*?)</script>', re.S)
+_BABEL_LOADER = re.compile(r'\n[ \t]*<script src="[^"]*@babel/standalone[^"]*"></script>')
+_BABEL_NOTE = re.compile(r'\n[ \t]*<!-- These files contain JSX;[^>]*-->')
+_BUNDLE_MARK = '<!--bundle-->'
+
+
+def dev_page() -> str:
+    """The unbuilt page with static URLs filled in (JSX is compiled in the browser)."""
+    with open(SOURCE, encoding='utf-8') as f:
+        return _URL_FOR.sub(lambda m: f"/static/{m.group(1)}", f.read())
+
+
+def compile_jsx(source: str) -> str:
+    """Compile and minify JSX to plain ES2018 with esbuild (React.createElement, as Babel does)."""
+    command = shlex.split(os.environ['ESBUILD']) if os.environ.get('ESBUILD') else \
+        ['npx', '--yes', f'esbuild@{ESBUILD_VERSION}']
+    result = subprocess.run(command + ['--loader=jsx', '--minify', '--target=es2018',
+                                       '--jsx-factory=React.createElement', '--jsx-fragment=React.Fragment'],
+                            input=source, capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(f"esbuild failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def _write_precompressed(path: str, data: bytes) -> Dict[str, int]:
+    """Write data plus .gz/.br siblings (kept only when smaller). Returns the size of each."""
+    sizes = {'identity': len(data)}
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        variants['.br'] = brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    with open(path, 'wb') as f:
+        f.write(data)
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            sizes[suffix.lstrip('.')] = len(compressed)
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return sizes
+
+
+def build(source: str = SOURCE, dist: str = DIST_DIR) -> Dict[str, str]:
+    """Build dist/ from source and return the manifest written to dist/manifest.json."""
+    with open(source, encoding='utf-8') as f:
+        html = _URL_FOR.sub(lambda m: f"/static/{m.group(1)}", f.read())
+
+    scripts = []
+
+    def collect(match):
+        src, body = match.group(1), match.group(2)
+        if src:
+            with open(os.path.join(STATIC_DIR, src[len('/static/'):]), encoding='utf-8') as f:
+                body = f.read()
+        scripts.append(body)
+        # Babel runs these after parsing, in order; a deferred bundle at the first one does the same
+        return _BUNDLE_MARK if len(scripts) == 1 else ''
+
+    html = _BABEL_SCRIPT.sub(collect, html)
+    if not scripts:
+        raise RuntimeError(f"No text/babel scripts in {source}")
+    bundle = compile_jsx('\n;\n'.join(scripts)).encode('utf-8')
+    bundle_name = f"app.{hashlib.sha256(bundle).hexdigest()[:12]}.js"
+    html = _BABEL_NOTE.sub('', _BABEL_LOADER.sub('', html))
+    html = html.replace(_BUNDLE_MARK, f'<script defer src="{ASSET_URL}{bundle_name}"></script>')
+
+    os.makedirs(dist, exist_ok=True)
+    bundle_sizes = _write_precompressed(os.path.join(dist, bundle_name), bundle)
+    page_sizes = _write_precompressed(os.path.join(dist, 'index.html'), html.encode('utf-8'))
+    manifest = {'index': 'index.html', 'bundle': bundle_name}
+    with open(os.path.join(dist, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    for stale in glob.glob(os.path.join(glob.escape(dist), 'app.*.js*')):
+        if not os.path.basename(stale).startswith(bundle_name):
+            os.remove(stale)
+
+    for name, sizes in ((bundle_name, bundle_sizes), ('index.html', page_sizes)):
+        print(f"\033[32m✓\033[0m {name}: " + ', '.join(f"{encoding} {size / 1024:.1f} KB"
+                                                    for encoding, size in sizes.items()))
+    return manifest
+
+
+if __name__ == '__main__':
+    build()
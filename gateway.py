@@ -0,0 +1,324 @@
+"""ASGI entry point that relays long-lived media streams on an asyncio event loop.
+
+Under the WSGI server every proxied download or merge holds a worker thread for as
+long as the client takes to receive it, so a handful of slow phones can exhaust the
+pool. Here /proxy_download is fully async (httpx), and the ffmpeg-backed merge and
+audio streams only borrow a thread for each chunk read, never while waiting on the
+client. The conversion and download progress streams (SSE) wait on the event loop
+too, so an open browser tab costs no thread. Every other route, and stored files,
+go to the Flask app, each request on a thread of its own (WSGI_THREADS of them).
+
+Run with e.g. `uvicorn gateway:application --port 5000`.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+
+import app as luminar
+import upstream
+from admission import Rejected
+from progress_events import RECONNECT_MS, SSE_HEADERS, ProgressChannel, event_id, format_sse
+from stream_merge import AUDIO_MIMETYPES, MergeBusy
+
+RELAY_CHUNK = 64 * 1024
+# Threads running Flask requests; each blocking request holds one until it returns
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 32))
+# Progress streams here hold no thread, so they can last; the cap only bounds a stuck job
+SSE_MAX_DURATION = 3600
+SSE_HEARTBEAT = 15
+
+_wsgi = WSGIMiddleware(luminar.application, workers=WSGI_THREADS)
+_services = luminar.services(luminar.application)
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http_client() -> httpx.AsyncClient:
+    """The process-wide httpx client (created on first use, inside the event loop)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(follow_redirects=True, limits=httpx.Limits(
+            max_connections=upstream.POOL_SIZE * 4, max_keepalive_connections=upstream.POOL_SIZE))
+    return _client
+
+
+def _header(scope, name: str) -> Optional[str]:
+    key = name.lower().encode('latin-1')
+    for header, value in scope['headers']:
+        if header == key:
+            return value.decode('latin-1')
+    return None
+
+
+def _client_ip(scope) -> str:
+    """The client's address, read from X-Forwarded-For the way ProxyFix does behind PROXY_HOPS proxies."""
+    hops = luminar.application.config['PROXY_HOPS']
+    forwarded = _header(scope, 'X-Forwarded-For') if hops else None
+    if forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        if len(addresses) >= hops:
+            return addresses[-hops]
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+async def _respond(send, status: int, body: str, headers=None) -> None:
+    payload = body.encode('utf-8')
+    raw = [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(payload)).encode())]
+    raw += [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in (headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _relay(receive, send, status: int, headers: dict, chunks) -> None:
+    """Send an async chunk iterator to the client, stopping as soon as the client goes away.
+
+    send() only returns once the server has accepted each chunk, so a slow reader pulls
+    from the upstream no faster than it can receive.
+    """
+    raw = [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw})
+        async for chunk in chunks:
+            if disconnected.is_set():
+                return
+            await send({'type': 'http.response.body', 'body': bytes(chunk), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        # Runs the iterator's own cleanup (closing the upstream response or ffmpeg) now
+        await chunks.aclose()
+
+
+async def _open_upstream(url: str, headers: dict) -> httpx.Response:
+    """Async counterpart of upstream.open_stream: same timeouts, retries and circuit breakers."""
+    request_headers = {'Accept-Encoding': 'identity'}
+    request_headers.update(headers)
+    host = urlsplit(url).hostname or ''
+    connect, read = upstream.host_timeout(host)
+    timeout = httpx.Timeout(read, connect=connect)
+    client = _http_client()
+    for attempt in range(upstream.RETRIES + 1):
+        upstream.health.before(host)
+        started = time.monotonic()
+        try:
+            response = await client.send(client.build_request('GET', url, headers=request_headers, timeout=timeout),
+                                         stream=True)
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            upstream.health.record(host, None, ok=False, error=type(e).__name__)
+            if attempt == upstream.RETRIES:
+                raise
+        else:
+            ok = response.status_code < 500
+            upstream.health.record(host, time.monotonic() - started, ok=ok,
+                                   error=None if ok else f'HTTP {response.status_code}')
+            if response.status_code not in upstream.RETRY_STATUSES or attempt == upstream.RETRIES:
+                return response
+            await response.aclose()
+        await asyncio.sleep(random.uniform(0, upstream.RETRY_BACKOFF * 2 ** attempt))
+
+
+async def proxy_download(scope, receive, send, args) -> None:
+    url = args.get('url')
+    filename = args.get('filename', 'download.mp4')
+    if not url:
+        return await _respond(send, 400, "Missing URL")
+    forwarded = {name: value for name in luminar.PROXY_REQUEST_HEADERS
+                 if (value := _header(scope, name)) is not None}
+    try:
+        r = await _open_upstream(url, forwarded)
+    except upstream.CircuitOpen as e:
+        return await _respond(send, 503, f"Failed to fetch media: {e}", {'Retry-After': max(1, int(e.retry_after))})
+    except Exception as e:
+        return await _respond(send, 502, f"Failed to fetch media: {e}")
+    try:
+        if r.status_code not in (200, 206, 304, 416):
+            return await _respond(send, 502, f"Failed to fetch media: upstream returned {r.status_code}")
+        headers = {name: r.headers[name] for name in luminar.PROXY_RESPONSE_HEADERS if name in r.headers}
+        headers['Content-Disposition'] = f'attachment;filename="{filename}"'
+
+        async def body():
+            if r.status_code not in (200, 206):
+                return
+            try:
+                async for chunk in r.aiter_raw(RELAY_CHUNK):
+                    yield chunk
+            except httpx.HTTPError as e:
+                # A stall or reset mid-body counts against the host like a failed request
+                host = urlsplit(url).hostname or ''
+                upstream.health.record(host, None, ok=False, error=type(e).__name__)
+                raise
+        await _relay(receive, send, r.status_code, headers, body())
+    finally:
+        await r.aclose()
+
+
+async def _iterate_in_thread(iterable):
+    """Async view of a blocking iterator: each next() runs on the default executor."""
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Closing kills ffmpeg and joins its feeders, which blocks
+        if hasattr(iterable, 'close'):
+            await loop.run_in_executor(None, iterable.close)
+
+
+async def _ffmpeg_stream(scope, receive, send, endpoint: str, cost: float, store_key: str, fmt: str,
+                         start, mimetype: str, filename: str, label: str) -> None:
+    if store_key and _services.media_store.lookup(store_key, fmt):
+        # Stored files are plain file responses; Flask already serves those with ranges
+        return await _wsgi(scope, receive, send)
+    try:
+        ticket = _services.admission.admit(_client_ip(scope), endpoint, cost)
+    except Rejected as e:
+        return await _respond(send, 429, f"{e.reason}. Please retry in {e.retry_after_header} seconds.",
+                              {'Retry-After': e.retry_after_header})
+    loop = asyncio.get_running_loop()
+    try:
+        try:
+            stored, body = await loop.run_in_executor(None, luminar.stored_or_streamed,
+                                                      _services.media_store, store_key, fmt, start)
+        except MergeBusy:
+            return await _respond(send, 503, "Too many merges in progress. Please try again shortly.",
+                                  {'Retry-After': 5})
+        except FileNotFoundError:
+            return await _respond(send, 500, f"Failed to {label}: ffmpeg is not installed on the server")
+        except Exception as e:
+            return await _respond(send, 500, f"Failed to {label}: {e}")
+        if stored:
+            return await _wsgi(scope, receive, send)
+        await _relay(receive, send, 200, {'Content-Type': mimetype,
+                                          'Content-Disposition': f'attachment;filename="{filename}"',
+                                          'X-Accel-Buffering': 'no'}, _iterate_in_thread(body))
+    finally:
+        _services.admission.release(ticket)
+
+
+async def proxy_merge_download(scope, receive, send, args) -> None:
+    try:
+        video_url, audio_url, store_key, filename = luminar.merge_target(args)
+    except ValueError as e:
+        return await _respond(send, 400, str(e))
+    await _ffmpeg_stream(scope, receive, send, 'proxy_merge_download', 6, store_key, 'mp4',
+                         lambda: _services.stream_merger.merge(video_url, audio_url),
+                         'video/mp4', filename, 'merge')
+
+
+async def proxy_audio_download(scope, receive, send, args) -> None:
+    try:
+        audio_url, container, store_key, filename = luminar.audio_target(args)
+    except ValueError as e:
+        return await _respond(send, 400, str(e))
+    await _ffmpeg_stream(scope, receive, send, 'proxy_audio_download', 2, store_key, container,
+                         lambda: _services.stream_merger.extract_audio(audio_url, container),
+                         AUDIO_MIMETYPES[container], filename, 'extract audio')
+
+
+async def _sse_messages(snapshot, channel: ProgressChannel, is_final, last_event_id: Optional[str]):
+    """Async counterpart of progress_events.sse_stream, woken by the channel instead of a blocked thread."""
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+
+    def listener(state) -> None:
+        loop.call_soon_threadsafe(changed.set)
+
+    channel.subscribe(listener)
+    try:
+        deadline = loop.time() + SSE_MAX_DURATION
+        version = -1
+        yield f"retry: {RECONNECT_MS}\n\n".encode()
+        while loop.time() < deadline:
+            changed.clear()
+            new_version, _ = channel.wait_for_change(version, timeout=0)
+            if new_version == version:
+                try:
+                    await asyncio.wait_for(changed.wait(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                continue
+            version = new_version
+            state = snapshot()
+            if event_id(version) != last_event_id:
+                yield format_sse(state, event_id=event_id(version)).encode()
+            if is_final(state):
+                return
+    finally:
+        channel.unsubscribe(listener)
+
+
+async def _sse(scope, receive, send, snapshot, channel: ProgressChannel, is_final) -> None:
+    headers = dict(SSE_HEADERS, **{'Content-Type': 'text/event-stream'})
+    await _relay(receive, send, 200, headers,
+                 _sse_messages(snapshot, channel, is_final, _header(scope, 'Last-Event-ID')))
+
+
+async def conversion_events(scope, receive, send, filename: str) -> None:
+    job = _services.conversion_jobs.get(filename)
+    if job is None:
+        return await _wsgi(scope, receive, send)
+    await _sse(scope, receive, send, job.snapshot, job.channel, lambda state: state.get('status') != 'pending')
+
+
+async def download_events(scope, receive, send, download_id: str) -> None:
+    job = _services.download_jobs.get(download_id)
+    if job is None:
+        return await _wsgi(scope, receive, send)
+    await _sse(scope, receive, send, lambda: luminar.download_status_payload(download_id, job.snapshot()),
+               job.channel, lambda state: state.get('status') in ('done', 'failed'))
+
+
+_ROUTES = {
+    '/proxy_download': proxy_download,
+    '/proxy_merge_download': proxy_merge_download,
+    '/proxy_audio_download': proxy_audio_download,
+}
+# Routes ending in one path segment, passed to the handler
+_PREFIX_ROUTES = {
+    '/conversion_events/': conversion_events,
+    '/download_youtube/events/': download_events,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if _client is not None:
+                    await _client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return await _wsgi(scope, receive, send)
+    path = scope.get('path', '')
+    for prefix, handler in _PREFIX_ROUTES.items():
+        segment = path[len(prefix):]
+        if path.startswith(prefix) and segment and '/' not in segment:
+            return await handler(scope, receive, send, segment)
+    handler = _ROUTES.get(path)
+    if handler is None:
+        return await _wsgi(scope, receive, send)
+    args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+    await handler(scope, receive, send, args)
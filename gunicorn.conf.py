@@ -0,0 +1,14 @@
+# gunicorn -c gunicorn.conf.py
+import os
+
+# The module-level app: importing app already builds it, so don't call the factory again
+wsgi_app = 'app:application'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Notebook conversions can hold a request for up to a minute
+timeout = 120
+# Workers share state through LUMINAR_WORK_DIR/state.db, so any worker can be
+# recycled; each one starts its own cleanup thread on its first request.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
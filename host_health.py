@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class CircuitOpen(Exception):
+    """Requests to host are failing fast until its breaker lets a probe through."""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f'{host} is unavailable (circuit open, retry in {retry_after:.0f}s)')
+        self.host = host
+        self.retry_after = retry_after
+
+
+class _Host:
+    __slots__ = ('state', 'consecutive_failures', 'opened_at', 'probing', 'requests', 'failures',
+                 'error_rate', 'latency_ms', 'max_latency_ms', 'last_error')
+
+    def __init__(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+        self.error_rate = 0.0
+        self.latency_ms = None
+        self.max_latency_ms = 0.0
+        self.last_error = None
+
+
+class HostHealth:
+    """Per-host circuit breakers plus latency and error-rate stats for upstream fetches.
+
+    A host's breaker opens after failure_threshold consecutive failures (connection
+    errors, timeouts, 5xx); while open, before() raises CircuitOpen without touching
+    the network. After cooldown seconds one probe request is let through (half-open):
+    success closes the breaker, failure re-opens it. Error rate and latency are
+    exponentially weighted, so they describe the last few dozen requests.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0, alpha: float = 0.1,
+                 max_hosts: int = 512):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.max_hosts = max_hosts
+        self._lock = threading.Lock()
+        self._hosts: 'OrderedDict[str, _Host]' = OrderedDict()
+
+    def before(self, host: str) -> None:
+        """Raise CircuitOpen if host should not be contacted right now."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._host(host)
+            if entry.state == 'closed':
+                return
+            if entry.state == 'open':
+                remaining = entry.opened_at + self.cooldown - now
+                if remaining > 0:
+                    raise CircuitOpen(host, remaining)
+                entry.state = 'half_open'
+                entry.probing = False
+            if entry.probing:
+                raise CircuitOpen(host, 1.0)
+            entry.probing = True
+
+    def record(self, host: str, latency: Optional[float], ok: bool, error: Optional[str] = None) -> None:
+        """Record the outcome of one request (latency in seconds, if it got that far)."""
+        with self._lock:
+            entry = self._host(host)
+            entry.requests += 1
+            entry.error_rate += self.alpha * ((0.0 if ok else 1.0) - entry.error_rate)
+            if latency is not None:
+                ms = latency * 1000
+                entry.latency_ms = ms if entry.latency_ms is None else entry.latency_ms + self.alpha * (ms - entry.latency_ms)
+                entry.max_latency_ms = max(entry.max_latency_ms, ms)
+            if ok:
+                entry.consecutive_failures = 0
+                if entry.state != 'closed':
+                    print(f"\033[32m✓\033[0m Upstream {host} recovered, closing circuit")
+                entry.state = 'closed'
+                entry.probing = False
+                return
+            entry.failures += 1
+            entry.consecutive_failures += 1
+            entry.last_error = error
+            if entry.state == 'half_open' or entry.consecutive_failures >= self.failure_threshold:
+                if entry.state != 'open':
+                    print(f"\033[33m⚠️\033[0m Upstream {host} failing ({error}), opening circuit for {self.cooldown:.0f}s")
+                entry.state = 'open'
+                entry.opened_at = time.monotonic()
+                entry.probing = False
+
+    def _host(self, host: str) -> _Host:
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = _Host()
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        return entry
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            return {host: {
+                'state': entry.state,
+                'requests': entry.requests,
+                'failures': entry.failures,
+                'errorRate': round(entry.error_rate, 3),
+                'latencyMs': round(entry.latency_ms, 1) if entry.latency_ms is not None else None,
+                'maxLatencyMs': round(entry.max_latency_ms, 1),
+                'lastError': entry.last_error,
+            } for host, entry in self._hosts.items()}
@@ -0,0 +1,109 @@
+import heapq
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class JobStatusStore:
+    """Thread-safe job records with O(1) lookups and TTL eviction.
+
+    Records are indexed by their primary key (the server filename) and by any number
+    of output basenames (e.g. the converted PDF). Every touch pushes a new expiry onto
+    a heap; stale heap entries are skipped lazily, so eviction costs O(log n) per entry.
+    """
+
+    def __init__(self, ttl: float, is_evictable: Optional[Callable[[Any], bool]] = None):
+        self.ttl = ttl
+        self._is_evictable = is_evictable or (lambda record: True)
+        self._lock = threading.RLock()
+        self._primary: Dict[str, Any] = {}
+        self._secondary: Dict[str, str] = {}
+        self._outputs: Dict[str, List[str]] = {}
+        self._expires: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._primary)
+
+    def put(self, key: str, record: Any) -> None:
+        with self._lock:
+            self._primary[key] = record
+            self._touch_locked(key)
+
+    def add_output(self, key: str, output_basename: str) -> None:
+        """Make the record under key reachable by one of its output files."""
+        with self._lock:
+            if key not in self._primary:
+                return
+            self._secondary[output_basename] = key
+            outputs = self._outputs.setdefault(key, [])
+            if output_basename not in outputs:
+                outputs.append(output_basename)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._primary.get(key)
+
+    def lookup(self, name: str) -> Tuple[Optional[str], Optional[Any]]:
+        """Resolve a server filename or output basename to (primary key, record)."""
+        with self._lock:
+            if name in self._primary:
+                return name, self._primary[name]
+            key = self._secondary.get(name)
+            if key is not None:
+                return key, self._primary.get(key)
+            return None, None
+
+    def values(self) -> List[Any]:
+        with self._lock:
+            return list(self._primary.values())
+
+    def touch(self, name: str) -> None:
+        """Extend the TTL of the record owning name (primary key or output basename)."""
+        with self._lock:
+            key, _ = self.lookup(name)
+            if key is not None:
+                self._touch_locked(key)
+
+    def discard(self, name: str) -> Optional[Any]:
+        """Drop the record owning name, e.g. because its file was deleted."""
+        with self._lock:
+            key, _ = self.lookup(name)
+            if key is None:
+                return None
+            return self._remove_locked(key)
+
+    def evict_expired(self, now: Optional[float] = None) -> List[Any]:
+        """Remove records whose TTL has passed. Records that are not evictable yet
+        (e.g. still converting) get a fresh TTL instead."""
+        now = time.time() if now is None else now
+        evicted = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, key = heapq.heappop(self._heap)
+                if self._expires.get(key) != expires_at:
+                    continue  # superseded by a later touch, or already removed
+                record = self._primary.get(key)
+                if record is not None and not self._is_evictable(record):
+                    self._touch_locked(key, now)
+                    continue
+                evicted.append(self._remove_locked(key))
+        return evicted
+
+    def _touch_locked(self, key: str, now: Optional[float] = None) -> None:
+        expires_at = (time.time() if now is None else now) + self.ttl
+        self._expires[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        # Bound heap growth from repeated touches of the same keys
+        if len(self._heap) > 4 * len(self._expires) + 64:
+            self._heap = [(exp, k) for k, exp in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def _remove_locked(self, key: str) -> Any:
+        record = self._primary.pop(key, None)
+        self._expires.pop(key, None)
+        for output in self._outputs.pop(key, []):
+            if self._secondary.get(output) == key:
+                del self._secondary[output]
+        return record
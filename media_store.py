@@ -0,0 +1,218 @@
+import glob
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Callable, Iterable, Iterator, Optional
+
+from file_lifecycle import FileLifecycleManager
+from single_flight import SingleFlight
+from state_backend import StateBackend
+
+# StateBackend namespace for "this worker is producing that file" claims
+_CLAIM_NS = 'media_claims'
+_FOLLOW_INTERVAL = 0.5
+# Claims are leases renewed while the producer makes progress, so a worker that dies
+# mid-download holds other workers up for at most this long before one takes over
+CLAIM_LEASE = 60
+
+
+class MediaStore:
+    """Downloaded and merged media shared by every request for the same video and format.
+
+    Each (key, format) pair maps to one file in the temp folder, e.g. key
+    'youtube:dQw4w9WgXcQ' with format 'best' is media_youtube_dQw4w9WgXcQ_best.mp4.
+    Requests for a stored file are served by reference to that file; producing a missing
+    one is coalesced, so concurrent requests (in this worker via SingleFlight, across
+    workers via a StateBackend claim) share a single download. The claim is a short
+    lease that the producer keeps renewing, so if its worker dies another takes over.
+    Stored files are ordinary lifecycle-managed temp files: they age out and are
+    evicted under the disk quota like everything else, and are simply produced again
+    on the next request.
+    """
+
+    def __init__(self, directory: str, lifecycle: FileLifecycleManager, backend: Optional[StateBackend] = None,
+                 claim_ttl: float = CLAIM_LEASE):
+        self.directory = directory
+        self.claim_ttl = claim_ttl
+        self._lifecycle = lifecycle
+        self._backend = backend
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._producing = set()
+
+    @staticmethod
+    def stem(key: str, fmt: str) -> str:
+        slug = re.sub(r'[^A-Za-z0-9_-]+', '_', f"{key}_{fmt}").strip('_')
+        if len(slug) > 80:
+            slug = hashlib.sha1(f"{key}\0{fmt}".encode('utf-8')).hexdigest()
+        return f"media_{slug}"
+
+    def lookup(self, key: str, fmt: str) -> Optional[str]:
+        """Filename of the stored file for (key, fmt), or None. Counts as an access."""
+        stem = self.stem(key, fmt)
+        for path in glob.glob(os.path.join(glob.escape(self.directory), glob.escape(stem) + '.*')):
+            filename = os.path.basename(path)
+            self._lifecycle.touch(filename)
+            return filename
+        return None
+
+    def fetch(self, key: str, fmt: str, download: Callable[[str], str]) -> str:
+        """Return the stored filename for (key, fmt), producing it with download(part_stem) if missing.
+
+        download writes the media to a path starting with part_stem (it picks the
+        extension) and returns that path; the file is then moved into the store.
+        """
+        stem = self.stem(key, fmt)
+
+        def produce():
+            while True:
+                filename = self.lookup(key, fmt)
+                if filename:
+                    return filename
+                if self._claim(stem):
+                    break
+                self._follow(stem)
+            # download() gives no progress callback; renew the lease for as long as it runs
+            done = threading.Event()
+            threading.Thread(target=self._keep_claimed, args=(stem, done), daemon=True).start()
+            try:
+                part_stem = os.path.join(self.directory, f".{stem}.{uuid.uuid4().hex}")
+                path = download(part_stem)
+                filename = stem + os.path.splitext(path)[1]
+                os.replace(path, os.path.join(self.directory, filename))
+                self._lifecycle.touch(filename)
+                return filename
+            finally:
+                done.set()
+                self._unclaim(stem)
+                for leftover in glob.glob(glob.escape(os.path.join(self.directory, f".{stem}.")) + '*'):
+                    try:
+                        os.remove(leftover)
+                    except OSError:
+                        pass
+
+        return self._flight.do(stem, produce)
+
+    def begin(self, key: str, fmt: str, ext: str) -> Optional['MediaWriter']:
+        """Start writing (key, fmt) from a stream, or None if it is stored or already being produced."""
+        stem = self.stem(key, fmt)
+        if self.lookup(key, fmt) or self._flight.in_flight(stem) or not self._claim(stem):
+            return None
+        return MediaWriter(self, stem, stem + ext)
+
+    def _claim(self, stem: str) -> bool:
+        with self._lock:
+            if stem in self._producing:
+                return False
+            self._producing.add(stem)
+        if self._backend is not None and not self._backend.claim(
+                _CLAIM_NS, stem, {'owner': os.getpid()}, expires_at=time.time() + self.claim_ttl):
+            with self._lock:
+                self._producing.discard(stem)
+            return False
+        return True
+
+    def _renew(self, stem: str) -> None:
+        if self._backend is not None:
+            self._backend.touch(_CLAIM_NS, stem, time.time() + self.claim_ttl)
+
+    def _keep_claimed(self, stem: str, done: threading.Event) -> None:
+        while not done.wait(self.claim_ttl / 3):
+            self._renew(stem)
+
+    def _unclaim(self, stem: str) -> None:
+        with self._lock:
+            self._producing.discard(stem)
+        if self._backend is not None:
+            self._backend.delete(_CLAIM_NS, stem)
+
+    def _follow(self, stem: str) -> None:
+        """Wait while another worker (or a streaming writer here) produces stem.
+
+        Returns once the claim is released or its lease lapses; the caller then looks
+        for the file and, if it isn't there, claims stem itself.
+        """
+        while True:
+            with self._lock:
+                local = stem in self._producing
+            record = self._backend.get(_CLAIM_NS, stem) if self._backend is not None and not local else None
+            if not local and (record is None or record.expires_at <= time.time()):
+                return
+            time.sleep(_FOLLOW_INTERVAL)
+
+
+class MediaWriter:
+    """Writes a stream into the store as it is relayed; only a complete stream is kept."""
+
+    def __init__(self, store: MediaStore, stem: str, filename: str):
+        self._store = store
+        self._stem = stem
+        self.filename = filename
+        self._part = os.path.join(store.directory, f".{stem}.{uuid.uuid4().hex}")
+        self._file = open(self._part, 'wb')
+        self._done = False
+        self._renewed = time.monotonic()
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        # Renew the claim while bytes flow; a stalled stream lets it lapse
+        now = time.monotonic()
+        if now - self._renewed > self._store.claim_ttl / 3:
+            self._renewed = now
+            self._store._renew(self._stem)
+
+    def commit(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        try:
+            self._file.close()
+            os.replace(self._part, os.path.join(self._store.directory, self.filename))
+            self._store._lifecycle.touch(self.filename)
+        finally:
+            self._store._unclaim(self._stem)
+
+    def abort(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        try:
+            self._file.close()
+            os.remove(self._part)
+        except OSError:
+            pass
+        finally:
+            self._store._unclaim(self._stem)
+
+    def tee(self, chunks: Iterable[bytes], succeeded: Callable[[], bool] = lambda: True) -> '_TeeStream':
+        """Wrap a response iterable so its bytes are also stored. The file is committed only
+        if every chunk was relayed and succeeded() holds after the source is closed."""
+        return _TeeStream(self, chunks, succeeded)
+
+
+class _TeeStream:
+    def __init__(self, writer: MediaWriter, chunks: Iterable[bytes], succeeded: Callable[[], bool]):
+        self._writer = writer
+        self._chunks = chunks
+        self._succeeded = succeeded
+        self._complete = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            for chunk in self._chunks:
+                self._writer.write(chunk)
+                yield chunk
+            self._complete = True
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        if self._complete and self._succeeded():
+            self._writer.commit()
+        else:
+            self._writer.abort()
@@ -0,0 +1,299 @@
+import base64
+import html
+import json
+import re
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional
+
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Paragraph, Spacer, XPreformatted, Image, KeepTogether
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.lib import colors
+
+try:
+    from pygments import lex
+    from pygments.lexers import get_lexer_by_name, TextLexer
+    from pygments.styles import get_style_by_name
+    _HAS_PYGMENTS = True
+except Exception:
+    _HAS_PYGMENTS = False
+
+# Bump whenever the rendered output changes so cached PDFs are invalidated.
+RENDERER_VERSION = 'native-1'
+
+_ANSI_RE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+_CODE_FONT_SIZE = 8
+_MARGIN = 0.75 * inch
+
+
+def _source(value) -> str:
+    """Notebook text fields are either a string or a list of lines."""
+    if isinstance(value, list):
+        return ''.join(value)
+    return value or ''
+
+
+def _build_styles() -> Dict[str, ParagraphStyle]:
+    base = getSampleStyleSheet()
+    styles = {
+        'body': ParagraphStyle('NbBody', parent=base['BodyText'], fontName='Helvetica', fontSize=10, leading=14, spaceAfter=6),
+        'bullet': ParagraphStyle('NbBullet', parent=base['BodyText'], fontName='Helvetica', fontSize=10, leading=14, leftIndent=14, bulletIndent=4),
+        'quote': ParagraphStyle('NbQuote', parent=base['BodyText'], fontName='Helvetica-Oblique', fontSize=10, leading=14, leftIndent=14, textColor=colors.HexColor("#555555")),
+        'prompt': ParagraphStyle('NbPrompt', fontName='Courier', fontSize=7, leading=9, textColor=colors.HexColor("#303f9f"), spaceBefore=4),
+        'code': ParagraphStyle('NbCode', fontName='Courier', fontSize=_CODE_FONT_SIZE, leading=_CODE_FONT_SIZE + 2,
+                               backColor=colors.HexColor("#f7f7f7"), borderColor=colors.HexColor("#dddddd"),
+                               borderWidth=0.5, borderPadding=4, spaceAfter=6),
+        'output': ParagraphStyle('NbOutput', fontName='Courier', fontSize=_CODE_FONT_SIZE, leading=_CODE_FONT_SIZE + 2, spaceAfter=6),
+        'error': ParagraphStyle('NbError', fontName='Courier', fontSize=_CODE_FONT_SIZE, leading=_CODE_FONT_SIZE + 2,
+                                backColor=colors.HexColor("#fdecea"), borderPadding=4, spaceAfter=6),
+    }
+    for level, size in zip(range(1, 7), (18, 15, 13, 12, 11, 10)):
+        styles[f'h{level}'] = ParagraphStyle(f'NbH{level}', parent=base['Heading1'], fontName='Helvetica-Bold',
+                                             fontSize=size, leading=size + 4, spaceBefore=8, spaceAfter=4,
+                                             textColor=colors.HexColor("#2c3e50"))
+    return styles
+
+
+def _inline_markdown(text: str) -> str:
+    """Convert inline markdown (code, bold, italic, links) to ReportLab paragraph markup."""
+    code_spans = []
+
+    def _stash(match):
+        code_spans.append(html.escape(match.group(1)))
+        return f'\x00{len(code_spans) - 1}\x00'
+
+    text = re.sub(r'`([^`]+)`', _stash, text)
+    text = html.escape(text, quote=False)
+    text = re.sub(r'!\[([^\]]*)\]\([^)]*\)', r'[\1]', text)
+    # The text was escaped for element content; the URL goes in an attribute, so quotes too
+    text = re.sub(r'\[([^\]]+)\]\(([^)\s]+)[^)]*\)',
+                  lambda m: f'<link href="{html.escape(html.unescape(m.group(2)), quote=True)}" color="blue">{m.group(1)}</link>',
+                  text)
+    # Bold italic first, so the bold pass below can't close a tag across an italic one
+    text = re.sub(r'(\*\*\*|___)(?!\s)(.+?)(?<!\s)\1', r'<b><i>\2</i></b>', text)
+    text = re.sub(r'(\*\*|__)(.+?)\1', r'<b>\2</b>', text)
+    text = re.sub(r'(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])', r'<i>\1</i>', text)
+    text = re.sub(r'(?<![\w_])_(?!\s)(.+?)(?<!\s)_(?![\w_])', r'<i>\1</i>', text)
+    return re.sub(r'\x00(\d+)\x00', lambda m: f'<font face="Courier">{code_spans[int(m.group(1))]}</font>', text)
+
+
+def _wrap_markup(tokens, width: int) -> str:
+    """Join (color, text) runs into XPreformatted markup, hard-wrapping lines at width characters."""
+    out = []
+    column = 0
+    for color, text in tokens:
+        pieces = []
+        for char in text:
+            if char == '\n':
+                column = 0
+            else:
+                if column >= width:
+                    pieces.append('\n')
+                    column = 0
+                column += 1
+            pieces.append(char)
+        chunk = html.escape(''.join(pieces), quote=False)
+        out.append(f'<font color="{color}">{chunk}</font>' if color else chunk)
+    return ''.join(out)
+
+
+class NotebookRenderer:
+    """Lay out a Jupyter notebook directly as a PDF, without a browser."""
+
+    def __init__(self, notebook: Dict[str, Any], pagesize=letter):
+        self.notebook = notebook
+        self.pagesize = pagesize
+        self.styles = _build_styles()
+        self.frame_width = pagesize[0] - 2 * _MARGIN
+        # Courier glyphs are 0.6em wide
+        self.code_columns = max(40, int((self.frame_width - 8) / (_CODE_FONT_SIZE * 0.6)))
+        metadata = notebook.get('metadata', {})
+        self.language = (metadata.get('language_info', {}).get('name')
+                         or metadata.get('kernelspec', {}).get('language')
+                         or 'python')
+        self._lexer = None
+        self._token_colors = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'NotebookRenderer':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    # --- markdown cells ---
+
+    def _markdown_flowables(self, source: str) -> List[Any]:
+        flowables = []
+        paragraph: List[str] = []
+        lines = source.splitlines()
+
+        def flush():
+            if paragraph:
+                flowables.append(Paragraph(_inline_markdown(' '.join(paragraph)), self.styles['body']))
+                paragraph.clear()
+
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            stripped = line.strip()
+            fence = re.match(r'^(```|~~~)\s*(\S*)', stripped)
+            if fence:
+                flush()
+                block = []
+                i += 1
+                while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                    block.append(lines[i])
+                    i += 1
+                flowables.append(self._code_block('\n'.join(block), fence.group(2) or None))
+            elif not stripped:
+                flush()
+            elif re.match(r'^#{1,6}\s', stripped):
+                flush()
+                level = len(stripped) - len(stripped.lstrip('#'))
+                flowables.append(Paragraph(_inline_markdown(stripped[level:].strip().rstrip('#').strip()), self.styles[f'h{level}']))
+            elif re.match(r'^([-*+]|\d+[.)])\s+', stripped):
+                flush()
+                marker, text = re.match(r'^([-*+]|\d+[.)])\s+(.*)$', stripped).groups()
+                bullet = '•' if marker in '-*+' else marker
+                flowables.append(Paragraph(_inline_markdown(text), self.styles['bullet'], bulletText=bullet))
+            elif stripped.startswith('>'):
+                flush()
+                flowables.append(Paragraph(_inline_markdown(stripped.lstrip('> ')), self.styles['quote']))
+            elif re.match(r'^(-{3,}|\*{3,}|_{3,})$', stripped):
+                flush()
+                flowables.append(Spacer(1, 6))
+            else:
+                paragraph.append(stripped)
+            i += 1
+        flush()
+        return flowables
+
+    def _plain_text_flowables(self, source: str) -> List[Any]:
+        """Escaped paragraphs (split on blank lines) for markdown that couldn't be converted."""
+        return [Paragraph(html.escape(' '.join(block.split())), self.styles['body'])
+                for block in re.split(r'\n\s*\n', source) if block.strip()]
+
+    # --- code cells ---
+
+    def _get_lexer(self, language: Optional[str]):
+        if not _HAS_PYGMENTS:
+            return None
+        if language is None:
+            if self._lexer is None:
+                try:
+                    self._lexer = get_lexer_by_name(self.language)
+                except Exception:
+                    self._lexer = TextLexer()
+            return self._lexer
+        try:
+            return get_lexer_by_name(language)
+        except Exception:
+            return TextLexer()
+
+    def _token_color(self, token_type) -> Optional[str]:
+        if token_type not in self._token_colors:
+            style = get_style_by_name('default')
+            color = style.style_for_token(token_type).get('color')
+            self._token_colors[token_type] = f'#{color}' if color else None
+        return self._token_colors[token_type]
+
+    def _code_block(self, code: str, language: Optional[str] = None):
+        lexer = self._get_lexer(language)
+        if lexer is None:
+            tokens = [(None, code)]
+        else:
+            tokens = [(self._token_color(ttype), value) for ttype, value in lex(code, lexer)]
+            # Pygments always appends a trailing newline
+            if tokens and tokens[-1][1].endswith('\n') and not code.endswith('\n'):
+                tokens[-1] = (tokens[-1][0], tokens[-1][1][:-1])
+        return XPreformatted(_wrap_markup(tokens, self.code_columns), self.styles['code'])
+
+    def _text_output(self, text: str, style: str = 'output'):
+        text = _ANSI_RE.sub('', text).rstrip('\n')
+        if not text:
+            return None
+        return XPreformatted(_wrap_markup([(None, text)], self.code_columns), self.styles[style])
+
+    def _image_output(self, b64data: str):
+        raw = base64.b64decode(b64data)
+        reader = ImageReader(BytesIO(raw))
+        width, height = reader.getSize()
+        # Notebook figures are usually saved at 72-100 dpi; never upscale past the frame
+        scale = min(1.0, self.frame_width / float(width), (self.pagesize[1] - 3 * _MARGIN) / float(height))
+        return Image(BytesIO(raw), width=width * scale, height=height * scale)
+
+    def _output_flowables(self, output: Dict[str, Any]) -> List[Any]:
+        output_type = output.get('output_type')
+        if output_type == 'stream':
+            flowable = self._text_output(_source(output.get('text')), 'error' if output.get('name') == 'stderr' else 'output')
+            return [flowable] if flowable else []
+        if output_type == 'error':
+            flowable = self._text_output('\n'.join(output.get('traceback') or [f"{output.get('ename')}: {output.get('evalue')}"]), 'error')
+            return [flowable] if flowable else []
+        if output_type in ('execute_result', 'display_data'):
+            data = output.get('data', {})
+            for mime in ('image/png', 'image/jpeg'):
+                if mime in data:
+                    try:
+                        return [self._image_output(_source(data[mime]))]
+                    except Exception as e:
+                        print(f"Could not render notebook image output: {e}")
+            if 'text/markdown' in data:
+                return self._markdown_flowables(_source(data['text/markdown']))
+            if 'text/plain' in data:
+                flowable = self._text_output(_source(data['text/plain']))
+                return [flowable] if flowable else []
+        return []
+
+    # --- document ---
+
+    def build_story(self) -> List[Any]:
+        story = []
+        for cell in self.notebook.get('cells', []):
+            cell_type = cell.get('cell_type')
+            source = _source(cell.get('source'))
+            if cell_type == 'markdown':
+                try:
+                    story.extend(self._markdown_flowables(source))
+                except ValueError as e:
+                    # ReportLab rejected the markup (e.g. tags that overlap): keep this cell as plain text
+                    print(f"Markdown cell rendered as plain text: {str(e).strip().splitlines()[-1]}")
+                    story.extend(self._plain_text_flowables(source))
+            elif cell_type == 'code':
+                count = cell.get('execution_count')
+                prompt = Paragraph(f"In [{count if count is not None else ' '}]:", self.styles['prompt'])
+                story.append(KeepTogether([prompt, self._code_block(source)]))
+                for output in cell.get('outputs', []):
+                    story.extend(self._output_flowables(output))
+            elif cell_type == 'raw':
+                flowable = self._text_output(source)
+                if flowable:
+                    story.append(flowable)
+        return story
+
+    def _draw_page(self, canvas, doc):
+        canvas.saveState()
+        canvas.setFillColor(colors.gray)
+        canvas.setFont('Helvetica', 8)
+        canvas.drawCentredString(self.pagesize[0] / 2, 0.4 * inch, str(doc.page))
+        canvas.restoreState()
+
+    def render(self, output_path: str, progress: Optional[Callable[[str], None]] = None) -> str:
+        """Build the PDF at output_path, reporting 'rendering' and 'writing' phases to progress."""
+        if progress:
+            progress('rendering')
+        doc = BaseDocTemplate(output_path, pagesize=self.pagesize, leftMargin=_MARGIN, rightMargin=_MARGIN,
+                              topMargin=_MARGIN, bottomMargin=_MARGIN)
+        frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='notebook_frame')
+        doc.addPageTemplates([PageTemplate(id='notebook', frames=[frame], onPage=self._draw_page)])
+        story = self.build_story() or [Paragraph('(empty notebook)', self.styles['body'])]
+        if progress:
+            progress('writing')
+        doc.build(story)
+        return output_path
+
+
+def render_notebook_to_pdf(ipynb_path: str, pdf_path: str, progress: Optional[Callable[[str], None]] = None) -> str:
+    """Render an .ipynb file to PDF with ReportLab. Raises on malformed notebooks."""
+    return NotebookRenderer.from_file(ipynb_path).render(pdf_path, progress=progress)
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class ProgressChannel:
+    """Latest-state holder that publishers update and SSE streams block on."""
+
+    def __init__(self, **state):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._state: Dict[str, Any] = dict(state)
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def subscribe(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Call listener(state) after every publish, on the publishing thread."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def publish(self, **changes) -> None:
+        with self._cond:
+            self._state.update(changes)
+            self._version += 1
+            self._cond.notify_all()
+            state = dict(self._state)
+        for listener in list(self._listeners):
+            try:
+                listener(state)
+            except Exception as e:
+                print(f"Progress listener failed: {e}")
+
+    @property
+    def state(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._state)
+
+    def wait_for_change(self, seen_version: int, timeout: float) -> Tuple[int, Dict[str, Any]]:
+        """Block until the state moves past seen_version or timeout expires."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != seen_version, timeout=timeout)
+            return self._version, dict(self._state)
+
+
+# A follower holds a server thread while its stream is open, so streams are short:
+# after STREAM_DURATION seconds the response ends and EventSource reconnects after
+# RECONNECT_MS, sending the Last-Event-ID it saw.
+STREAM_DURATION = 25.0
+RECONNECT_MS = 500
+
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None, event_id: Optional[str] = None,
+               retry: Optional[int] = None) -> str:
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    if event_id:
+        message = f"id: {event_id}\n{message}"
+    if retry is not None:
+        message = f"retry: {retry}\n{message}"
+    return message
+
+
+def event_id(version: int) -> str:
+    """SSE id for a channel version; versions are per process, so the pid is part of it."""
+    return f"{os.getpid()}.{version}"
+
+
+def sse_stream(snapshot: Callable[[], Dict[str, Any]], channel: ProgressChannel,
+               is_final: Callable[[Dict[str, Any]], bool], last_event_id: Optional[str] = None,
+               heartbeat: float = 15.0, max_duration: float = STREAM_DURATION) -> Iterator[str]:
+    """Yield an SSE message per state change until is_final(state) or max_duration.
+
+    A state the client already has (last_event_id, from a reconnect) isn't sent again.
+    Comment lines are sent as heartbeats so proxies keep idle streams open.
+    """
+    deadline = time.time() + max_duration
+    version = -1
+    yield f"retry: {RECONNECT_MS}\n\n"
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        new_version, _ = channel.wait_for_change(version, timeout=min(heartbeat, remaining))
+        if new_version == version:
+            if time.time() < deadline:
+                yield ": keep-alive\n\n"
+            continue
+        version = new_version
+        state = snapshot()
+        if event_id(version) != last_event_id:
+            yield format_sse(state, event_id=event_id(version))
+        if is_final(state):
+            return
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Disable response buffering in nginx so events reach the browser immediately
+    'X-Accel-Buffering': 'no',
+}
@@ -0,0 +1,201 @@
+"""Multi-connection downloads for large media on hosts that throttle per connection.
+
+The file size is probed with a one-byte range request; the body is then fetched as
+byte ranges in parallel on a bounded process-wide pool. A failed segment is retried
+on its own, resuming from the last byte it wrote, so one dropped connection doesn't
+restart the whole transfer. Hosts without range support get a plain single stream.
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, Optional
+
+import upstream
+
+SEGMENT_WORKERS = int(os.environ.get('SEGMENT_WORKERS', 8))
+# Parallel connections per download
+CONNECTIONS = int(os.environ.get('SEGMENT_CONNECTIONS', 4))
+SEGMENT_SIZE = 4 * 1024 * 1024
+# Below this, one connection is as fast as several
+MIN_SEGMENTED_SIZE = 8 * 1024 * 1024
+SEGMENT_RETRIES = 3
+
+class _Stopped(Exception):
+    """Raised inside a segment's write once the download has been abandoned."""
+
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _segment_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS, thread_name_prefix='segment')
+        return _executor
+
+
+def probe(url: str) -> Optional[int]:
+    """Total size of url if the host serves byte ranges, else None."""
+    response = upstream.open_stream(url, headers={'Range': 'bytes=0-0'})
+    try:
+        response.raise_for_status()
+        match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+        if response.status_code == 206 and match:
+            return int(match.group(3))
+        return None
+    finally:
+        response.close()
+
+
+def _fetch_range(url: str, start: int, end: int, write: Callable[[int, bytes], None],
+                 retries: int = SEGMENT_RETRIES) -> None:
+    """Fetch bytes start..end (inclusive), calling write(offset, chunk). Retries resume where it stopped."""
+    offset = start
+    for attempt in range(retries + 1):
+        try:
+            # This loop does the retrying (resuming mid-segment), so open_stream shouldn't
+            response = upstream.open_stream(url, headers={'Range': f'bytes={offset}-{end}'}, retries=0)
+            try:
+                match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                if response.status_code != 206 or not match or int(match.group(1)) != offset:
+                    raise IOError(f'Upstream ignored range {offset}-{end} (HTTP {response.status_code})')
+                for chunk in upstream.iter_adaptive(response):
+                    chunk = chunk[:end + 1 - offset]
+                    write(offset, chunk)
+                    offset += len(chunk)
+                    if offset > end:
+                        return
+            finally:
+                response.close()
+            if offset > end:
+                return
+            raise IOError(f'Segment {start}-{end} ended early at {offset}')
+        except _Stopped:
+            raise
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+
+def _ranges(size: int, segment_size: int):
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+
+def download_to_file(url: str, path: str, progress: Optional[Callable[[int, int], None]] = None,
+                     connections: int = CONNECTIONS, segment_size: int = SEGMENT_SIZE) -> int:
+    """Download url into path over up to `connections` parallel range requests. Returns the size."""
+    size = probe(url)
+    if size is None or size < MIN_SEGMENTED_SIZE or connections < 2:
+        return _download_single(url, path, progress, size)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # Reserve the blocks up front, so segments land in place without growing the file
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+        done = [0]
+        done_lock = threading.Lock()
+        stop = threading.Event()
+
+        def write(offset: int, chunk: bytes) -> None:
+            if stop.is_set():
+                raise _Stopped()
+            view = memoryview(chunk)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+            if progress:
+                with done_lock:
+                    done[0] += len(chunk)
+                    downloaded = done[0]
+                progress(downloaded, size)
+
+        executor = _segment_executor()
+        running = set()
+        try:
+            for start, end in _ranges(size, segment_size):
+                if len(running) >= connections:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                running.add(executor.submit(_fetch_range, url, start, end, write))
+            for future in running:
+                future.result()
+        except BaseException:
+            # Segments already running still hold fd: stop them and wait, so none writes
+            # after it is closed (and its number possibly reused for another file)
+            stop.set()
+            for future in running:
+                future.cancel()
+            wait(running)
+            raise
+    finally:
+        os.close(fd)
+    return size
+
+
+def _download_single(url: str, path: str, progress: Optional[Callable[[int, int], None]],
+                     size: Optional[int]) -> int:
+    response = upstream.open_stream(url)
+    try:
+        response.raise_for_status()
+        total = size or int(response.headers.get('Content-Length') or 0) or None
+        downloaded = 0
+        with open(path, 'wb') as f:
+            for chunk in upstream.iter_adaptive(response):
+                f.write(chunk)
+                downloaded += len(chunk)
+                if progress:
+                    progress(downloaded, total)
+        return downloaded
+    finally:
+        response.close()
+
+
+def iter_ranges(url: str, connections: int = CONNECTIONS, segment_size: int = SEGMENT_SIZE) -> Iterator[bytearray]:
+    """Yield url's body in order while fetching up to `connections` segments ahead in parallel.
+
+    For consumers that need a stream (e.g. an ffmpeg pipe). Memory stays bounded by
+    connections * segment_size. Falls back to one streamed request without range support.
+    """
+    size = probe(url)
+    if size is None or size < MIN_SEGMENTED_SIZE or connections < 2:
+        response = upstream.open_stream(url)
+        try:
+            response.raise_for_status()
+            yield from upstream.iter_adaptive(response)
+        finally:
+            response.close()
+        return
+
+    def fetch(start: int, end: int) -> bytearray:
+        buffer = bytearray(end - start + 1)
+
+        def write(offset: int, chunk: bytes) -> None:
+            buffer[offset - start:offset - start + len(chunk)] = chunk
+        _fetch_range(url, start, end, write)
+        return buffer
+
+    executor = _segment_executor()
+    segments = iter(_ranges(size, segment_size))
+    window = []
+    try:
+        for start, end in segments:
+            window.append(executor.submit(fetch, start, end))
+            if len(window) >= connections:
+                yield window.pop(0).result()
+        while window:
+            yield window.pop(0).result()
+    finally:
+        for future in window:
+            future.cancel()
@@ -1,14 +1,19 @@
 from pytube import YouTube
-from googleapiclient.discovery import build
 import os
 import json
-from typing import Optional, Dict, Any
+from concurrent.futures import wait
+from typing import Optional, Dict, Any, List, Callable
+
+import segmented_download
+import upstream
+import youtube_clients
 
 class SmartYouTubeDownloader:
     def __init__(self, api_key: Optional[str] = None):
         """Initialize with optional API key for enhanced metadata."""
         self.api_key = api_key
-        self.youtube_api = build('youtube', 'v3', developerKey=api_key) if api_key else None
+        # API clients and pytube objects come from process-wide pools (youtube_clients),
+        # so constructing a downloader per request costs nothing.
         
     def _get_video_id(self, url: str) -> Optional[str]:
         """Extract video ID from various YouTube URL formats."""
@@ -27,39 +32,45 @@ class SmartYouTubeDownloader:
 
     def _get_video_info_api(self, video_id: str) -> Optional[Dict[str, Any]]:
         """Get video information using YouTube Data API if available."""
-        if not self.youtube_api:
+        if not self.api_key:
             return None
             
         try:
-            request = self.youtube_api.videos().list(
-                part="snippet,contentDetails",
-                id=video_id
-            )
-            response = request.execute()
-            
-            if response['items']:
-                video_data = response['items'][0]
-                return {
-                    'title': video_data['snippet']['title'],
-                    'description': video_data['snippet']['description'],
-                    'thumbnail': video_data['snippet']['thumbnails']['maxres']['url'],
-                    'duration': video_data['contentDetails']['duration']
-                }
+            video_data = youtube_clients.api_video_item(self.api_key, video_id)
+            if video_data:
+                return self._info_from_api_item(video_data)
         except Exception as e:
             print(f"API Error: {e}")
             return None
             
+    @staticmethod
+    def _info_from_api_item(video_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'title': video_data['snippet']['title'],
+            'description': video_data['snippet']['description'],
+            'thumbnail': youtube_clients.best_thumbnail(video_data['snippet']),
+            'duration': video_data['contentDetails']['duration']
+        }
+
     def _get_streams(self, url: str) -> Optional[YouTube]:
-        """Get video streams using pytube."""
+        """Get video streams using pytube, reusing the object from an earlier preview of the same video."""
         try:
-            yt = YouTube(url)
+            video_id = self._get_video_id(url)
+            yt = youtube_clients.pytube_video(video_id) if video_id else YouTube(url)
             return yt
         except Exception as e:
             print(f"Pytube Error: {e}")
             return None
             
-    def download_video(self, url: str, output_path: str, quality: str = 'high') -> Dict[str, Any]:
-        """Download video with enhanced error handling and progress tracking."""
+    def download_video(self, url: str, output_path: str, quality: str = 'high',
+                       progress: Optional[Callable[[int, int], None]] = None,
+                       filename_stem: Optional[str] = None) -> Dict[str, Any]:
+        """Download video with enhanced error handling and progress tracking.
+
+        progress(downloaded_bytes, total_bytes) is called as each chunk is written.
+        filename_stem names the output file (the stream's extension is appended);
+        by default it is named after the video title.
+        """
         video_id = self._get_video_id(url)
         if not video_id:
             raise ValueError("Invalid YouTube URL")
@@ -88,11 +99,12 @@ class SmartYouTubeDownloader:
         if not stream:
             raise RuntimeError("No suitable stream found")
             
-        # Download the video
+        # Download the video over several connections; googlevideo throttles each one
         try:
-            file_path = stream.download(output_path=output_path)
+            filename = f"{filename_stem}.{stream.subtype}" if filename_stem else stream.default_filename
+            file_path = os.path.join(output_path, filename)
             info['file_path'] = file_path
-            info['file_size'] = os.path.getsize(file_path)
+            info['file_size'] = segmented_download.download_to_file(stream.url, file_path, progress=progress)
             return info
         except Exception as e:
             raise RuntimeError(f"Download failed: {str(e)}")
@@ -118,4 +130,64 @@ class SmartYouTubeDownloader:
             'thumbnail': yt.thumbnail_url,
             'length': yt.length,
             'author': yt.author
-        }
\ No newline at end of file
+        }
+
+    def _get_preview_fallback(self, video_id: str) -> Dict[str, Any]:
+        """Preview info without the Data API: pytube first, then yt-dlp."""
+        url = f'https://www.youtube.com/watch?v={video_id}'
+        yt = self._get_streams(url)
+        if yt:
+            try:
+                return {'title': yt.title, 'thumbnail': yt.thumbnail_url, 'length': yt.length, 'author': yt.author}
+            except Exception as e:
+                print(f"Pytube Error: {e}")
+        import yt_dlp
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'noplaylist': True,
+                               'socket_timeout': upstream.EXTRACTOR_TIMEOUT}) as ydl:
+            info = ydl.extract_info(url, download=False)
+        if not info:
+            raise RuntimeError("Failed to fetch video information")
+        return {'title': info.get('title'), 'thumbnail': info.get('thumbnail'),
+                'length': info.get('duration'), 'author': info.get('uploader')}
+
+    def get_preview_infos(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """Preview info for many URLs, in input order.
+
+        Known ids are resolved with videos.list, 50 per request. Anything the API
+        can't describe (or every id, without an API key) is looked up per video on
+        a bounded shared thread pool, given FALLBACK_DEADLINE seconds per round of
+        FALLBACK_WORKERS lookups; lookups still queued or running then get an error. Each result has 'url' and either
+        the preview fields or an 'error'.
+        """
+        results = [{'url': url, 'id': self._get_video_id(url)} for url in urls]
+        video_ids = list(dict.fromkeys(r['id'] for r in results if r['id']))
+
+        api_items: Dict[str, Dict[str, Any]] = {}
+        if self.api_key and video_ids:
+            try:
+                api_items = youtube_clients.api_video_items(self.api_key, video_ids)
+            except Exception as e:
+                print(f"API Error: {e}")
+
+        executor = youtube_clients.fallback_executor()
+        fallbacks = {video_id: executor.submit(self._get_preview_fallback, video_id)
+                     for video_id in video_ids if video_id not in api_items}
+        if fallbacks:
+            _, late = wait(fallbacks.values(), timeout=youtube_clients.fallback_deadline(len(fallbacks)))
+            for future in late:
+                future.cancel()
+
+        for result in results:
+            video_id = result['id']
+            if not video_id:
+                result['error'] = 'Invalid YouTube URL'
+            elif video_id in api_items:
+                result.update(self._info_from_api_item(api_items[video_id]))
+            elif fallbacks[video_id].cancelled() or not fallbacks[video_id].done():
+                result['error'] = 'Timed out fetching video information'
+            else:
+                try:
+                    result.update(fallbacks[video_id].result())
+                except Exception as e:
+                    result['error'] = f'Failed to fetch video information: {e}'
+        return results
@@ -0,0 +1,179 @@
+import json
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, NamedTuple, Optional
+
+
+class StateRecord(NamedTuple):
+    key: str
+    value: Any
+    alias: Optional[str]
+    weight: int
+    expires_at: Optional[float]
+
+
+class StateBackend(ABC):
+    """Namespaced key/value records shared by every worker process.
+
+    Each record has a JSON value, an optional secondary `alias` (e.g. an output
+    basename), a numeric `weight` (e.g. a file size) and an `expires_at` timestamp
+    that doubles as the recency order for LRU decisions.
+    """
+
+    @abstractmethod
+    def put(self, ns: str, key: str, value: Any = None, alias: Optional[str] = None,
+            weight: int = 0, expires_at: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, ns: str, key: str) -> Optional[StateRecord]:
+        ...
+
+    @abstractmethod
+    def get_by_alias(self, ns: str, alias: str) -> Optional[StateRecord]:
+        ...
+
+    @abstractmethod
+    def touch(self, ns: str, key: str, expires_at: float) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, ns: str, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def claim(self, ns: str, key: str, value: Any, expires_at: float) -> bool:
+        """Atomically create the record unless a live one exists. True if we own it."""
+
+    @abstractmethod
+    def expired(self, ns: str, now: float, limit: int = 100) -> List[StateRecord]:
+        ...
+
+    @abstractmethod
+    def oldest(self, ns: str, limit: int = 100) -> List[StateRecord]:
+        ...
+
+    @abstractmethod
+    def total_weight(self, ns: str) -> int:
+        ...
+
+    @abstractmethod
+    def has_live_alias(self, ns: str, alias: str, now: float) -> bool:
+        ...
+
+    @abstractmethod
+    def purge_expired(self, ns: str, now: float) -> int:
+        ...
+
+
+class SQLiteStateBackend(StateBackend):
+    """StateBackend on a local SQLite file in WAL mode, safe for concurrent processes.
+
+    WAL lets readers proceed while one writer commits, and every statement here is a
+    short indexed lookup, so the file can sit on the hot path of status polls.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("""CREATE TABLE IF NOT EXISTS state (
+            ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT, alias TEXT,
+            weight INTEGER NOT NULL DEFAULT 0, expires_at REAL,
+            PRIMARY KEY (ns, key))""")
+        conn.execute("CREATE INDEX IF NOT EXISTS state_alias ON state (ns, alias)")
+        conn.execute("CREATE INDEX IF NOT EXISTS state_expiry ON state (ns, expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread, and never reuse one inherited across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _record(row) -> Optional[StateRecord]:
+        if row is None:
+            return None
+        key, value, alias, weight, expires_at = row
+        return StateRecord(key, json.loads(value) if value is not None else None, alias, weight, expires_at)
+
+    def put(self, ns, key, value=None, alias=None, weight=0, expires_at=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO state (ns, key, value, alias, weight, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (ns, key, json.dumps(value) if value is not None else None, alias, weight, expires_at))
+
+    def get(self, ns, key):
+        return self._record(self._conn().execute(
+            "SELECT key, value, alias, weight, expires_at FROM state WHERE ns = ? AND key = ?", (ns, key)).fetchone())
+
+    def get_by_alias(self, ns, alias):
+        return self._record(self._conn().execute(
+            "SELECT key, value, alias, weight, expires_at FROM state WHERE ns = ? AND alias = ? LIMIT 1", (ns, alias)).fetchone())
+
+    def touch(self, ns, key, expires_at):
+        self._conn().execute("UPDATE state SET expires_at = ? WHERE ns = ? AND key = ?", (expires_at, ns, key))
+
+    def delete(self, ns, key):
+        self._conn().execute("DELETE FROM state WHERE ns = ? AND key = ?", (ns, key))
+
+    def claim(self, ns, key, value, expires_at):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT expires_at FROM state WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+            if row is not None and (row[0] is None or row[0] > time.time()):
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO state (ns, key, value, alias, weight, expires_at) VALUES (?, ?, ?, NULL, 0, ?)",
+                (ns, key, json.dumps(value), expires_at))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def expired(self, ns, now, limit=100):
+        rows = self._conn().execute(
+            "SELECT key, value, alias, weight, expires_at FROM state WHERE ns = ? AND expires_at <= ? "
+            "ORDER BY expires_at LIMIT ?", (ns, now, limit)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def oldest(self, ns, limit=100):
+        rows = self._conn().execute(
+            "SELECT key, value, alias, weight, expires_at FROM state WHERE ns = ? "
+            "ORDER BY expires_at LIMIT ?", (ns, limit)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def total_weight(self, ns):
+        return self._conn().execute("SELECT COALESCE(SUM(weight), 0) FROM state WHERE ns = ?", (ns,)).fetchone()[0]
+
+    def has_live_alias(self, ns, alias, now):
+        return self._conn().execute(
+            "SELECT 1 FROM state WHERE ns = ? AND alias = ? AND (expires_at IS NULL OR expires_at > ?) LIMIT 1",
+            (ns, alias, now)).fetchone() is not None
+
+    def purge_expired(self, ns, now):
+        return self._conn().execute("DELETE FROM state WHERE ns = ? AND expires_at <= ?", (ns, now)).rowcount
+
+
+def open_state_backend(url: str) -> Optional[StateBackend]:
+    """Build a backend from a URL: 'sqlite:////abs/path.db', 'sqlite:///relative.db'
+    or 'memory' (process-local state, nothing shared between workers)."""
+    if not url or url == 'memory':
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteStateBackend(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported STATE_BACKEND: {url}")
@@ -9,58 +9,73 @@ const YouTubePreview = ({ videoInfo, onDownload }) => {
         return `${minutes}:${remainingSeconds.toString().padStart(2, '0')}`;
     };
 
+    const isFinal = (state) => ['done', 'failed', 'unknown'].includes(state.status);
+
+    // Follow a background download job: SSE for live byte progress. The server ends
+    // each stream after a few seconds and EventSource reconnects by itself; the status
+    // endpoint is polled only if the stream is refused.
+    const followDownload = (job) => new Promise((resolve) => {
+        let settled = false;
+        const update = (state) => {
+            if (state.progress != null) setProgress(state.progress);
+            if (isFinal(state) && !settled) {
+                settled = true;
+                resolve(state);
+            }
+        };
+        const source = new EventSource(job.eventsUrl);
+        source.onmessage = (event) => {
+            update(JSON.parse(event.data));
+            if (settled) source.close();
+        };
+        source.onerror = async () => {
+            if (source.readyState !== EventSource.CLOSED) return;
+            while (!settled) {
+                try {
+                    const res = await fetch(job.statusUrl);
+                    update(await res.json());
+                } catch (err) {
+                    update({ status: 'failed' });
+                }
+                if (!settled) await new Promise(r => setTimeout(r, 1000));
+            }
+        };
+    });
+
+    const downloadTwitter = async (youtubeError) => {
+        const response = await fetch(`/download_twitter?url=${encodeURIComponent(videoInfo.url)}&download_id=${videoInfo.download_id}`);
+        if (!response.ok) {
+            const errorText = (youtubeError || '') + await response.text();
+            if (errorText.includes('Sign in to confirm you’re not a bot')) {
+                setError('YouTube requires authentication for this video. Please follow the instructions to export your cookies and upload them. See https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp');
+            } else {
+                setError('Download failed. Try again or check the video URL.');
+            }
+            return;
+        }
+        window.location.href = `/download_twitter?url=${encodeURIComponent(videoInfo.url)}&download_id=${videoInfo.download_id}`;
+    };
+
     const handleDownload = async () => {
         try {
             setDownloading(true);
             setError(null);
-            // Try YouTube, then X/Twitter, fallback to error
-            let response = await fetch(`/download_youtube?url=${encodeURIComponent(videoInfo.url)}&download_id=${videoInfo.download_id}`);
-            if (!response.ok) {
-                response = await fetch(`/download_twitter?url=${encodeURIComponent(videoInfo.url)}&download_id=${videoInfo.download_id}`);
-                if (!response.ok) {
-                    const errorText = await response.text();
-                    if (errorText.includes('Sign in to confirm you’re not a bot')) {
-                        setError('YouTube requires authentication for this video. Please follow the instructions to export your cookies and upload them. See https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp');
-                    } else {
-                        setError('Download failed. Try again or check the video URL.');
-                    }
-                    setDownloading(false);
-                    return;
-                }
-            }
-            // Check for missing output file
-            const contentType = response.headers.get('Content-Type');
-            if (contentType && contentType.includes('application/json')) {
-                const data = await response.json();
-                if (data.missingOutput) {
+            setProgress(0);
+            // Start a YouTube download job; fall back to X/Twitter if it can't be fetched
+            const response = await fetch(`/download_youtube?url=${encodeURIComponent(videoInfo.url)}&download_id=${videoInfo.download_id}`);
+            const job = await response.json().catch(() => ({}));
+            const result = response.ok ? await followDownload(job) : job;
+            if (result.status === 'done') {
+                setProgress(100);
+                const file = await fetch(result.fileUrl, { method: 'HEAD' });
+                if (file.status === 404) {
                     showMissingFileError('The output file is missing or was cleaned up. Please re-upload and try again.');
-                    setDownloading(false);
-                    return;
+                } else {
+                    // The browser saves the attachment itself
+                    window.location.href = result.fileUrl;
                 }
-            }
-            const reader = response.body.getReader();
-            const contentLengthHeader = response.headers.get('Content-Length');
-            const contentLength = contentLengthHeader ? +contentLengthHeader : null;
-            let receivedLength = 0;
-            if (!contentLength) {
-                let fake = 10;
-                const fakeInterval = setInterval(() => {
-                    fake = Math.min(90, fake + Math.random() * 15);
-                    setProgress(Math.round(fake));
-                }, 600);
-                while(true) {
-                    const {done, value} = await reader.read();
-                    if (done) break;
-                }
-                clearInterval(fakeInterval);
-                setProgress(100);
             } else {
-                while(true) {
-                    const {done, value} = await reader.read();
-                    if (done) break;
-                    receivedLength += value.length;
-                    setProgress(Math.round((receivedLength / contentLength) * 100));
-                }
+                await downloadTwitter(result.error);
             }
             setDownloading(false);
             setProgress(0);
@@ -0,0 +1,198 @@
+import os
+import subprocess
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import segmented_download
+
+# Fragmented MP4 can be written to a pipe: ffmpeg emits an empty moov up front and then
+# self-contained fragments, so nothing has to be seeked back to and patched afterwards.
+FRAGMENTED_MP4_FLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+
+# ffmpeg output options per audio-only container. Every audio packet is a keyframe, so
+# m4a is fragmented by duration (2 s) rather than per keyframe; Ogg and WebM stream as-is.
+AUDIO_CONTAINERS = {
+    'm4a': ['-movflags', 'empty_moov+default_base_moof', '-frag_duration', '2000000', '-f', 'ipod'],
+    'opus': ['-f', 'opus'],
+    'webm': ['-f', 'webm'],
+}
+AUDIO_MIMETYPES = {'m4a': 'audio/mp4', 'opus': 'audio/ogg', 'webm': 'audio/webm'}
+# How long ffmpeg gets to exit after closing its output before it is killed
+EXIT_TIMEOUT = 10
+
+
+def audio_container(acodec: Optional[str]) -> str:
+    """Container an audio codec can be stream-copied into: Opus to .opus, Vorbis to .webm, the rest (AAC...) to .m4a."""
+    acodec = (acodec or '').lower()
+    if acodec.startswith('opus'):
+        return 'opus'
+    if acodec.startswith('vorbis'):
+        return 'webm'
+    return 'm4a'
+
+
+class MergeBusy(Exception):
+    """All ffmpeg slots are taken; the caller should ask the client to retry."""
+
+
+class MergeFailed(Exception):
+    """ffmpeg produced no output (bad stream URL, unsupported codec, ffmpeg missing...)."""
+
+
+class StreamMerger:
+    """Mux a separate video and audio stream into one MP4 while both are still downloading.
+
+    Both upstream URLs are fetched concurrently, each over several ranged connections
+    (segmented_download), by feeder threads that write into OS pipes ffmpeg reads as
+    extra file descriptors. ffmpeg copies the codecs (no re-encode) into fragmented MP4
+    on stdout, and the caller streams that straight to the client, so the first bytes
+    go out within seconds and nothing touches the disk.
+    At most max_processes merges run at once; further requests are refused with MergeBusy.
+    """
+
+    def __init__(self, max_processes: int = 2, chunk_size: int = 256 * 1024,
+                 fetch: Callable[[str], Iterable[bytes]] = segmented_download.iter_ranges,
+                 ffmpeg: str = 'ffmpeg'):
+        self.chunk_size = chunk_size
+        self.ffmpeg = ffmpeg
+        self._fetch = fetch
+        self._slots = threading.BoundedSemaphore(max_processes)
+
+    def merge(self, video_url: str, audio_url: str) -> '_MergeOutput':
+        """Start the merge and return an iterable over the MP4 bytes.
+
+        Blocks until ffmpeg has written its first bytes, so failures surface as
+        MergeFailed before the caller commits to a 200 response.
+        """
+        return self._run({'video': video_url, 'audio': audio_url},
+                         ['-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+                          '-movflags', FRAGMENTED_MP4_FLAGS, '-f', 'mp4'])
+
+    def extract_audio(self, audio_url: str, container: str) -> '_MergeOutput':
+        """Remux an audio-only stream into container ('m4a', 'opus' or 'webm') without re-encoding.
+
+        Same slots and failure behaviour as merge(); one input, so far less data and CPU.
+        """
+        if container not in AUDIO_CONTAINERS:
+            raise ValueError(f'Unsupported audio container: {container}')
+        return self._run({'audio': audio_url}, ['-map', '0:a:0', '-c', 'copy'] + AUDIO_CONTAINERS[container])
+
+    def _run(self, inputs: Dict[str, str], output_args: List[str]) -> '_MergeOutput':
+        if not self._slots.acquire(blocking=False):
+            raise MergeBusy('Too many merges in progress')
+        try:
+            proc, feeders, errors = self._start(inputs, output_args)
+        except Exception:
+            self._slots.release()
+            raise
+        first = proc.stdout.read1(self.chunk_size) if proc.stdout else b''
+        if not first:
+            detail = self._finish(proc, feeders, errors, at_eof=True)
+            raise MergeFailed(detail or 'ffmpeg produced no output')
+        return _MergeOutput(self, proc, feeders, errors, first)
+
+    def _start(self, inputs: Dict[str, str], output_args: List[str]):
+        pipes = [os.pipe() for _ in inputs]
+        read_fds = [read_fd for read_fd, _ in pipes]
+        input_args = [arg for read_fd in read_fds for arg in ('-i', f'pipe:{read_fd}')]
+        try:
+            proc = subprocess.Popen(
+                [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin'] + input_args + output_args + ['pipe:1'],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                pass_fds=read_fds)
+        except Exception:
+            for fd in (fd for pair in pipes for fd in pair):
+                os.close(fd)
+            raise
+        # ffmpeg holds its own copies of the read ends
+        for read_fd in read_fds:
+            os.close(read_fd)
+
+        errors: List[str] = []
+        feeders = [threading.Thread(target=self._feed, args=(url, write_fd, errors), daemon=True, name=f'merge_{kind}')
+                   for (kind, url), (_, write_fd) in zip(inputs.items(), pipes)]
+        for feeder in feeders:
+            feeder.start()
+        return proc, feeders, errors
+
+    def _feed(self, url: str, fd: int, errors: List[str]) -> None:
+        """Copy one upstream stream into ffmpeg's input pipe; closing it signals EOF."""
+        chunks = None
+        try:
+            with os.fdopen(fd, 'wb') as pipe:
+                chunks = self._fetch(url)
+                for chunk in chunks:
+                    pipe.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg exited (finished, failed or the client went away)
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def _finish(self, proc, feeders, errors, at_eof: bool = False) -> Optional[str]:
+        """Reap ffmpeg and release the slot. Returns an error summary.
+
+        At EOF of its output ffmpeg is finishing up, so it gets EXIT_TIMEOUT to exit with
+        its own status; a consumer that stops early (client gone) kills it outright.
+        """
+        try:
+            if at_eof:
+                try:
+                    proc.wait(timeout=EXIT_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    pass
+            if proc.poll() is None:
+                proc.kill()
+            _, stderr = proc.communicate(timeout=10)
+            for feeder in feeders:
+                feeder.join(timeout=5)
+            detail = '; '.join(errors)
+            stderr_text = (stderr or b'').decode('utf-8', errors='ignore').strip()
+            if stderr_text:
+                detail = f"{detail}; {stderr_text}" if detail else stderr_text
+            return detail
+        finally:
+            self._slots.release()
+
+
+class _MergeOutput:
+    """The muxed bytes of one merge. close() stops ffmpeg even if iteration never began
+    (the WSGI server calls it when the client disconnects or the response ends)."""
+
+    def __init__(self, merger: StreamMerger, proc, feeders, errors, first: bytes):
+        self._merger = merger
+        self._proc = proc
+        self._feeders = feeders
+        self._errors = errors
+        self._first = first
+        self._closed = False
+        self._eof = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            if self._first:
+                first, self._first = self._first, b''
+                yield first
+            while not self._closed:
+                chunk = self._proc.stdout.read1(self._merger.chunk_size)
+                if not chunk:
+                    self._eof = True
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    @property
+    def succeeded(self) -> bool:
+        """True once the merge has finished and ffmpeg exited cleanly."""
+        return self._closed and self._proc.returncode == 0
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        detail = self._merger._finish(self._proc, self._feeders, self._errors, at_eof=self._eof)
+        if self._proc.returncode not in (0, None) and detail:
+            print(f"\033[33m⚠️\033[0m Streaming merge ended early: {detail}")
@@ -0,0 +1,142 @@
+"""Shared HTTP connection pool for fetching upstream media (googlevideo, twimg, CDNs).
+
+One requests.Session per process keeps TLS connections to media hosts warm across
+proxied downloads and merges. Every request has connect/read timeouts (overridable
+per host), and bodies are read in chunks sized to how fast the upstream is actually
+delivering. Requests are GETs, so connection errors, timeouts and 502/503/504 are
+retried with jittered backoff; a per-host circuit breaker (host_health) makes calls
+to a host that keeps failing fail fast instead of tying up worker threads.
+"""
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from host_health import CircuitOpen, HostHealth
+
+CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 60))
+POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 32))
+RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 2))
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (502, 503, 504)
+# Socket timeout handed to yt-dlp for extraction and downloads
+EXTRACTOR_TIMEOUT = float(os.environ.get('UPSTREAM_EXTRACTOR_TIMEOUT', 20))
+
+
+def _parse_host_timeouts(spec: str) -> Dict[str, Tuple[float, float]]:
+    """'googlevideo.com=5:30,twimg.com=5:20' -> {'googlevideo.com': (5.0, 30.0), ...}"""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        host, _, value = item.partition('=')
+        connect, _, read = value.partition(':')
+        timeouts[host.strip().lower()] = (float(connect), float(read or connect))
+    return timeouts
+
+HOST_TIMEOUTS = _parse_host_timeouts(os.environ.get('UPSTREAM_HOST_TIMEOUTS', ''))
+
+health = HostHealth(failure_threshold=int(os.environ.get('UPSTREAM_BREAKER_FAILURES', 5)),
+                    cooldown=float(os.environ.get('UPSTREAM_BREAKER_COOLDOWN', 30)))
+
+MIN_CHUNK = 16 * 1024
+START_CHUNK = 64 * 1024
+MAX_CHUNK = 1024 * 1024
+
+_lock = threading.Lock()
+_session = None
+
+
+def session():
+    """The process-wide requests.Session (created on first use)."""
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            s = requests.Session()
+            # No retries in the adapter: open_stream retries GETs itself (connection errors, timeouts
+            # and RETRY_STATUSES, up to RETRIES times with jittered backoff), before any body byte is
+            # read; other callers of the session get exactly one attempt
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_SIZE, max_retries=0)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            _session = s
+        return _session
+
+
+def host_timeout(host: str) -> Tuple[float, float]:
+    """(connect, read) timeout for host: the longest matching UPSTREAM_HOST_TIMEOUTS suffix, else the defaults."""
+    host = host.lower()
+    for suffix in sorted(HOST_TIMEOUTS, key=len, reverse=True):
+        if host == suffix or host.endswith('.' + suffix):
+            return HOST_TIMEOUTS[suffix]
+    return CONNECT_TIMEOUT, READ_TIMEOUT
+
+
+def open_stream(url: str, headers: Optional[Dict[str, str]] = None, timeout=None, retries: int = RETRIES):
+    """Start a streamed GET on the shared pool. The caller must close() the response.
+
+    Asks for the identity encoding, so Content-Length and Content-Range describe the
+    bytes we relay and ranges line up with the client's view of the file. Connection
+    errors, timeouts and RETRY_STATUSES responses are retried up to `retries` times
+    with full-jitter exponential backoff; a GET is safe to replay because nothing has
+    been relayed yet. Raises CircuitOpen without a network call while the host's
+    breaker is open.
+    """
+    from requests import ConnectionError as RequestsConnectionError, Timeout
+    request_headers = {'Accept-Encoding': 'identity'}
+    request_headers.update(headers or {})
+    host = urlsplit(url).hostname or ''
+    for attempt in range(retries + 1):
+        health.before(host)
+        started = time.monotonic()
+        try:
+            response = session().get(url, headers=request_headers, stream=True,
+                                     timeout=timeout or host_timeout(host))
+        except (RequestsConnectionError, Timeout) as e:
+            health.record(host, None, ok=False, error=type(e).__name__)
+            if attempt == retries:
+                raise
+        except Exception as e:
+            health.record(host, None, ok=False, error=type(e).__name__)
+            raise
+        else:
+            ok = response.status_code < 500
+            health.record(host, time.monotonic() - started, ok=ok, error=None if ok else f'HTTP {response.status_code}')
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                response.host = host
+                return response
+            response.close()
+        # Full jitter, so clients retrying one stalled host don't all come back together
+        time.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
+
+
+def iter_adaptive(response, min_chunk: int = MIN_CHUNK, start_chunk: int = START_CHUNK,
+                  max_chunk: int = MAX_CHUNK) -> Iterator[bytes]:
+    """Yield a streamed response body in chunks that track the upstream's throughput.
+
+    A chunk that fills almost instantly doubles the next read (fewer, larger writes for
+    fast CDNs); one that takes a long time halves it, so a slow upstream still trickles
+    bytes to the client instead of stalling behind a large buffer.
+    """
+    size = start_chunk
+    raw = response.raw
+    while True:
+        started = time.monotonic()
+        try:
+            chunk = raw.read(size, decode_content=True)
+        except Exception as e:
+            # A stall or reset mid-body counts against the host like a failed request
+            health.record(getattr(response, 'host', urlsplit(response.url).hostname or ''), None,
+                          ok=False, error=type(e).__name__)
+            raise
+        if not chunk:
+            return
+        elapsed = time.monotonic() - started
+        yield chunk
+        if len(chunk) == size and elapsed < 0.05:
+            size = min(size * 2, max_chunk)
+        elif elapsed > 0.5:
+            size = max(size // 2, min_chunk)
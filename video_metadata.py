@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit, urlunsplit
+
+from single_flight import SingleFlight
+
+# (platform, hosts, pattern) triples. A pattern is matched against the path and query
+# of URLs on one of its hosts (or their subdomains) only; the first group is the video id.
+_VIDEO_ID_PATTERNS = [
+    ('youtube', ('youtube.com', 'youtube-nocookie.com'),
+     re.compile(r'/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)([0-9A-Za-z_-]{11})')),
+    ('youtube', ('youtu.be',), re.compile(r'/([0-9A-Za-z_-]{11})')),
+    ('twitter', ('twitter.com', 'x.com'), re.compile(r'/(?:[^/]+|i/web)/status(?:es)?/(\d+)')),
+    ('instagram', ('instagram.com',), re.compile(r'/(?:[^/]+/)?(?:p|reels?|tv)/([\w-]+)')),
+    ('tiktok', ('tiktok.com',), re.compile(r'/@[^/]+/video/(\d+)')),
+    ('vimeo', ('vimeo.com',), re.compile(r'/(?:video/)?(\d+)')),
+]
+# Query parameters that never change which video a URL points to
+_TRACKING_PARAMS = re.compile(r'^(utm_\w+|si|feature|ref|ref_src|s|t|igshid|fbclid)$')
+
+
+def video_cache_key(url: str) -> str:
+    """Normalize a video URL to 'platform:video_id', so share links, embeds and
+    tracking-parameter variants of the same video share one cache entry.
+    Other hosts fall back to the URL without fragment or tracking parameters: the key
+    is shared by every user, so only the platform's own host may claim its ids."""
+    url = url.strip()
+    parts = urlsplit(url if '//' in url else '//' + url)
+    host = (parts.hostname or '').lower()
+    if parts.scheme in ('', 'http', 'https'):
+        target = parts.path + ('?' + parts.query if parts.query else '')
+        for platform, hosts, pattern in _VIDEO_ID_PATTERNS:
+            if any(host == h or host.endswith('.' + h) for h in hosts):
+                match = pattern.match(target)
+                if match:
+                    return f"{platform}:{match.group(1)}"
+    parts = urlsplit(url)
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if not _TRACKING_PARAMS.match(k)))
+    return 'url:' + urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
+
+def signed_url_expiry(urls: Iterable[Optional[str]]) -> Optional[float]:
+    """Earliest `expire=` timestamp among signed media URLs (as used by googlevideo), if any."""
+    earliest = None
+    for url in urls:
+        if not url or 'expire' not in url:
+            continue
+        try:
+            expire = float(parse_qs(urlsplit(url).query)['expire'][0])
+        except (KeyError, ValueError, IndexError):
+            continue
+        earliest = expire if earliest is None else min(earliest, expire)
+    return earliest
+
+
+def media_url_key(url: str) -> Optional[str]:
+    """Stable identity of a signed googlevideo URL across re-signings ('googlevideo:<id>.<itag>').
+
+    None for any other host: the key decides whose bytes are stored and served to
+    everyone asking for that video, so it must only come from a source we trust to
+    serve that id and itag.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if parts.scheme != 'https' or not (host == 'googlevideo.com' or host.endswith('.googlevideo.com')):
+        return None
+    query = parse_qs(parts.query)
+    if 'id' not in query or 'itag' not in query:
+        return None
+    return f"googlevideo:{query['id'][0]}.{query['itag'][0]}"
+
+
+class MetadataCache:
+    """TTL + LRU cache of processed video metadata with single-flight loading.
+
+    Entries live for ttl seconds, but never past expiry_margin seconds before the
+    earliest signed media URL they contain expires, so a hit never hands out a
+    dead download link. Concurrent misses for one key share a single extraction.
+    """
+
+    def __init__(self, ttl: float = 900, max_entries: int = 512, expiry_margin: float = 300,
+                 signed_urls: Callable[[Dict[str, Any]], Iterable[Optional[str]]] = lambda payload: ()):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.expiry_margin = expiry_margin
+        self._signed_urls = signed_urls
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, key: str, payload: Dict[str, Any]) -> None:
+        expires_at = time.time() + self.ttl
+        signed_expiry = signed_url_expiry(self._signed_urls(payload))
+        if signed_expiry is not None:
+            expires_at = min(expires_at, signed_expiry - self.expiry_margin)
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[Dict[str, Any]]]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Return (payload, cached). A None payload from loader is returned but not cached."""
+        payload = self.get(key)
+        if payload is not None:
+            self.hits += 1
+            return payload, True
+
+        def load():
+            # Re-check: the previous flight may have filled the entry just before we got here
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            self.misses += 1
+            fresh = loader()
+            if fresh is not None:
+                self.put(key, fresh)
+            return fresh
+
+        return self._flight.do(key, load), False
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
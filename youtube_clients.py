@@ -0,0 +1,140 @@
+"""Process-wide pools shared by the YouTube downloader classes.
+
+- YouTube Data API clients are built once from the discovery document bundled with
+  google-api-python-client (no discovery fetch) and checked out per call. Each client
+  keeps its own httplib2 connection, so repeat calls reuse a warm TLS connection.
+  Clients are not thread-safe, hence the checkout/return pool rather than one global.
+- pytube YouTube objects are cached per video id for a few minutes, so the preview and
+  download steps for the same video share the parsed watch page and stream list.
+"""
+import json
+import math
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from video_metadata import MetadataCache
+
+API_TIMEOUT = float(os.environ.get('YOUTUBE_API_TIMEOUT', 10))
+_MAX_IDLE_CLIENTS = 8
+# videos.list accepts at most 50 ids per call
+API_BATCH_SIZE = 50
+FALLBACK_WORKERS = int(os.environ.get('YOUTUBE_FALLBACK_WORKERS', 4))
+# Seconds a batch preview allows per round of FALLBACK_WORKERS lookups (one lookup per
+# worker); lookups unfinished when all rounds are up are reported as timed out
+FALLBACK_DEADLINE = float(os.environ.get('YOUTUBE_FALLBACK_DEADLINE', 20))
+# Never longer than this in total, so the request ends well inside the server's timeout
+FALLBACK_MAX_WAIT = 90
+
+
+def fallback_deadline(lookups: int) -> float:
+    """Seconds to wait for `lookups` fallback lookups sharing the pool's FALLBACK_WORKERS threads."""
+    return min(FALLBACK_MAX_WAIT, FALLBACK_DEADLINE * max(1, math.ceil(lookups / FALLBACK_WORKERS)))
+
+_lock = threading.Lock()
+_discovery_doc: Optional[Dict[str, Any]] = None
+_idle_clients: Dict[str, 'queue.LifoQueue'] = {}
+_fallback_executor: Optional[ThreadPoolExecutor] = None
+
+# Signed stream URLs inside a YouTube object stay valid for hours; keep them well short of that
+pytube_videos = MetadataCache(ttl=600, max_entries=128)
+# videos.list results, so a download right after a preview doesn't repeat the API call
+api_video_info = MetadataCache(ttl=600, max_entries=2048)
+
+
+def _youtube_discovery_doc() -> Dict[str, Any]:
+    global _discovery_doc
+    if _discovery_doc is None:
+        from googleapiclient.discovery_cache import get_static_doc
+        doc = get_static_doc('youtube', 'v3')
+        if doc is None:
+            raise RuntimeError('google-api-python-client has no bundled YouTube v3 discovery document')
+        _discovery_doc = json.loads(doc)
+    return _discovery_doc
+
+
+def _build_client(api_key: str):
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(_youtube_discovery_doc(), developerKey=api_key,
+                               http=httplib2.Http(timeout=API_TIMEOUT))
+
+
+@contextmanager
+def youtube_api(api_key: str):
+    """Check out a YouTube Data API client for api_key, building one only if none is idle."""
+    with _lock:
+        idle = _idle_clients.setdefault(api_key, queue.LifoQueue())
+    try:
+        client = idle.get_nowait()
+    except queue.Empty:
+        client = _build_client(api_key)
+    yield client
+    # Only reached when the call succeeded; a client whose call raised may hold a broken connection
+    if idle.qsize() < _MAX_IDLE_CLIENTS:
+        idle.put(client)
+
+
+def pytube_video(video_id: str):
+    """Shared pytube YouTube object for video_id (created on first use, then cached)."""
+    def load():
+        from pytube import YouTube
+        return YouTube(f'https://www.youtube.com/watch?v={video_id}')
+    video, _ = pytube_videos.get_or_load(video_id, load)
+    return video
+
+
+def api_video_items(api_key: str, video_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """videos.list items for many ids, asking the API for up to 50 uncached ids per request.
+
+    Ids the API doesn't return (private, deleted, malformed) are absent from the result.
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    missing = []
+    for video_id in dict.fromkeys(video_ids):
+        item = api_video_info.get(video_id)
+        if item is not None:
+            found[video_id] = item
+        else:
+            missing.append(video_id)
+    for start in range(0, len(missing), API_BATCH_SIZE):
+        batch = missing[start:start + API_BATCH_SIZE]
+        with youtube_api(api_key) as api:
+            response = api.videos().list(part='snippet,contentDetails', id=','.join(batch),
+                                         maxResults=API_BATCH_SIZE).execute()
+        for item in response.get('items') or []:
+            api_video_info.put(item['id'], item)
+            found[item['id']] = item
+    return found
+
+
+def fallback_executor() -> ThreadPoolExecutor:
+    """Bounded pool for per-video pytube/yt-dlp lookups, shared by all requests in the process."""
+    global _fallback_executor
+    with _lock:
+        if _fallback_executor is None:
+            _fallback_executor = ThreadPoolExecutor(max_workers=FALLBACK_WORKERS, thread_name_prefix='yt_fallback')
+        return _fallback_executor
+
+
+def api_video_item(api_key: str, video_id: str) -> Optional[Dict[str, Any]]:
+    """The videos.list item (snippet and contentDetails) for video_id, or None if not found."""
+    def load():
+        with youtube_api(api_key) as api:
+            response = api.videos().list(part='snippet,contentDetails', id=video_id).execute()
+        items = response.get('items') or []
+        return items[0] if items else None
+    item, _ = api_video_info.get_or_load(video_id, load)
+    return item
+
+
+def best_thumbnail(snippet: Dict[str, Any]) -> Optional[str]:
+    """URL of the largest thumbnail in a snippet; not every video has a 'maxres' one."""
+    thumbnails = snippet.get('thumbnails') or {}
+    for size in ('maxres', 'standard', 'high', 'medium', 'default'):
+        if thumbnails.get(size, {}).get('url'):
+            return thumbnails[size]['url']
+    return None
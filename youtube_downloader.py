@@ -1,24 +1,19 @@
 try:
-    from googleapiclient.discovery import build
-    from google.oauth2 import service_account
+    import googleapiclient.discovery
     _HAS_GOOGLE_API = True
 except Exception:
-    build = None
     _HAS_GOOGLE_API = False
 import os
 import json
-from pytube import YouTube
+
+import youtube_clients
 
 class YouTubeDownloader:
     def __init__(self, api_key=None):
         self.api_key = api_key or os.getenv('YOUTUBE_API_KEY')
-        # Initialize YouTube Data API client only if the library is available and api_key provided
-        self.youtube = None
-        if _HAS_GOOGLE_API and self.api_key:
-            try:
-                self.youtube = build('youtube', 'v3', developerKey=self.api_key)
-            except Exception:
-                self.youtube = None
+        # Use the YouTube Data API only if the library is available and api_key provided;
+        # clients are pooled process-wide in youtube_clients
+        self.use_api = bool(_HAS_GOOGLE_API and self.api_key)
     
     def get_video_info(self, video_url):
         """Get video information using YouTube Data API."""
@@ -26,27 +21,21 @@ class YouTubeDownloader:
         if not video_id:
             return None
         # Prefer YouTube Data API if available
-        if self.youtube:
+        if self.use_api:
             try:
-                request = self.youtube.videos().list(
-                    part="snippet,contentDetails",
-                    id=video_id
-                )
-                response = request.execute()
-                if response.get('items'):
-                    video_data = response['items'][0]
-                    thumb = video_data['snippet']['thumbnails'].get('maxres', {}) or video_data['snippet']['thumbnails'].get('high', {})
+                video_data = youtube_clients.api_video_item(self.api_key, video_id)
+                if video_data:
                     return {
                         'id': video_id,
                         'title': video_data['snippet']['title'],
-                        'thumbnail': thumb.get('url'),
+                        'thumbnail': youtube_clients.best_thumbnail(video_data['snippet']),
                         'duration': video_data['contentDetails']['duration']
                     }
             except Exception as e:
                 print(f"Error fetching video info via API: {e}")
         # Fallback to pytube for metadata
         try:
-            yt = YouTube(f'https://www.youtube.com/watch?v={video_id}')
+            yt = youtube_clients.pytube_video(video_id)
             return {
                 'id': video_id,
                 'title': yt.title,
@@ -74,9 +63,8 @@ class YouTubeDownloader:
 
     def get_download_url(self, video_id, quality='high'):
         """Get direct download URL using pytube (fallback for actual download)."""
-        from pytube import YouTube
         try:
-            yt = YouTube(f'https://www.youtube.com/watch?v={video_id}')
+            yt = youtube_clients.pytube_video(video_id)
             if quality == 'high':
                 stream = yt.streams.get_highest_resolution()
             else: